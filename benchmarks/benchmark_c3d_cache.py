@@ -0,0 +1,94 @@
+"""
+This benchmark measures the time spent reading the data of a trial from its c3d file (ezc3d parsing, including the
+force platform extraction) and from the cache of C3dCache (hash of the c3d file and memory-mapped arrays).
+The c3d file mimics a 60 s treadmill trial (60 markers at 100 Hz, 16 analogs and 2 force platforms at 1 kHz).
+"""
+
+import os
+import tempfile
+import time
+
+import ezc3d
+import numpy as np
+
+from gait_analyzer.utils.c3d_cache import C3dCache
+
+
+def write_c3d(c3d_full_file_path: str, duration: float = 60, nb_markers: int = 60, nb_analogs: int = 16):
+    marker_rate = 100
+    analog_rate = 1000
+    nb_marker_frames = int(duration * marker_rate)
+    rng = np.random.default_rng(0)
+
+    c3d = ezc3d.c3d()
+    c3d["parameters"]["POINT"]["RATE"]["value"] = [marker_rate]
+    c3d["parameters"]["POINT"]["LABELS"]["value"] = [f"marker_{i_marker}" for i_marker in range(nb_markers)]
+    c3d["parameters"]["POINT"]["UNITS"]["value"] = ["mm"]
+    c3d["parameters"]["ANALOG"]["RATE"]["value"] = [analog_rate]
+    c3d["parameters"]["ANALOG"]["LABELS"]["value"] = [f"analog_{i_analog}" for i_analog in range(nb_analogs)]
+    c3d["parameters"]["ANALOG"]["UNITS"]["value"] = ["N"] * 12 + ["V"] * (nb_analogs - 12)
+    points = np.ones((4, nb_markers, nb_marker_frames))
+    points[:3, :, :] = rng.uniform(0, 1000, (3, nb_markers, nb_marker_frames))
+    c3d["data"]["points"] = points
+    analogs = rng.uniform(0, 1, (1, nb_analogs, nb_marker_frames * analog_rate // marker_rate))
+    analogs[0, [2, 8], :] += 700  # The vertical force of each platform
+    c3d["data"]["analogs"] = analogs
+
+    # Two force platforms of type 2 (6 channels each)
+    for name, value in [
+        ("USED", np.array([2])),
+        ("TYPE", np.array([2, 2])),
+        ("CHANNEL", np.arange(1, 13).reshape(2, 6).T),
+    ]:
+        c3d.add_parameter("FORCE_PLATFORM", name, value.astype(float))
+        c3d["parameters"]["FORCE_PLATFORM"][name]["type"] = ezc3d.ezc3d.INT
+    corners = np.zeros((3, 4, 2))
+    corners[:2, :, 0] = [[0, 600, 600, 0], [0, 0, 400, 400]]
+    corners[:2, :, 1] = corners[:2, :, 0] + np.array([[600], [0]])
+    c3d.add_parameter("FORCE_PLATFORM", "CORNERS", corners)
+    c3d.add_parameter("FORCE_PLATFORM", "ORIGIN", np.zeros((3, 2)))
+    c3d.write(c3d_full_file_path)
+
+
+def timeit(function, nb_repeats: int = 5):
+    times = []
+    for _ in range(nb_repeats):
+        tic = time.perf_counter()
+        output = function()
+        times += [time.perf_counter() - tic]
+    return output, np.median(times)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        c3d_full_file_path = os.path.join(folder, "trial.c3d")
+        cache_folder = os.path.join(folder, "c3d_cache")
+        write_c3d(c3d_full_file_path)
+
+        parsed_data, parse_time = timeit(lambda: C3dCache.load(c3d_full_file_path, None))
+
+        tic = time.perf_counter()
+        C3dCache.load(c3d_full_file_path, cache_folder)
+        first_load_time = time.perf_counter() - tic
+
+        # The arrays are summed so that the memory-mapped data are actually read
+        cached_data, cached_load_time = timeit(
+            lambda: {
+                key: np.sum(value)
+                for key, value in C3dCache.load(c3d_full_file_path, cache_folder).items()
+                if isinstance(value, np.ndarray)
+            }
+        )
+        for key, value in cached_data.items():
+            np.testing.assert_almost_equal(value, np.sum(parsed_data[key]))
+
+    print(f"Parsing the c3d file with ezc3d: {parse_time * 1000:.1f} ms")
+    print(f"First load with the cache (parsing and saving the arrays): {first_load_time * 1000:.1f} ms")
+    print(
+        f"Next loads from the cache (hash of the c3d file and reading all the arrays): {cached_load_time * 1000:.1f} ms"
+    )
+    print(f"Speedup: {parse_time / cached_load_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
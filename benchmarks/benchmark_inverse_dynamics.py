@@ -0,0 +1,69 @@
+"""
+This benchmark compares the batched inverse dynamics (symbolic function of the model mapped over all frames) with the
+frame by frame evaluation of biorbd, for trials of different lengths.
+The kinematics and the external forces are random, only the computation time and the difference between the two
+evaluations are of interest.
+Usage: python benchmark_inverse_dynamics.py path/to/model.bioMod
+"""
+
+import sys
+import time
+
+import numpy as np
+import biorbd
+
+from gait_analyzer.inverse_dynamics_performer import InverseDynamicsPerformer
+from gait_analyzer.utils.batched_dynamics import BatchedDynamics
+from gait_analyzer.utils.stage_cache import StageCache
+
+
+def loop_inverse_dynamics(model: biorbd.Model, q: np.ndarray, qdot: np.ndarray, qddot: np.ndarray, f_ext: np.ndarray):
+    tau = np.zeros_like(q)
+    for i_node in range(q.shape[1]):
+        f_ext_set = model.externalForceSet()
+        for i_platform, segment_name in enumerate(InverseDynamicsPerformer.platform_segment_names):
+            f_ext_set.add(segment_name, f_ext[i_platform, 3:9, i_node], f_ext[i_platform, :3, i_node])
+        tau[:, i_node] = model.InverseDynamics(q[:, i_node], qdot[:, i_node], qddot[:, i_node], f_ext_set).to_array()
+    return tau
+
+
+def main(biorbd_model_full_path: str, trial_lengths: tuple[int, ...] = (1000, 10_000, 60_000), nb_threads: int = 4):
+    rng = np.random.default_rng(0)
+    model = biorbd.Model(biorbd_model_full_path)
+    nb_platforms = len(InverseDynamicsPerformer.platform_segment_names)
+
+    tic = time.perf_counter()
+    inverse_dynamics = BatchedDynamics.get_inverse_dynamics_function(
+        biorbd_model_full_path,
+        StageCache.hash_file(biorbd_model_full_path),
+        InverseDynamicsPerformer.platform_segment_names,
+    )
+    print(f"Symbolic function built in {(time.perf_counter() - tic) * 1000:.1f} ms (once per model)")
+
+    for nb_frames in trial_lengths:
+        q = rng.uniform(-0.5, 0.5, (model.nbQ(), nb_frames))
+        qdot = rng.uniform(-1, 1, (model.nbQ(), nb_frames))
+        qddot = rng.uniform(-5, 5, (model.nbQ(), nb_frames))
+        f_ext = rng.uniform(-100, 100, (nb_platforms, 9, nb_frames))
+
+        tic = time.perf_counter()
+        reference = loop_inverse_dynamics(model, q, qdot, qddot, f_ext)
+        loop_time = time.perf_counter() - tic
+
+        tic = time.perf_counter()
+        batched = BatchedDynamics.evaluate(inverse_dynamics, 1, q, qdot, qddot, f_ext.reshape(-1, nb_frames))
+        batched_time = time.perf_counter() - tic
+
+        tic = time.perf_counter()
+        threaded = BatchedDynamics.evaluate(inverse_dynamics, nb_threads, q, qdot, qddot, f_ext.reshape(-1, nb_frames))
+        threaded_time = time.perf_counter() - tic
+
+        print(
+            f"{nb_frames} frames: loop {loop_time:.3f} s, batched {batched_time:.3f} s (x{loop_time / batched_time:.1f}), "
+            f"batched with {nb_threads} threads {threaded_time:.3f} s (x{loop_time / threaded_time:.1f}), "
+            f"max difference {np.max(np.abs(reference - batched)):.2e} / {np.max(np.abs(reference - threaded)):.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
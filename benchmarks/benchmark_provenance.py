@@ -0,0 +1,28 @@
+"""
+This benchmark measures the time spent collecting the provenance information (versions of the code and of the
+packages) that is saved with the results of each trial.
+The first call collects the versions, the following calls (one per trial) reuse them.
+"""
+
+import time
+
+from gait_analyzer.utils.provenance import Provenance
+
+
+def main(nb_trials: int = 100):
+
+    tic = time.perf_counter()
+    Provenance.get_provenance()
+    first_call_time = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    for _ in range(nb_trials):
+        Provenance.get_provenance()
+    per_trial_time = (time.perf_counter() - tic) / nb_trials
+
+    print(f"First call (versions collected): {first_call_time * 1000:.2f} ms")
+    print(f"Following calls (per trial): {per_trial_time * 1000:.4f} ms")
+
+
+if __name__ == "__main__":
+    main()
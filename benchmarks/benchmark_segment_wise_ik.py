@@ -0,0 +1,50 @@
+"""
+This benchmark compares the segment-wise inverse kinematics (Levenberg-Marquardt segment by segment, vectorized over
+the frames) with the global Levenberg-Marquardt of biorbd, for trials of different lengths.
+The markers are generated from random joint angles within the bounds of segment_dict, so the reconstruction error
+should be close to zero for both methods.
+Usage: python benchmark_segment_wise_ik.py path/to/model.bioMod
+"""
+
+import sys
+import time
+
+import numpy as np
+import biorbd
+
+from gait_analyzer.kinematics_reconstructor import KinematicsReconstructor, ReconstructionType, segment_dict
+
+
+def generate_markers(model: biorbd.Model, nb_frames: int, rng: np.random.Generator) -> np.ndarray:
+    q = np.zeros((model.nbQ(), nb_frames))
+    for segment in segment_dict.values():
+        min_bound = np.array(segment["min_bound"])[:, np.newaxis]
+        max_bound = np.array(segment["max_bound"])[:, np.newaxis]
+        q[segment["dof_idx"], :] = min_bound + (max_bound - min_bound) * rng.uniform(0.3, 0.7, (1, nb_frames))
+    markers = np.zeros((3, model.nbMarkers(), nb_frames))
+    for i_frame in range(nb_frames):
+        for i_marker, marker in enumerate(model.markers(q[:, i_frame])):
+            markers[:, i_marker, i_frame] = marker.to_array()
+    return markers
+
+
+def main(biorbd_model_full_path: str, trial_lengths: tuple[int, ...] = (100, 1000, 10_000)):
+    rng = np.random.default_rng(0)
+    model = biorbd.Model(biorbd_model_full_path)
+
+    for nb_frames in trial_lengths:
+        markers = generate_markers(model, nb_frames, rng)
+        for recons_method in [ReconstructionType.ONLY_LM, ReconstructionType.SEGMENT_WISE]:
+            tic = time.perf_counter()
+            _, residuals = KinematicsReconstructor.solve_inverse_kinematics(
+                biorbd_model_full_path, None, recons_method, markers
+            )
+            elapsed_time = time.perf_counter() - tic
+            print(
+                f"{nb_frames} frames, {recons_method.value}: {elapsed_time:.3f} s, "
+                f"median residual {np.nanmedian(residuals) * 1000:.3f} mm, max residual {np.nanmax(residuals) * 1000:.3f} mm"
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
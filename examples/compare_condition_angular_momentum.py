@@ -23,6 +23,7 @@ def analysis_to_perform(
     static_trial: str,
     c3d_file_name: str,
     result_folder: str,
+    reuse_existing_model: bool = False,
 ):
 
     # --- Example of analysis that must be performed in order --- #
@@ -31,6 +32,7 @@ def analysis_to_perform(
         cycles_to_analyze=cycles_to_analyze,
         static_trial=static_trial,
         result_folder=result_folder,
+        reuse_existing_model=reuse_existing_model,
     )
 
     results.create_model(
@@ -18,6 +18,7 @@ def analysis_to_perform(
     static_trial: str,
     c3d_file_name: str,
     result_folder: str,
+    reuse_existing_model: bool = False,
 ):
 
     # # This step is to show the markers and eventually change their labeling manually
@@ -31,6 +32,7 @@ def analysis_to_perform(
         cycles_to_analyze=cycles_to_analyze,
         static_trial=static_trial,
         result_folder=result_folder,
+        reuse_existing_model=reuse_existing_model,
     )
 
     results.create_model(
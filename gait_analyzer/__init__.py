@@ -5,15 +5,23 @@ from .experimental_data import ExperimentalData
 from .events.cyclic_events import CyclicEvents
 from .events.unique_events import UniqueEvents
 from .helper import helper
-from .kinematics_reconstructor import KinematicsReconstructor, ReconstructionType
+from .kinematics_reconstructor import KinematicsReconstructor, ReconstructionType, DerivativeMethod
 from .operator import Operator
+from .time_base import TimeBase
 from .optimal_estimator import OptimalEstimator
+from .multi_cycle_optimal_estimator import MultiCycleOptimalEstimator
 from .statistical_analysis.organized_result import OrganizedResult, LegToPlot, PlotType, EventIndexType
 from .statistical_analysis.stats_utils import QuantityToExtractType, StatsType
 from .statistical_analysis.stats_performer import StatsPerformer
 from .plots.plot_leg_data import PlotLegData, LegToPlot, PlotType, EventIndexType
 from .plots.plot_biomechanics_quantity import PlotBiomechanicsQuantity
 from .utils.marker_labeling_handler import MarkerLabelingHandler
+from .utils.stage_cache import StageCache
+from .utils.provenance import Provenance
+from .utils.result_store import ResultStore, StoredResult
+from .utils.result_writer import ResultWriter
+from .utils.c3d_cache import C3dCache
+from .utils.model_registry import ModelRegistry
 from .result_manager import ResultManager
 from .subject import Subject, Side
 
@@ -1,15 +1,14 @@
 import os
-import pickle
-from scipy.io import savemat
-import git
-from datetime import date
-import subprocess
-import json
+import inspect
+import traceback
+from concurrent.futures import Executor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 import shutil
 import ezc3d
 import numpy as np
 
 from gait_analyzer.subject import Subject
+from gait_analyzer.utils.provenance import Provenance
+from gait_analyzer.utils.result_writer import ResultWriter
 
 
 class AnalysisPerformer:
@@ -21,6 +20,11 @@ class AnalysisPerformer:
         result_folder: str = os.path.dirname(os.path.abspath(__file__)) + "/results/",
         trails_to_analyze: list[str] = None,
         skip_if_existing: bool = False,
+        n_workers: int = 1,
+        executor: Executor = None,
+        save_result_store: bool = False,
+        save_mat: bool = True,
+        write_in_background: bool = False,
         **kwargs,
     ):
         """
@@ -30,6 +34,8 @@ class AnalysisPerformer:
         ----------
         analysis_to_perform: callable(subject_name: str, subject_mass: float, c3d_file_name: str)
             The analysis to perform
+            If it has a reuse_existing_model argument, it is set to True for the trials following the first trial of a
+            subject, and should be passed to the ResultManager so that the subject's model is created only once.
         subjects_to_analyze: list[Subject]
             The list of subjects to analyze
         cycles_to_analyze: range | cycles_to_analyze
@@ -40,6 +46,23 @@ class AnalysisPerformer:
             The list of trails to analyze. If None, all the trails will be analyzed.
         skip_if_existing: bool
             If True, the analysis will not be performed if the results already exist.
+        n_workers: int
+            The number of processes to use to analyze the trials in parallel (one trial per process).
+            If 1, the trials are analyzed sequentially. If > 1, analysis_to_perform must be picklable (i.e., defined at
+            the top level of a module) and the animation/plotting flags should be turned off.
+        executor: Executor
+            The executor to use to analyze the trials in parallel instead of the default ProcessPoolExecutor (e.g., an
+            executor submitting jobs to a cluster). If provided, n_workers is ignored.
+        save_result_store: bool
+            If True, the results are also saved in a columnar format (one memory-mappable .npy file per array, see
+            ResultStore) in the folder [...]_results_arrays, which is then used by OrganizedResult.
+        save_mat: bool
+            If True, the results are also saved in a .mat file. The .mat files can also be created later using
+            ResultWriter.export_mat_files(result_folder).
+        write_in_background: bool
+            If True, the results of a trial are written in a background thread while the next trial is analyzed (the
+            writing errors are then raised when the next results are submitted). When the trials are analyzed in parallel, each
+            worker writes its own results.
         **kwargs: Any
             Any additional arguments to pass to the analysis_to_perform function
         """
@@ -77,6 +100,16 @@ class AnalysisPerformer:
             raise ValueError("result_folder must be a string")
         if not isinstance(trails_to_analyze, list) and trails_to_analyze is not None:
             raise ValueError("trails_to_analyze must be a list of strings")
+        if not isinstance(n_workers, int) or n_workers < 1:
+            raise ValueError("n_workers must be a positive integer")
+        if executor is not None and not isinstance(executor, Executor):
+            raise ValueError("executor must be a concurrent.futures.Executor")
+        if not isinstance(save_result_store, bool):
+            raise ValueError("save_result_store must be a boolean")
+        if not isinstance(save_mat, bool):
+            raise ValueError("save_mat must be a boolean")
+        if not isinstance(write_in_background, bool):
+            raise ValueError("write_in_background must be a boolean")
         if not os.path.exists(result_folder):
             os.makedirs(result_folder)
             print(f"Result folder did not exist, I have created it here {os.path.abspath(result_folder)}")
@@ -88,11 +121,21 @@ class AnalysisPerformer:
         self.result_folder = result_folder
         self.trails_to_analyze = trails_to_analyze
         self.skip_if_existing = skip_if_existing
+        self.n_workers = n_workers
+        self.executor = executor
+        self.save_result_store = save_result_store
+        self.save_mat = save_mat
+        self.write_in_background = write_in_background
         self.kwargs = kwargs
 
         # Extended attributes
         self.figures_result_folder = None
         self.models_result_folder = None
+        self.accepts_reuse_existing_model = "reuse_existing_model" in inspect.signature(analysis_to_perform).parameters
+        self.result_writer = None
+        self.trial_status = {}  # c3d_file_name: "success" or the traceback of the error
+        # Collected once for all the trials (and sent to the workers)
+        self.versions = Provenance.get_versions()
 
         # Run the analysis
         self.check_for_geometry_files()
@@ -103,42 +146,12 @@ class AnalysisPerformer:
         """
         Save the version of the code and the date of the analysis for future reference
         """
-
-        # Packages installed in the env
-        # Running 'conda list' command and parse it as JSON
-        result = subprocess.run(["conda", "list", "--json"], capture_output=True, text=True)
-        packages = json.loads(result.stdout)
-        packages_versions = {elt["name"]: elt["version"] for elt in packages}
-
-        # Get the version of the current package
-        repo = git.Repo(search_parent_directories=True)
-        commit_id = str(repo.commit())
-        branch = str(repo.active_branch)
-        try:
-            tag = repo.git.describe("--tags")
-        except git.exc.GitCommandError:
-            tag = "No tag"
-        gait_analyzer_version = repo.git.version_info
-        git_date = repo.git.log("-1", "--format=%cd")
-        version_dic = {
-            "commit_id": commit_id,
-            "git_date": git_date,
-            "branch": branch,
-            "tag": tag,
-            "gait_analyzer_version": gait_analyzer_version,
-            "date_of_the_analysis": date.today().strftime("%b-%d-%Y-%H-%M-%S"),
-            "biorbd_version": packages_versions["biorbd"],
-            "pyomeca_version": packages_versions["pyomeca"] if "pyomeca" in packages_versions else "Not installed",
-            "ezc3d_version": packages_versions["ezc3d"],
-            "bioptim_version": (
-                packages_versions["bioptim"] if "bioptim" in packages_versions else "Not installed through conda-forge"
-            ),
-        }
-        return version_dic
+        return Provenance.get_provenance()
 
     def save_subject_results(self, results, result_file_name: str, cycles_to_analyze: range | None):
         """
         Save the results of the analysis in a pickle file and a matlab file.
+        If write_in_background is True, the files are written by the ResultWriter while the next trial is analyzed.
         .
         Parameters
         ----------
@@ -150,7 +163,7 @@ class AnalysisPerformer:
             The range of cycles to analyze. If None, all cycles will be analyzed.
         """
 
-        result_dict = self.get_version()
+        result_dict = Provenance.get_provenance(self.versions)
         result_dict["cycles_to_analyze"] = cycles_to_analyze if cycles_to_analyze is not None else 0
         for attr_name in dir(results):
             attr = getattr(results, attr_name)
@@ -170,11 +183,10 @@ class AnalysisPerformer:
                             result_dict[key] = value
 
         # Save the results
-        # For python analysis
-        with open(result_file_name + ".pkl", "wb") as f:
-            pickle.dump(result_dict, f)
-        # For matlab analysis
-        savemat(result_file_name + ".mat", result_dict)
+        if self.result_writer is None:
+            ResultWriter.write(result_dict, result_file_name, self.save_mat, self.save_result_store)
+        else:
+            self.result_writer.submit(result_dict, result_file_name)
 
     def check_for_geometry_files(self):
         """
@@ -237,88 +249,258 @@ class AnalysisPerformer:
                 )
         return cycles_to_analyze
 
-    def run_analysis(self):
+    def prepare_subject(self, subject: Subject, parent_path: str) -> tuple[str, str]:
         """
-        Loops over the data files and perform the analysis specified by the user (on the subjects specified by the user).
+        Find the static trial, measure the mass of the subject if needed, and create the subject's result folders.
+        This is done only once per subject (not once per trial).
+        .
+        Parameters
+        ----------
+        subject: Subject
+            The subject to prepare
+        parent_path: str
+            The path to the root of the repository (where the data folder is)
+        .
+        Returns
+        -------
+        static_trial_full_file_path: str
+            The full path of the static trial ([...]_static.c3d)
+        result_folder: str
+            The folder where the results of this subject will be saved
         """
-        parent_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subject_name = subject.subject_name
+        subject_data_folder = parent_path + f"/data/{subject_name}"
 
-        # Loop over all subjects
-        for subject in self.subjects_to_analyze:
+        # Checks
+        if not os.path.exists(subject_data_folder):
+            os.makedirs(subject_data_folder)
+            tempo_subject_path = os.path.abspath(subject_data_folder)
+            raise RuntimeError(
+                f"Data folder for subject {subject_name} does not exist. I have created it here {tempo_subject_path}, please put the data files in here."
+            )
 
-            subject_name = subject.subject_name
-            subject_data_folder = parent_path + f"/data/{subject_name}"
+        # Loop over files to find the static trial
+        static_trial_full_file_path = None
+        for data_file in os.listdir(subject_data_folder):
+            if data_file.endswith("static.c3d"):
+                static_trial_full_file_path = parent_path + f"/data/{subject_name}/{data_file}"
+                break
+        if not static_trial_full_file_path:
+            raise FileNotFoundError(
+                f"Please put the static trial file here {os.path.abspath(subject_data_folder)} and name it [...]_static.c3d"
+            )
 
-            # Checks
-            if not os.path.exists(subject_data_folder):
-                os.makedirs(subject_data_folder)
-                tempo_subject_path = os.path.abspath(subject_data_folder)
-                raise RuntimeError(
-                    f"Data folder for subject {subject_name} does not exist. I have created it here {tempo_subject_path}, please put the data files in here."
-                )
+        # Define mass with static trial
+        if subject.subject_mass is None:
+            static_c3d = ezc3d.c3d(static_trial_full_file_path, extract_forceplat_data=True)
+            summed_force = 0
+            for i_platform in range(len(static_c3d["data"]["platform"])):
+                summed_force += static_c3d["data"]["platform"][i_platform]["force"]
+            # Réunion Island : ~9.782
+            subject.subject_mass = np.nanmedian(np.linalg.norm(summed_force, axis=0)) / 9.8
 
-            # Loop over files to find the static trial
-            static_trial_full_file_path = None
-            for data_file in os.listdir(subject_data_folder):
-                if data_file.endswith("static.c3d"):
-                    static_trial_full_file_path = parent_path + f"/data/{subject_name}/{data_file}"
-                    break
-            if not static_trial_full_file_path:
-                raise FileNotFoundError(
-                    f"Please put the static trial file here {os.path.abspath(subject_data_folder)} and name it [...]_static.c3d"
-                )
+        # Define subject specific paths
+        result_folder = f"{self.result_folder}/{subject_name}"
+        self.figures_result_folder = f"{result_folder}/figures"
+        self.models_result_folder = f"{result_folder}/models"
+        if not os.path.exists(result_folder):
+            os.makedirs(result_folder)
+            os.makedirs(self.figures_result_folder)
+            os.makedirs(self.models_result_folder)
+            print("The results folder was created here: ", os.path.abspath(result_folder))
+        if not os.path.exists(self.figures_result_folder):
+            os.makedirs(self.figures_result_folder)
+        if not os.path.exists(self.models_result_folder):
+            os.makedirs(self.models_result_folder)
 
-            # Define mass with static trial
-            if subject.subject_mass is None:
-                static_c3d = ezc3d.c3d(static_trial_full_file_path, extract_forceplat_data=True)
-                summed_force = 0
-                for i_platform in range(len(static_c3d["data"]["platform"])):
-                    summed_force += static_c3d["data"]["platform"][i_platform]["force"]
-                # Réunion Island : ~9.782
-                subject.subject_mass = np.nanmedian(np.linalg.norm(summed_force, axis=0)) / 9.8
+        return static_trial_full_file_path, result_folder
 
-            # Define subject specific paths
-            result_folder = f"{self.result_folder}/{subject_name}"
-            self.figures_result_folder = f"{result_folder}/figures"
-            self.models_result_folder = f"{result_folder}/models"
-            if not os.path.exists(result_folder):
-                os.makedirs(result_folder)
-                os.makedirs(self.figures_result_folder)
-                os.makedirs(self.models_result_folder)
-                print("The results folder was created here: ", os.path.abspath(result_folder))
-            if not os.path.exists(self.figures_result_folder):
-                os.makedirs(self.figures_result_folder)
-            if not os.path.exists(self.models_result_folder):
-                os.makedirs(self.models_result_folder)
+    def get_trials_to_analyze(
+        self, subject: Subject, parent_path: str, static_trial_full_file_path: str, result_folder: str
+    ) -> list[dict]:
+        """
+        List the trials of a subject that should be analyzed (one trial = one task).
+        .
+        Parameters
+        ----------
+        subject: Subject
+            The subject to analyze
+        parent_path: str
+            The path to the root of the repository (where the data folder is)
+        static_trial_full_file_path: str
+            The full path of the static trial ([...]_static.c3d)
+        result_folder: str
+            The folder where the results of this subject will be saved
+        .
+        Returns
+        -------
+        trials: list[dict]
+            The information needed to analyze each trial
+        """
+        subject_name = subject.subject_name
+        trials = []
+        for data_file in os.listdir(parent_path + f"/data/{subject_name}"):
+            # Files that we should not analyze
+            if data_file.endswith("static.c3d") or not data_file.endswith(".c3d"):
+                continue
+            if self.trails_to_analyze is not None and not any(trail in data_file for trail in self.trails_to_analyze):
+                continue
 
-            # Loop over all data files
-            for data_file in os.listdir(subject_data_folder):
-                # Files that we should not analyze
-                if data_file.endswith("static.c3d") or not data_file.endswith(".c3d"):
-                    continue
-                if self.trails_to_analyze is not None and not any(
-                    trail in data_file for trail in self.trails_to_analyze
-                ):
-                    continue
+            c3d_file_name = parent_path + f"/data/{subject_name}/{data_file}"
+            result_file_name = f"{result_folder}/{data_file.replace('.c3d', '_results')}"
 
-                c3d_file_name = parent_path + f"/data/{subject_name}/{data_file}"
-                result_file_name = f"{result_folder}/{data_file.replace('.c3d', '_results')}"
+            # Skip if already exists
+            if self.skip_if_existing and os.path.exists(result_file_name + ".pkl"):
+                print(f"Skipping {subject_name} - {data_file} because it already exists.")
+                continue
 
-                # Skip if already exists
-                if self.skip_if_existing and os.path.exists(result_file_name + ".pkl"):
-                    print(f"Skipping {subject_name} - {data_file} because it already exists.")
-                    continue
+            trials += [
+                {
+                    "subject": subject,
+                    "data_file": data_file,
+                    "cycles_to_analyze": self.get_cycles_to_analyze_for_this_trial(subject_name, data_file),
+                    "static_trial_full_file_path": static_trial_full_file_path,
+                    "c3d_file_name": c3d_file_name,
+                    "result_folder": result_folder,
+                    "result_file_name": result_file_name,
+                    # The trials after the first one use the model created by the first trial of this analysis
+                    "reuse_subject_model": len(trials) > 0,
+                }
+            ]
+        return trials
 
-                cycles_to_analyze = self.get_cycles_to_analyze_for_this_trial(subject_name, data_file)
+    def perform_trial_analysis(self, trial: dict):
+        """
+        Perform the analysis on one trial and save its results.
+        When n_workers > 1, this method is executed in a worker process.
+        .
+        Parameters
+        ----------
+        trial: dict
+            The information needed to analyze this trial (see get_trials_to_analyze)
+        """
+        print("\n\n\nAnalyzing ", trial["subject"].subject_name, " : ***** ", trial["data_file"], " *****")
+        kwargs = self.kwargs
+        if self.accepts_reuse_existing_model:
+            # The model of the subject is created once per analysis, whatever the skip_if_existing of create_model
+            kwargs = {**self.kwargs, "reuse_existing_model": trial["reuse_subject_model"]}
+        results = self.analysis_to_perform(
+            trial["subject"],
+            trial["cycles_to_analyze"],
+            trial["static_trial_full_file_path"],
+            trial["c3d_file_name"],
+            trial["result_folder"],
+            **kwargs,
+        )
+        if callable(getattr(results, "run_stages", None)):
+            # Compute the stages that were only registered (when the ResultManager runs its stages concurrently)
+            results.run_stages()
+        self.save_subject_results(results, trial["result_file_name"], trial["cycles_to_analyze"])
 
-                # Actually perform the analysis
-                print("\n\n\nAnalyzing ", subject_name, " : ***** ", data_file, " *****")
-                results = self.analysis_to_perform(
-                    subject,
-                    cycles_to_analyze,
-                    static_trial_full_file_path,
-                    c3d_file_name,
-                    result_folder,
-                    **self.kwargs,
-                )
-                self.save_subject_results(results, result_file_name, cycles_to_analyze)
+    def run_analysis(self):
+        """
+        Loops over the data files and perform the analysis specified by the user (on the subjects specified by the user).
+        """
+        parent_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+        # Prepare the subjects (static trial, mass, folders) and list the trials to analyze
+        trials_per_subject = []
+        for subject in self.subjects_to_analyze:
+            static_trial_full_file_path, result_folder = self.prepare_subject(subject, parent_path)
+            trials_per_subject += [
+                self.get_trials_to_analyze(subject, parent_path, static_trial_full_file_path, result_folder)
+            ]
+
+        if self.n_workers == 1 and self.executor is None:
+            # Sequential analysis
+            if self.write_in_background:
+                self.result_writer = ResultWriter(save_mat=self.save_mat, save_result_store=self.save_result_store)
+            analysis_error = None
+            try:
+                for trials in trials_per_subject:
+                    for trial in trials:
+                        self.perform_trial_analysis(trial)
+                        self.trial_status[trial["c3d_file_name"]] = "success"
+            except BaseException as error:
+                analysis_error = error
+                raise
+            finally:
+                # Wait for all the results to be written (the writing errors are raised here)
+                if self.result_writer is not None:
+                    result_writer = self.result_writer
+                    self.result_writer = None
+                    try:
+                        result_writer.close()
+                    except Exception:
+                        if analysis_error is None:
+                            raise
+                        # The error of the analysis is being raised, so the writing error is only reported
+                        print(f"The results could not be written:\n{traceback.format_exc()}")
+        else:
+            self.run_analysis_in_parallel(trials_per_subject)
+
+    def run_analysis_in_parallel(self, trials_per_subject: list[list[dict]]):
+        """
+        Fan the trials out to a pool of workers (one trial = one task).
+        The first trial of each subject is analyzed first so that the subject's model is created only once, the other
+        trials of this subject are then analyzed concurrently using this model (whatever the skip_if_existing of
+        create_model, see the reuse_existing_model argument of analysis_to_perform). If the first trial fails, the
+        model may not have been created, so the next trial of this subject is analyzed alone, and so on.
+        A trial that fails does not stop the analysis of the other trials, the failures are summarized at the end.
+        .
+        Parameters
+        ----------
+        trials_per_subject: list[list[dict]]
+            The trials to analyze for each subject (see get_trials_to_analyze)
+        """
+        executor = self.executor
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=self.n_workers)
+        try:
+            # future: (trial, the trials of the subject waiting for its model)
+            running_trials = {}
+            for trials in trials_per_subject:
+                if len(trials) > 0:
+                    trial = {**trials[0], "reuse_subject_model": False}
+                    running_trials[executor.submit(self.perform_trial_analysis, trial)] = (trial, list(trials[1:]))
+            while len(running_trials) > 0:
+                done, _ = wait(running_trials, return_when=FIRST_COMPLETED)
+                for future in done:
+                    trial, waiting_trials = running_trials.pop(future)
+                    try:
+                        future.result()
+                        self.trial_status[trial["c3d_file_name"]] = "success"
+                        # The model of the subject exists, so the other trials can use it concurrently
+                        next_trials = [
+                            {**waiting_trial, "reuse_subject_model": True} for waiting_trial in waiting_trials
+                        ]
+                        waiting_trials = []
+                    except Exception:
+                        self.trial_status[trial["c3d_file_name"]] = traceback.format_exc()
+                        print(f"The analysis of {trial['c3d_file_name']} failed:\n{traceback.format_exc()}")
+                        # The model of the subject may not exist, so the next trial is analyzed alone to create it
+                        next_trials = [
+                            {**waiting_trial, "reuse_subject_model": False} for waiting_trial in waiting_trials[:1]
+                        ]
+                        waiting_trials = waiting_trials[1:]
+                    for next_trial in next_trials:
+                        running_trials[executor.submit(self.perform_trial_analysis, next_trial)] = (
+                            next_trial,
+                            waiting_trials,
+                        )
+        finally:
+            if self.executor is None:
+                executor.shutdown()
+
+        # Summary
+        failed_trials = [c3d_file_name for c3d_file_name, status in self.trial_status.items() if status != "success"]
+        print(f"\n\n\n{len(self.trial_status) - len(failed_trials)}/{len(self.trial_status)} trials were analyzed.")
+        for c3d_file_name in failed_trials:
+            print(f"Failed: {c3d_file_name} (see AnalysisPerformer.trial_status for the error)")
+
+    def __getstate__(self):
+        # The executor and the result writer cannot be sent to the worker processes
+        state = self.__dict__.copy()
+        state["executor"] = None
+        state["result_writer"] = None
+        return state
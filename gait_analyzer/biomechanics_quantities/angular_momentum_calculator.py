@@ -1,4 +1,3 @@
-import os
 import numpy as np
 import pickle
 import biorbd
@@ -6,6 +5,8 @@ import biorbd
 from gait_analyzer.subject import Subject
 from gait_analyzer.kinematics_reconstructor import KinematicsReconstructor
 from gait_analyzer.experimental_data import ExperimentalData
+from gait_analyzer.utils.stage_cache import StageCache
+from gait_analyzer.utils.batched_dynamics import BatchedDynamics
 
 
 class AngularMomentumCalculator:
@@ -22,6 +23,8 @@ class AngularMomentumCalculator:
         kinematics_reconstructor: KinematicsReconstructor,
         subject: Subject,
         skip_if_existing: bool,
+        batched_flag: bool = False,
+        nb_threads: int = 1,
     ):
         """
         Initialize the AngularMomentumCalculator.
@@ -40,7 +43,17 @@ class AngularMomentumCalculator:
         #     A dictionary containing the length of each segment in meters.
         skip_if_existing : bool
             If True, skip the angular momentum computations if it already exists.
+        batched_flag : bool
+            If True, the angular momentum of all frames is evaluated in a single call of a symbolic function (built
+            once per model with the CasADi backend of biorbd) instead of calling biorbd frame by frame.
+        nb_threads : int
+            The number of threads used to evaluate the frames when batched_flag is True.
         """
+        # Checks
+        if not isinstance(batched_flag, bool):
+            raise ValueError("batched_flag must be a boolean")
+        if not isinstance(nb_threads, int) or nb_threads < 1:
+            raise ValueError("nb_threads must be a positive integer")
 
         # Initial attributes
         self.model = biorbd_model
@@ -50,6 +63,9 @@ class AngularMomentumCalculator:
         self.subject_mass = subject.subject_mass
         self.subject_height = subject.subject_height
         self.gravity = biorbd_model.getGravity().to_array()
+        self.biorbd_model_full_path = experimental_data.model_creator.biorbd_model_full_path
+        self.batched_flag = batched_flag
+        self.nb_threads = nb_threads
 
         # Helper parameters
         self.nb_frames = self.q.shape[1]
@@ -60,14 +76,24 @@ class AngularMomentumCalculator:
         self.segments_angular_momentum = None
         # self.segments_angular_momentum_normalized = None
         self.is_loaded_angular_momentum = False
+        self.input_hash = StageCache.hash_inputs(
+            kinematics_reconstructor.input_hash,
+            self.subject_mass,
+            self.subject_height,
+            self.extract_segments_with_dofs(),
+        )
 
         if skip_if_existing and self.check_if_existing():
             self.is_loaded_angular_momentum = True
         else:
             # Compute the angular momentum values
-            self.compute_total_angular_momentum()
+            if self.batched_flag:
+                self.compute_batched_angular_momentum()
+            else:
+                self.compute_total_angular_momentum()
+                self.compute_segments_angular_momentum()
             self.normalize_total_angular_momentum()
-            self.compute_segments_angular_momentum()
+            self.save_angular_momentum()
 
     def compute_total_angular_momentum(self):
         """
@@ -79,6 +105,24 @@ class AngularMomentumCalculator:
                 self.q[:, i_frame], self.qdot[:, i_frame], True
             ).to_array()
 
+    def compute_batched_angular_momentum(self):
+        """
+        Computes the angular momentum of the whole body and of each segment on all frames at once with a symbolic
+        function of the model.
+        """
+        segment_names, segment_indices = self.extract_segments_with_dofs()
+        angular_momentum = BatchedDynamics.get_angular_momentum_function(
+            self.biorbd_model_full_path, StageCache.hash_file(self.biorbd_model_full_path), tuple(segment_indices)
+        )
+        self.total_angular_momentum, segments_angular_momentum = BatchedDynamics.evaluate(
+            angular_momentum, self.nb_threads, self.q, self.qdot
+        )
+        segments_angular_momentum = segments_angular_momentum.reshape(len(segment_names), 3, self.nb_frames)
+        self.segments_angular_momentum = {
+            segment_name: segments_angular_momentum[i_segment, :, :]
+            for i_segment, segment_name in enumerate(segment_names)
+        }
+
     def normalize_total_angular_momentum(self):
         """
         Normalize the angular momentum with respect to the mass and height of the subject.
@@ -92,43 +136,33 @@ class AngularMomentumCalculator:
         normalization_factor = self.subject_mass * self.subject_height * np.sqrt(gravity_factor * self.subject_height)
         self.total_angular_momentum_normalized = self.total_angular_momentum / normalization_factor.reshape(3, 1)
 
-    def extract_last_dof_per_segment(self):
+    def extract_segments_with_dofs(self) -> tuple[list[str], list[int]]:
         """
-        Extract the last DoF for each segment because biorbd stores the angular momentum of the kinematic chain at
-        the index of this DoF (all others are set to zeros).
-        TODO: This workaround works for models with "_rotation" and "_translation" in the DoF names, but should be replaced with something else.
+        Extract the segments which have DoFs, and their index in the model (CalcSegmentsAngularMomentum returns the
+        angular momentum of each segment of the model, including the segments without DoFs, e.g., the offsets and the
+        *_rotation_transform segments).
+        .
+        Returns
+        -------
+        segment_names: list[str]
+            The name of the segments with DoFs
+        segment_indices: list[int]
+            The index of these segments in the model
         """
-        dof_names = [m.to_string() for m in self.model.nameDof()]
-        last_dofs = []
         segment_names = []
-        last_dof_indices = []
-        current_segment = None
-        for i, dof_name in enumerate(dof_names):
-            if "_translation" in dof_name:
-                segment_name = dof_name.split("_translation")[0]
-            elif "_rotation" in dof_name:
-                segment_name = dof_name.split("_rotation")[0]
-            else:
-                segment_name = dof_name.split("_")[0]
-
-            if current_segment is not None and segment_name != current_segment:
-                last_dofs.append(dof_names[i - 1])
-                segment_names.append(segment_name)
-                last_dof_indices.append(i - 1)
-            current_segment = segment_name
-
-        if dof_names:
-            last_dofs.append(dof_names[-1])
-            segment_names.append(segment_name)
-            last_dof_indices.append(len(dof_names) - 1)
-
-            return last_dofs, segment_names, last_dof_indices
+        segment_indices = []
+        for i_segment in range(self.model.nbSegment()):
+            segment = self.model.segment(i_segment)
+            if segment.nbDof() > 0:
+                segment_names.append(segment.name().to_string())
+                segment_indices.append(i_segment)
+        return segment_names, segment_indices
 
     def compute_segments_angular_momentum(self):
         """
         Computes the angular momentum of each segment around its center of mass on the three axis.
         """
-        last_dofs, segment_names, last_dof_indices = self.extract_last_dof_per_segment()
+        segment_names, segment_indices = self.extract_segments_with_dofs()
 
         self.segments_angular_momentum = {segment_name: np.zeros((3, self.nb_frames)) for segment_name in segment_names}
 
@@ -148,17 +182,21 @@ class AngularMomentumCalculator:
         # self.segments_angular_momentum_normalized = {segment_name: np.zeros((3, self.nb_frames)) for segment_name in segment_names}
         # for i_frame in range(self.nb_frames):
         #     segment_angular_momentum = self.model.CalcSegmentsAngularMomentum(self.q[:, i_frame], self.qdot[:, i_frame], True)
-        #     for segment_name, index in zip(segment_names, last_dof_indices):
-        #         self.segments_angular_momentum[segment_name][: i_frame] = segment_angular_momentum[index].to_array()
+        #     for segment_name, index in zip(segment_names, segment_indices):
         #         self.segments_angular_momentum_normalized[segment_name][:, i_frame] = self.segments_angular_momentum[segment_name][:, i_frame] / (
         #             self.subject_mass * self.segments_length[segment_name] * np.sqrt(self.gravity * self.segments_length[segment_name])
         #         )
 
-        return
+        for i_frame in range(self.nb_frames):
+            segment_angular_momentum = self.model.CalcSegmentsAngularMomentum(
+                self.q[:, i_frame], self.qdot[:, i_frame], True
+            )
+            for segment_name, index in zip(segment_names, segment_indices):
+                self.segments_angular_momentum[segment_name][:, i_frame] = segment_angular_momentum[index].to_array()
 
     def check_if_existing(self) -> bool:
         """
-        Check if the angular momentum value already exists.
+        Check if the angular momentum value already exists and was computed with the same inputs.
         If it exists, load it.
         .
         Returns
@@ -167,17 +205,15 @@ class AngularMomentumCalculator:
             If the angular momentum value already exists
         """
         result_file_full_path = self.get_result_file_full_path()
-        if os.path.exists(result_file_full_path):
-            with open(result_file_full_path, "rb") as file:
-                data = pickle.load(file)
-                self.total_angular_momentum = data["total_angular_momentum"]
-                self.total_angular_momentum_normalized = data["total_angular_momentum_normalized"]
-                self.segments_angular_momentum = data["segments_angular_momentum"]
-                # self.segments_angular_momentum_normalized = data["segments_angular_momentum_normalized"]
-                self.is_loaded_angular_momentum = True
-            return True
-        else:
+        data = StageCache.load_if_up_to_date(result_file_full_path, self.input_hash)
+        if data is None:
             return False
+        self.total_angular_momentum = data["total_angular_momentum"]
+        self.total_angular_momentum_normalized = data["total_angular_momentum_normalized"]
+        self.segments_angular_momentum = data["segments_angular_momentum"]
+        # self.segments_angular_momentum_normalized = data["segments_angular_momentum_normalized"]
+        self.is_loaded_angular_momentum = True
+        return True
 
     def get_result_file_full_path(self, result_folder=None):
         if result_folder is None:
@@ -191,8 +227,10 @@ class AngularMomentumCalculator:
         Save the angular momentum values.
         """
         result_file_full_path = self.get_result_file_full_path()
+        outputs = self.outputs()
+        outputs["input_hash"] = self.input_hash
         with open(result_file_full_path, "wb") as file:
-            pickle.dump(self.outputs(), file)
+            pickle.dump(outputs, file)
 
     def inputs(self):
         return {
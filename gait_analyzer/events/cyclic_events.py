@@ -6,6 +6,7 @@ from matplotlib import colormaps
 
 from gait_analyzer.operator import Operator
 from gait_analyzer.experimental_data import ExperimentalData
+from gait_analyzer.utils.stage_cache import StageCache
 from gait_analyzer.subject import Side
 
 
@@ -62,6 +63,13 @@ class CyclicEvents:
         self.left_leg_index = force_plate_sides.index(Side.LEFT)
         self.is_loaded_events = False
         self.type = "cyclic"
+        self.input_hash = StageCache.hash_inputs(
+            experimental_data.input_hash,
+            force_plate_sides,
+            self.minimal_vertical_force_threshold,
+            self.minimal_forward_force_threshold,
+            self.heel_velocity_threshold,
+        )
 
         # Extended attributes
         self.events = {
@@ -110,7 +118,7 @@ class CyclicEvents:
 
     def check_if_existing(self) -> bool:
         """
-        Check if the events detection already exists.
+        Check if the events detection already exists and was performed with the same inputs.
         If it exists, load the events.
         .
         Returns
@@ -119,26 +127,21 @@ class CyclicEvents:
             If the events detection already exists
         """
         result_file_full_path = self.get_result_file_full_path()
-        if os.path.exists(result_file_full_path):
-            with open(result_file_full_path, "rb") as file:
-                data = pickle.load(file)
-                self.events = data["events"]
-                self.phases_right_leg = data["phases_right_leg"]
-                self.phases_left_leg = data["phases_left_leg"]
-                self.phases = data["phases"]
-            return True
-        else:
+        data = StageCache.load_if_up_to_date(result_file_full_path, self.input_hash)
+        if data is None:
             return False
+        self.events = data["events"]
+        self.phases_right_leg = data["phases_right_leg"]
+        self.phases_left_leg = data["phases_left_leg"]
+        self.phases = data["phases"]
+        return True
 
     def detect_heel_touch(self, show_debug_plot_flag: bool):
         """
         Detect the heel touch event when the antero-posterior GRF reaches a certain threshold after the swing phase
         """
-        grf_left_y_filtered = Operator.moving_average(
-            self.experimental_data.f_ext_sorted[self.left_leg_index, 7, :], 21
-        )
-        grf_right_y_filtered = Operator.moving_average(
-            self.experimental_data.f_ext_sorted[self.right_leg_index, 7, :], 21
+        grf_left_y_filtered, grf_right_y_filtered = Operator.moving_average(
+            self.experimental_data.f_ext_sorted[[self.left_leg_index, self.right_leg_index], 7, :], 21
         )
 
         # Left
@@ -214,11 +217,8 @@ class CyclicEvents:
         """
         Detect the toes touch event when the vertical GRF is maximal
         """
-        grf_left_z_filtered = Operator.moving_average(
-            self.experimental_data.f_ext_sorted[self.left_leg_index, 8, :], 35
-        )
-        grf_right_z_filtered = Operator.moving_average(
-            self.experimental_data.f_ext_sorted[self.right_leg_index, 8, :], 35
+        grf_left_z_filtered, grf_right_z_filtered = Operator.moving_average(
+            self.experimental_data.f_ext_sorted[[self.left_leg_index, self.right_leg_index], 8, :], 35
         )
 
         swing_timings = np.where(self.phases_left_leg["swing"])[0]
@@ -390,11 +390,8 @@ class CyclicEvents:
         """
         Detect the swing phase when the vertical GRF is lower than a threshold
         """
-        grf_left_z_filtered = Operator.moving_average(
-            self.experimental_data.f_ext_sorted[self.left_leg_index, 8, :], 21
-        )
-        grf_right_z_filtered = Operator.moving_average(
-            self.experimental_data.f_ext_sorted[self.right_leg_index, 8, :], 21
+        grf_left_z_filtered, grf_right_z_filtered = Operator.moving_average(
+            self.experimental_data.f_ext_sorted[[self.left_leg_index, self.right_leg_index], 8, :], 21
         )
         self.phases_left_leg["swing"][:] = np.abs(grf_left_z_filtered) < self.minimal_vertical_force_threshold
         self.phases_right_leg["swing"][:] = np.abs(grf_right_z_filtered) < self.minimal_vertical_force_threshold
@@ -651,11 +648,7 @@ class CyclicEvents:
         """
         Get the frame range to analyze.
         """
-        heel_touches = Operator.from_analog_frame_to_marker_frame(
-            self.experimental_data.analogs_time_vector,
-            self.experimental_data.markers_time_vector,
-            self.events["right_leg_heel_touch"],
-        )
+        heel_touches = self.experimental_data.time_base.analog_to_marker_frame(self.events["right_leg_heel_touch"])
         if cycles_to_analyze is None:
             start_cycle = 0
             end_cycle = -1
@@ -680,8 +673,10 @@ class CyclicEvents:
         Save the events detected.
         """
         result_file_full_path = self.get_result_file_full_path()
+        outputs = self.outputs()
+        outputs["input_hash"] = self.input_hash
         with open(result_file_full_path, "wb") as file:
-            pickle.dump(self.outputs(), file)
+            pickle.dump(outputs, file)
 
     def inputs(self):
         return {
@@ -6,6 +6,7 @@ from matplotlib import colormaps
 
 from gait_analyzer.operator import Operator
 from gait_analyzer.experimental_data import ExperimentalData
+from gait_analyzer.utils.stage_cache import StageCache
 
 
 class UniqueEvents:
@@ -41,6 +42,7 @@ class UniqueEvents:
         self.experimental_data = experimental_data
         self.is_loaded_events = False
         self.type = "unique"
+        self.input_hash = StageCache.hash_inputs(experimental_data.input_hash, self.minimal_vertical_force_threshold)
 
         # Extended attributes
         self.events = [
@@ -50,6 +52,7 @@ class UniqueEvents:
             }
             for _ in range(len(experimental_data.platform_corners))
         ]
+        self.vertical_grf_filtered = None
 
         if skip_if_existing and self.check_if_existing():
             self.is_loaded_events = True
@@ -60,7 +63,7 @@ class UniqueEvents:
 
     def check_if_existing(self) -> bool:
         """
-        Check if the events detection already exists.
+        Check if the events detection already exists and was performed with the same inputs.
         If it exists, load the events.
         .
         Returns
@@ -69,20 +72,26 @@ class UniqueEvents:
             If the events detection already exists
         """
         result_file_full_path = self.get_result_file_full_path()
-        if os.path.exists(result_file_full_path):
-            with open(result_file_full_path, "rb") as file:
-                data = pickle.load(file)
-                self.events = data["events"]
-            return True
-        else:
+        data = StageCache.load_if_up_to_date(result_file_full_path, self.input_hash)
+        if data is None:
             return False
+        self.events = data["events"]
+        return True
+
+    def get_vertical_grf_filtered(self) -> np.ndarray:
+        """
+        Get the vertical GRF of all platforms smoothed with a moving average (computed only once for all the events).
+        """
+        if self.vertical_grf_filtered is None:
+            self.vertical_grf_filtered = Operator.moving_average(self.experimental_data.f_ext_sorted[:, 8, :], 21)
+        return self.vertical_grf_filtered
 
     def detect_heel_touch(self):
         """
         Detect the heel touch event when the vertical GRF reaches a certain threshold
         """
         for i_platform in range(len(self.experimental_data.platform_corners)):
-            grf_y_filtered = Operator.moving_average(self.experimental_data.f_ext_sorted[i_platform, 8, :], 21)
+            grf_y_filtered = self.get_vertical_grf_filtered()[i_platform, :]
             index = np.abs(grf_y_filtered) > self.minimal_vertical_force_threshold
             first_indices_of_a_bloc = np.where(index[1:].astype(int) - index[:-1].astype(int) == 1)
             if len(first_indices_of_a_bloc) > 0:
@@ -97,7 +106,7 @@ class UniqueEvents:
         Detect the toes off event when the vertical GRF is lower than a threshold
         """
         for i_platform in range(len(self.experimental_data.platform_corners)):
-            grf_y_filtered = Operator.moving_average(self.experimental_data.f_ext_sorted[i_platform, 8, :], 21)
+            grf_y_filtered = self.get_vertical_grf_filtered()[i_platform, :]
             index = np.abs(grf_y_filtered) > self.minimal_vertical_force_threshold
             last_indices_of_a_bloc = np.where(index[1:].astype(int) - index[:-1].astype(int) == -1)
             if len(last_indices_of_a_bloc) > 0:
@@ -131,8 +140,10 @@ class UniqueEvents:
         Save the events detected.
         """
         result_file_full_path = self.get_result_file_full_path()
+        outputs = self.outputs()
+        outputs["input_hash"] = self.input_hash
         with open(result_file_full_path, "wb") as file:
-            pickle.dump(self.outputs(), file)
+            pickle.dump(outputs, file)
 
     def inputs(self):
         return {
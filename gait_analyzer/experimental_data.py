@@ -1,11 +1,13 @@
 import os
 import ezc3d
 import numpy as np
-from pyomeca import Analogs
 
 from gait_analyzer.model_creator import ModelCreator
 from gait_analyzer.operator import Operator
 from gait_analyzer.subject import Subject
+from gait_analyzer.time_base import TimeBase
+from gait_analyzer.utils.stage_cache import StageCache
+from gait_analyzer.utils.c3d_cache import C3dCache
 
 
 class ExperimentalData:
@@ -21,6 +23,7 @@ class ExperimentalData:
         markers_to_ignore: list[str],
         analogs_to_ignore: list[str],
         animate_c3d_flag: bool,
+        c3d_cache_folder: str | None = None,
     ):
         """
         Initialize the ExperimentalData.
@@ -41,12 +44,17 @@ class ExperimentalData:
             Supplementary analogs to ignore in the analysis (e.g., EMG signals).
         animate_c3d_flag: bool
             If True, the c3d file will be animated.
+        c3d_cache_folder: str | None
+            The folder where the parsed c3d arrays are cached (keyed by the hash of the c3d file) to avoid parsing the
+            c3d file again when the trial is re-analyzed. If None, the c3d file is parsed each time.
         """
         # Checks
         if not isinstance(c3d_file_name, str):
             raise ValueError("c3d_file_name must be a string")
         if not isinstance(result_folder, str):
             raise ValueError("result_folder must be a string")
+        if c3d_cache_folder is not None and not isinstance(c3d_cache_folder, str):
+            raise ValueError("c3d_cache_folder must be a string or None")
 
         # Threshold for removing force values
         # TODO: Validate because this value is high !
@@ -58,9 +66,11 @@ class ExperimentalData:
         self.markers_to_ignore = markers_to_ignore
         self.analogs_to_ignore = analogs_to_ignore
         self.result_folder = result_folder
+        self.c3d_cache_folder = c3d_cache_folder
 
         # Extended attributes
-        self.c3d = None
+        self.c3d_data = None
+        self._c3d = None  # The ezc3d.c3d of the trial, only parsed if it is accessed (see c3d)
         self.model_marker_names = None
         self.marker_sampling_frequency = None
         self.markers_dt = None
@@ -75,8 +85,11 @@ class ExperimentalData:
         self.nb_analog_frames = None
         self.f_ext_sorted = None
         self.f_ext_sorted_filtered = None
+        self.f_ext_sorted_marker_rate = None
         self.markers_time_vector = None
         self.analogs_time_vector = None
+        self.time_base = None
+        self.input_hash = self.get_input_hash()
 
         # Extract data from the c3d file
         print(f"Reading experimental data from file {self.c3d_full_file_path} ...")
@@ -85,6 +98,36 @@ class ExperimentalData:
         if animate_c3d_flag:
             self.animate_c3d()
 
+    @property
+    def c3d(self) -> ezc3d.c3d:
+        """
+        The ezc3d.c3d of the trial, kept for backward compatibility (the analysis only uses the arrays of c3d_data).
+        The file is only parsed the first time this attribute is accessed.
+        """
+        if self._c3d is None:
+            self._c3d = ezc3d.c3d(self.c3d_full_file_path, extract_forceplat_data=True)
+        return self._c3d
+
+    def __getstate__(self):
+        # The ezc3d.c3d cannot be sent to the worker processes, it is parsed again if it is accessed
+        state = self.__dict__.copy()
+        state["_c3d"] = None
+        return state
+
+    def get_input_hash(self) -> str:
+        """
+        Hash the inputs of the experimental data treatment (c3d content, model, and parameters).
+        This hash is used by the next stages to know if they should be recomputed.
+        """
+        return StageCache.hash_inputs(
+            StageCache.hash_file(self.c3d_full_file_path),
+            self.model_creator.input_hash,
+            StageCache.hash_file(self.model_creator.biorbd_model_full_path),
+            self.markers_to_ignore,
+            self.analogs_to_ignore,
+            self.force_threshold,
+        )
+
     def perform_initial_treatment(self):
         """
         Extract important information and sort the data
@@ -98,17 +141,15 @@ class ExperimentalData:
             ]
 
         def sort_markers():
-            self.c3d = ezc3d.c3d(self.c3d_full_file_path, extract_forceplat_data=True)
-            markers = self.c3d["data"]["points"]
-            self.marker_sampling_frequency = self.c3d["parameters"]["POINT"]["RATE"]["value"][0]  # Hz
-            self.markers_dt = 1 / self.c3d["header"]["points"]["frame_rate"]
+            self.c3d_data = C3dCache.load(self.c3d_full_file_path, self.c3d_cache_folder)
+            markers = self.c3d_data["points"]
+            self.marker_sampling_frequency = self.c3d_data["point_rate"]  # Hz
+            self.markers_dt = 1 / self.c3d_data["point_frame_rate"]
             self.nb_marker_frames = markers.shape[2]
-            exp_marker_names = [
-                m for m in self.c3d["parameters"]["POINT"]["LABELS"]["value"] if m not in self.markers_to_ignore
-            ]
+            exp_marker_names = [m for m in self.c3d_data["point_labels"] if m not in self.markers_to_ignore]
 
             self.marker_units = 1
-            if self.c3d["parameters"]["POINT"]["UNITS"]["value"][0] == "mm":
+            if self.c3d_data["point_units"] == "mm":
                 self.marker_units = 0.001
             if len(self.model_marker_names) > len(exp_marker_names):
                 supplementary_marker_names = [name for name in self.model_marker_names if name not in exp_marker_names]
@@ -134,20 +175,16 @@ class ExperimentalData:
             """
 
             # Get an array of the experimental muscle activity
-            analogs = self.c3d["data"]["analogs"]
-            self.nb_analog_frames = analogs.shape[2]
-            self.analogs_sampling_frequency = self.c3d["parameters"]["ANALOG"]["RATE"]["value"][0]  # Hz
-            self.analogs_dt = 1 / self.c3d["header"]["analogs"]["frame_rate"]
-            self.analog_names = [
-                name
-                for name in self.c3d["parameters"]["ANALOG"]["LABELS"]["value"]
-                if name not in self.analogs_to_ignore
-            ]
+            analogs = self.c3d_data["analogs"]
+            self.nb_analog_frames = analogs.shape[1]
+            self.analogs_sampling_frequency = self.c3d_data["analog_rate"]  # Hz
+            self.analogs_dt = 1 / self.c3d_data["analog_frame_rate"]
+            self.analog_names = [name for name in self.c3d_data["analog_labels"] if name not in self.analogs_to_ignore]
 
             self.emg_units = 1
-            for i_analog, name in enumerate(self.c3d["parameters"]["ANALOG"]["LABELS"]["value"]):
+            for i_analog, name in enumerate(self.c3d_data["analog_labels"]):
                 if name not in self.analogs_to_ignore:
-                    if self.c3d["parameters"]["ANALOG"]["UNITS"]["value"][i_analog] == "V":
+                    if self.c3d_data["analog_units"][i_analog] == "V":
                         self.emg_units = 1_000_000  # Convert to microV
 
             # Make sure all MVC are declared
@@ -157,15 +194,15 @@ class ExperimentalData:
                         f"There was not MVC trial for muscle {analog_name}, available muscles are {self.model_creator.mvc_values.keys()}. Please check that the MVC trials are correctly named and placed in the folder {self.model_creator.mvc_trials_path}."
                     )
 
-            # Process the EMG signals
-            emg = Analogs.from_c3d(self.c3d_full_file_path, suffix_delimiter=".", usecols=self.analog_names)
+            # Process the EMG signals (directly from the analogs already loaded)
+            analog_idx = [self.c3d_data["analog_labels"].index(analog_name) for analog_name in self.analog_names]
             emg_processed = (
-                emg.meca.interpolate_missing_data()
-                .meca.band_pass(order=2, cutoff=[10, 425])
-                .meca.center()
-                .meca.abs()
-                .meca.low_pass(order=4, cutoff=5, freq=emg.rate)
-            ) * self.emg_units
+                Operator.process_emg(
+                    analogs[analog_idx, :],
+                    sampling_rate=self.c3d_data["analog_frame_rate"],
+                )
+                * self.emg_units
+            )
             normalized_emg = np.zeros((len(self.analog_names), self.nb_analog_frames))
             for i_muscle, muscle_name in enumerate(self.analog_names):
                 normalized_emg[i_muscle, :] = (
@@ -193,17 +230,31 @@ class ExperimentalData:
             The F_ext output is of the form [cop, moments, forces].
             """
 
-            platforms = self.c3d["data"]["platform"]
-            nb_platforms = len(platforms)
+            nb_platforms = self.c3d_data["platform_force"].shape[0]
             units = self.marker_units  # We assume that the all position units are the same as the markers'
             self.platform_corners = []
-            for platform in platforms:
-                self.platform_corners += [platform["corners"] * units]
+            for i_platform in range(nb_platforms):
+                self.platform_corners += [self.c3d_data["platform_corners"][i_platform, :, :] * units]
+
+            # Get the data
+            forces = self.c3d_data["platform_force"]
+            moments = self.c3d_data["platform_moment"] * units
+            tzs = self.c3d_data["platform_tz"] * units
+            tzs[:, :2, :] = 0  # This is the intended behavior (no moments on X and Y at the CoP)
+
+            # Filter forces and moments of all platforms at once
+            # TODO: Charbie -> Antoine is supposed to send a ref for this filtering
+            forces_and_moments_filtered = Operator.apply_filtfilt(
+                np.concatenate((forces, moments, tzs), axis=1),
+                order=2,
+                sampling_rate=self.analogs_sampling_frequency,
+                cutoff_freq=10,
+            )
+            force_filtered = forces_and_moments_filtered[:, 0:3, :]
+            moment_filtered = forces_and_moments_filtered[:, 3:6, :]
+            tz_filtered = forces_and_moments_filtered[:, 6:9, :]
 
             # Initialize arrays for storing external forces and moments
-            force_filtered = np.zeros((nb_platforms, 3, self.nb_analog_frames))
-            moment_filtered = np.zeros((nb_platforms, 3, self.nb_analog_frames))
-            tz_filtered = np.zeros((nb_platforms, 3, self.nb_analog_frames))
             cop_filtered = np.zeros((nb_platforms, 3, self.nb_analog_frames))
             f_ext_sorted = np.zeros((nb_platforms, 9, self.nb_analog_frames))
             f_ext_sorted_filtered = np.zeros((nb_platforms, 9, self.nb_analog_frames))
@@ -212,22 +263,8 @@ class ExperimentalData:
             for i_platform in range(nb_platforms):
 
                 # Get the data
-                force = platforms[i_platform]["force"]
-                moment = platforms[i_platform]["moment"] * units
-                tz = platforms[i_platform]["Tz"] * units
-                tz[:2, :] = 0  # This is the intended behavior (no moments on X and Y at the CoP)
-
-                # Filter forces and moments
-                # TODO: Charbie -> Antoine is supposed to send a ref for this filtering
-                force_filtered[i_platform, :, :] = Operator.apply_filtfilt(
-                    force, order=2, sampling_rate=self.analogs_sampling_frequency, cutoff_freq=10
-                )
-                moment_filtered[i_platform, :, :] = Operator.apply_filtfilt(
-                    moment, order=2, sampling_rate=self.analogs_sampling_frequency, cutoff_freq=10
-                )
-                tz_filtered[i_platform, :, :] = Operator.apply_filtfilt(
-                    tz, order=2, sampling_rate=self.analogs_sampling_frequency, cutoff_freq=10
-                )
+                force = forces[i_platform, :, :]
+                tz = tzs[i_platform, :, :]
 
                 # Remove the values when the force is too small since it is likely only noise
                 null_idx = np.where(np.linalg.norm(force_filtered[i_platform, :, :], axis=0) < self.force_threshold)[0]
@@ -235,7 +272,7 @@ class ExperimentalData:
                 force_filtered[i_platform, :, null_idx] = np.nan
 
                 # Do not trust the CoP from ezc3d and recompute it after filtering the forces and moments
-                cop_ezc3d = platforms[i_platform]["center_of_pressure"] * units
+                cop_ezc3d = self.c3d_data["platform_center_of_pressure"][i_platform, :, :] * units
 
                 r_z = 0  # In our case the reference frame of the platform is at its surface, so the height is 0
                 cop_filtered[i_platform, 0, :] = (
@@ -305,8 +342,13 @@ class ExperimentalData:
             self.f_ext_sorted_filtered = f_ext_sorted_filtered
 
         def compute_time_vectors():
-            self.markers_time_vector = np.linspace(0, self.markers_dt * self.nb_marker_frames, self.nb_marker_frames)
-            self.analogs_time_vector = np.linspace(0, self.analogs_dt * self.nb_analog_frames, self.nb_analog_frames)
+            self.time_base = TimeBase(self.nb_marker_frames, self.nb_analog_frames, self.markers_dt, self.analogs_dt)
+            self.markers_time_vector = self.time_base.markers_time_vector
+            self.analogs_time_vector = self.time_base.analogs_time_vector
+
+        def compute_marker_rate_forces():
+            # The external forces averaged over the time lapse of each marker frame (used by the inverse dynamics)
+            self.f_ext_sorted_marker_rate = self.time_base.average_over_marker_frames(self.f_ext_sorted)
 
         # Perform the initial treatment
         load_model()
@@ -314,6 +356,7 @@ class ExperimentalData:
         sort_analogs()
         extract_force_platform_data()
         compute_time_vectors()
+        compute_marker_rate_forces()
 
     def animate_c3d(self):
         try:
@@ -347,6 +390,7 @@ class ExperimentalData:
             "nb_analog_frames": self.nb_analog_frames,
             "f_ext_sorted": self.f_ext_sorted,
             "f_ext_sorted_filtered": self.f_ext_sorted_filtered,
+            "f_ext_sorted_marker_rate": self.f_ext_sorted_marker_rate,
             "markers_time_vector": self.markers_time_vector,
             "analogs_time_vector": self.analogs_time_vector,
             "normalized_emg": self.normalized_emg,
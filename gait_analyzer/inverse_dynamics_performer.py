@@ -1,10 +1,12 @@
 import pickle
-import os
 import numpy as np
 from pyomeca import Markers
 
-from gait_analyzer import Operator, KinematicsReconstructor
+from gait_analyzer import KinematicsReconstructor
 from gait_analyzer.experimental_data import ExperimentalData
+from gait_analyzer.utils.stage_cache import StageCache
+from gait_analyzer.utils.batched_dynamics import BatchedDynamics
+from gait_analyzer.utils.model_registry import ModelRegistry
 
 
 class InverseDynamicsPerformer:
@@ -12,6 +14,9 @@ class InverseDynamicsPerformer:
     This class performs the inverse dynamics based on the kinematics and the external forces.
     """
 
+    # The segment on which the external forces of each platform are applied
+    platform_segment_names = ("calcn_l", "calcn_r")
+
     def __init__(
         self,
         experimental_data: ExperimentalData,
@@ -19,6 +24,8 @@ class InverseDynamicsPerformer:
         skip_if_existing: bool,
         reintegrate_flag: bool,
         animate_dynamics_flag: bool,
+        batched_flag: bool = False,
+        nb_threads: int = 1,
     ):
         """
         Initialize the InverseDynamicsPerformer.
@@ -32,9 +39,16 @@ class InverseDynamicsPerformer:
         skip_if_existing: bool
             If True, the inverse dynamics is not performed if the results already exist
         reintegrate_flag: bool
-            If True the dynamics is reintegrated to confirm the results
+            If True the dynamics is reintegrated on successive windows of frames to confirm the results (see
+            reintegrate_dynamics). The reintegrated q and the drift are saved with the inverse dynamics.
         animate_dynamics_flag: bool
             If True an animation of the dynamics is shown using Pyorerun
+        batched_flag: bool
+            If True, the inverse dynamics (and the forward dynamics of the reintegration) of all frames is evaluated in
+            a single call of a symbolic function (built once per model with the CasADi backend of biorbd) instead of
+            calling biorbd frame by frame
+        nb_threads: int
+            The number of threads used to evaluate the frames when batched_flag is True
         """
 
         # Checks
@@ -52,58 +66,82 @@ class InverseDynamicsPerformer:
             raise ValueError("reintegrate_flag must be a boolean")
         if not isinstance(animate_dynamics_flag, bool):
             raise ValueError("animate_dynamics_flag must be a boolean")
+        if not isinstance(batched_flag, bool):
+            raise ValueError("batched_flag must be a boolean")
+        if not isinstance(nb_threads, int) or nb_threads < 1:
+            raise ValueError("nb_threads must be a positive integer")
         if animate_dynamics_flag and not reintegrate_flag:
             print("When animate_dynamics_flag is True, reintegrate_flag is automatically set to True.")
             reintegrate_flag = True
 
         # Initial attributes
         self.experimental_data = experimental_data
-        self.biorbd_model = kinematics_reconstructor.biorbd_model
+        # This stage has its own model since it can run concurrently with other stages (see ResultManager.run_stages)
+        self.biorbd_model = ModelRegistry.get_biorbd_model(
+            experimental_data.model_creator.biorbd_model_full_path, "inverse_dynamics_performer"
+        )
         self.kinematics_reconstructor = kinematics_reconstructor
         self.q_filtered = kinematics_reconstructor.q_filtered
         self.qdot = kinematics_reconstructor.qdot
         self.qddot = kinematics_reconstructor.qddot
         self.t = kinematics_reconstructor.t
+        self.batched_flag = batched_flag
+        self.nb_threads = nb_threads
+
+        # Parameters of the reintegration
+        self.reintegration_window_length = 20  # Number of frames integrated from the reconstructed kinematics
 
         # Extended attributes
         self.tau = None
         self.q_reintegrated = None
+        self.reintegration_drift = None
         self.is_loaded_inverse_dynamics = False
+        self.input_hash = StageCache.hash_inputs(
+            self.experimental_data.input_hash, self.kinematics_reconstructor.input_hash
+        )
 
         # Perform the inverse dynamics
         if skip_if_existing and self.check_if_existing():
             self.is_loaded_inverse_dynamics = True
         else:
             print("Performing inverse dynamics...")
-            self.perform_inverse_dynamics()
-            self.save_inverse_dynamics()
+            if self.batched_flag:
+                self.perform_batched_inverse_dynamics()
+            else:
+                self.perform_inverse_dynamics()
 
-        # Reintegrate the dynamics to confirm the results (q, tau, f_ext)
-        if reintegrate_flag:
+        # Reintegrate the dynamics to confirm the results (q, tau, f_ext), unless it was already saved
+        is_reintegrated = False
+        if reintegrate_flag and self.q_reintegrated is None:
             self.reintegrate_dynamics()
+            is_reintegrated = True
+
+        # The results of the reintegration are saved with the inverse dynamics
+        if not self.is_loaded_inverse_dynamics or is_reintegrated:
+            self.save_inverse_dynamics()
 
         if animate_dynamics_flag:
             self.animate_dynamics()
 
     def check_if_existing(self) -> bool:
         """
-        Check if the events detection already exists.
-        If it exists, load the events.
+        Check if the inverse dynamics already exists and was performed with the same inputs.
+        If it exists, load the tau (and the results of the reintegration if it was performed).
         .
         Returns
         -------
         bool
-            If the events detection already exists
+            If the inverse dynamics already exists
         """
         result_file_full_path = self.get_result_file_full_path()
-        if os.path.exists(result_file_full_path):
-            with open(result_file_full_path, "rb") as file:
-                data = pickle.load(file)
-                self.tau = data["tau"]
-                self.q_reintegrated = data["q_reintegrated"] if data["q_reintegrated"] != 0 else None
-            return True
-        else:
+        data = StageCache.load_if_up_to_date(result_file_full_path, self.input_hash)
+        if data is None:
             return False
+        self.tau = data["tau"]
+        if isinstance(data["q_reintegrated"], np.ndarray):
+            self.q_reintegrated = data["q_reintegrated"]
+            self.reintegration_drift = data["reintegration_drift"]
+        return True
 
     def perform_inverse_dynamics(self):
         tau = np.zeros_like(self.q_filtered)
@@ -114,88 +152,171 @@ class InverseDynamicsPerformer:
             ).to_array()
         self.tau = tau
 
-    def get_f_ext_at_frame(self, i_marker_node: int):
+    def perform_batched_inverse_dynamics(self):
+        """
+        Perform the inverse dynamics on all frames at once with a symbolic function of the model.
+        """
+        biorbd_model_full_path = self.experimental_data.model_creator.biorbd_model_full_path
+        inverse_dynamics = BatchedDynamics.get_inverse_dynamics_function(
+            biorbd_model_full_path, StageCache.hash_file(biorbd_model_full_path), self.platform_segment_names
+        )
+        nb_frames = self.q_filtered.shape[1]
+        f_ext = self.get_f_ext_of_kinematics_frames()
+        self.tau = BatchedDynamics.evaluate(
+            inverse_dynamics,
+            self.nb_threads,
+            self.q_filtered,
+            self.qdot,
+            self.qddot,
+            f_ext.reshape(-1, nb_frames),
+        )
+
+    def get_f_ext_of_kinematics_frames(self) -> np.ndarray:
+        """
+        Get the external forces of the platforms at the marker frames of the kinematics (the kinematics starts at the
+        marker frame kinematics_reconstructor.frame_range.start, not at the first frame of the trial).
+        .
+        Returns
+        -------
+        f_ext: np.ndarray
+            The 9 components (CoP, moments, forces) of the external forces of each platform (nb_platforms x 9 x nb_frames)
+        """
+        frame_range = self.kinematics_reconstructor.frame_range
+        return self.experimental_data.f_ext_sorted_marker_rate[: len(self.platform_segment_names), :, frame_range]
+
+    def get_f_ext_at_frame(self, i_node: int):
         """
         Constructs a biorbd external forces set object at a specific frame.
         .
         Parameters
         ----------
-        i_marker_node: int
-            The marker frame index.
+        i_node: int
+            The index of the frame in the kinematics (the marker frame kinematics_reconstructor.frame_range[i_node]).
         .
         Returns
         -------
         f_ext_set: biorbd externalForceSet
             The external forces set at the frame.
         """
+        i_marker_node = self.kinematics_reconstructor.frame_range[i_node]
+        # Already averaged over the marker frame time lapse
+        return self.get_f_ext_set(self.experimental_data.f_ext_sorted_marker_rate[:, :, i_marker_node])
+
+    def get_f_ext_set(self, f_ext: np.ndarray):
+        """
+        Constructs a biorbd external forces set object from the external forces of the platforms.
+        .
+        Parameters
+        ----------
+        f_ext: np.ndarray
+            The 9 components (CoP, moments, forces) of the external forces of each platform (nb_platforms x 9)
+        .
+        Returns
+        -------
+        f_ext_set: biorbd externalForceSet
+            The external forces set.
+        """
         f_ext_set = self.biorbd_model.externalForceSet()
-        i_analog_node = Operator.from_marker_frame_to_analog_frame(
-            self.experimental_data.analogs_time_vector, self.experimental_data.markers_time_vector, i_marker_node
-        )
-        analog_to_marker_ratio = int(
-            round(
-                self.experimental_data.analogs_time_vector.shape[0]
-                / self.experimental_data.markers_time_vector.shape[0]
-            )
-        )
-        frame_range = list(
-            range(i_analog_node - (int(analog_to_marker_ratio / 2)), i_analog_node + (int(analog_to_marker_ratio / 2)))
-        )
-        # Average over the marker frame time lapse
-        f_ext_set.add(
-            "calcn_l",
-            np.mean(self.experimental_data.f_ext_sorted[0, 3:9, frame_range], axis=0),
-            np.mean(self.experimental_data.f_ext_sorted[0, :3, frame_range], axis=0),
-        )
-        f_ext_set.add(
-            "calcn_r",
-            np.mean(self.experimental_data.f_ext_sorted[1, 3:9, frame_range], axis=0),
-            np.mean(self.experimental_data.f_ext_sorted[1, :3, frame_range], axis=0),
-        )
+        for i_platform, segment_name in enumerate(self.platform_segment_names):
+            f_ext_set.add(segment_name, f_ext[i_platform, 3:9], f_ext[i_platform, :3])
         return f_ext_set
 
-    def reintegrate_dynamics(self):
+    def get_forward_dynamics(self, q: np.ndarray, qdot: np.ndarray, tau: np.ndarray, f_ext: np.ndarray) -> np.ndarray:
         """
-        Reintegrate the dynamics to confirm the results using scipy.
+        Compute the generalized accelerations of several states at once.
+        .
+        Parameters
+        ----------
+        q: np.ndarray
+            The generalized coordinates (nb_q x nb_states)
+        qdot: np.ndarray
+            The generalized velocities (nb_qdot x nb_states)
+        tau: np.ndarray
+            The generalized forces (nb_tau x nb_states)
+        f_ext: np.ndarray
+            The external forces of the platforms (nb_platforms * 9 x nb_states)
+        .
+        Returns
+        -------
+        qddot: np.ndarray
+            The generalized accelerations (nb_qddot x nb_states)
         """
+        if self.batched_flag:
+            biorbd_model_full_path = self.experimental_data.model_creator.biorbd_model_full_path
+            forward_dynamics = BatchedDynamics.get_forward_dynamics_function(
+                biorbd_model_full_path, StageCache.hash_file(biorbd_model_full_path), self.platform_segment_names
+            )
+            return BatchedDynamics.evaluate(forward_dynamics, self.nb_threads, q, qdot, tau, f_ext)
+
+        qddot = np.zeros_like(qdot)
+        for i_state in range(q.shape[1]):
+            f_ext_set = self.get_f_ext_set(f_ext[:, i_state].reshape(-1, 9))
+            qddot[:, i_state] = self.biorbd_model.ForwardDynamics(
+                q[:, i_state], qdot[:, i_state], tau[:, i_state], f_ext_set
+            ).to_array()
+        return qddot
 
-        def dynamics(t, x):
-            i_node = int(np.argmin(np.abs(self.experimental_data.markers_time_vector - t)))
-            q = x[: self.biorbd_model.nbQ()]
-            qdot = x[self.biorbd_model.nbQ() :]
-            u = self.tau[:, i_node]
-            f_ext_biorbd = self.get_f_ext_at_frame(i_node)
-            dqdot = self.biorbd_model.ForwardDynamics(q, qdot, u, f_ext_biorbd).to_array()
-            return np.hstack((qdot, dqdot))
-
-        # Reintegrate the dynamics -> This version explodes my RAM!
-        # t_span = np.array([0, self.experimental_data.markers_time_vector[30]])
-        # x_reintegrated = solve_ivp(dynamics,
-        #                            y0=np.hstack((self.q_filtered[0, :], np.zeros_like(self.q_filtered)[0, :])),
-        #                            t_span=t_span,
-        #                            t_eval=self.experimental_data.markers_time_vector[0:30:3],
-        #                            method="DOP853")
-
-        # Euler integration for now
-        frames_to_reintegrate = range(0, 100)
-
-        nb_frames_to_reintegrate = len(list(frames_to_reintegrate))
+    def reintegrate_dynamics(self):
+        """
+        Reintegrate the dynamics (forward dynamics driven by tau and the external forces) on successive windows to
+        confirm the results. This is a windowed check and not an integration of the whole trial: the open-loop
+        integration of a whole trial diverges, so the integration starts again from the reconstructed kinematics every
+        reintegration_window_length frames. All the windows are integrated together with a fixed-step RK4 (the forward
+        dynamics of all windows is evaluated at once), tau and the external forces being linearly interpolated at the
+        middle of each frame time lapse. Only the reintegrated q is kept, so the memory used is the same as for the
+        kinematics whatever the length of the trial.
+        The drift is the difference between the reintegrated and reconstructed q at the end of each window.
+        """
+        nb_q = self.q_filtered.shape[0]
+        nb_frames = self.q_filtered.shape[1]
         dt = self.experimental_data.markers_dt
-        x_reintegrated = np.zeros((2 * self.biorbd_model.nbQ(), nb_frames_to_reintegrate + 1))
-        x_reintegrated[:, 0] = np.hstack(
-            (self.q_filtered[:, frames_to_reintegrate.start], self.qdot[:, frames_to_reintegrate.start])
+        f_ext = self.get_f_ext_of_kinematics_frames().reshape(-1, nb_frames)
+
+        window_starts = np.arange(0, nb_frames - 1, self.reintegration_window_length)
+        window_ends = np.minimum(window_starts + self.reintegration_window_length, nb_frames - 1)
+        q = self.q_filtered[:, window_starts].copy()
+        qdot = self.qdot[:, window_starts].copy()
+        self.q_reintegrated = np.zeros((nb_q, nb_frames))
+        self.q_reintegrated[:, window_starts] = q
+        for i_step in range(self.reintegration_window_length):
+            # The last window may be shorter, its integration just stops at the last frame
+            frames = np.minimum(window_starts + i_step, nb_frames - 2)
+            is_integrated = window_starts + i_step < window_ends
+            tau_start, tau_end = self.tau[:, frames], self.tau[:, frames + 1]
+            f_ext_start, f_ext_end = f_ext[:, frames], f_ext[:, frames + 1]
+            tau_middle, f_ext_middle = (tau_start + tau_end) / 2, (f_ext_start + f_ext_end) / 2
+
+            qddot_1 = self.get_forward_dynamics(q, qdot, tau_start, f_ext_start)
+            qdot_2 = qdot + dt / 2 * qddot_1
+            qddot_2 = self.get_forward_dynamics(q + dt / 2 * qdot, qdot_2, tau_middle, f_ext_middle)
+            qdot_3 = qdot + dt / 2 * qddot_2
+            qddot_3 = self.get_forward_dynamics(q + dt / 2 * qdot_2, qdot_3, tau_middle, f_ext_middle)
+            qdot_4 = qdot + dt * qddot_3
+            qddot_4 = self.get_forward_dynamics(q + dt * qdot_3, qdot_4, tau_end, f_ext_end)
+            q_next = q + dt / 6 * (qdot + 2 * qdot_2 + 2 * qdot_3 + qdot_4)
+            qdot_next = qdot + dt / 6 * (qddot_1 + 2 * qddot_2 + 2 * qddot_3 + qddot_4)
+
+            q[:, is_integrated] = q_next[:, is_integrated]
+            qdot[:, is_integrated] = qdot_next[:, is_integrated]
+            self.q_reintegrated[:, frames[is_integrated] + 1] = q[:, is_integrated]
+
+        # The first frame of each window is the reconstructed one (the end of the previous window was just overwritten)
+        self.q_reintegrated[:, window_starts] = self.q_filtered[:, window_starts]
+        self.reintegration_drift = q - self.q_filtered[:, window_ends]
+        self.print_reintegration_drift()
+
+    def print_reintegration_drift(self, nb_dofs_to_print: int = 5):
+        """
+        Print the DoFs with the largest RMS drift at the end of the reintegration windows.
+        """
+        rms_drift = np.sqrt(np.mean(self.reintegration_drift**2, axis=1))
+        dof_names = [dof_name.to_string() for dof_name in self.biorbd_model.nameDof()]
+        print(
+            f"Drift of the reintegration after {self.reintegration_window_length} frames "
+            f"(RMS over {self.reintegration_drift.shape[1]} windows):"
         )
-        for i, i_node in enumerate(frames_to_reintegrate):
-            q = x_reintegrated[: self.biorbd_model.nbQ(), i]
-            qdot = x_reintegrated[self.biorbd_model.nbQ() :, i]
-            u = self.tau[:, i_node]
-            f_ext_biorbd = self.get_f_ext_at_frame(i_node)
-            dqdot = self.biorbd_model.ForwardDynamics(q, qdot, u, f_ext_biorbd).to_array()
-            dx = np.hstack((qdot, dqdot))
-            x_reintegrated[:, i + 1] = x_reintegrated[:, i] + dt * dx
-
-        self.q_reintegrated = np.zeros_like(self.q_filtered)
-        self.q_reintegrated[:, list(frames_to_reintegrate)] = x_reintegrated[: self.biorbd_model.nbQ(), :-1]
+        for i_dof in np.argsort(rms_drift)[::-1][:nb_dofs_to_print]:
+            print(f"    {dof_names[i_dof]}: {rms_drift[i_dof]:.4f}")
 
     def animate_dynamics(self):
         """
@@ -220,10 +341,8 @@ class InverseDynamicsPerformer:
         markers = PyoMarkers(data=self.kinematics_reconstructor.markers, channels=marker_names, show_labels=False)
 
         # Add force plates to the animation
-        force_plate_idx = Operator.from_marker_frame_to_analog_frame(
-            self.experimental_data.analogs_time_vector,
-            self.experimental_data.markers_time_vector,
-            list(self.kinematics_reconstructor.frame_range),
+        force_plate_idx = self.experimental_data.time_base.marker_to_analog_frame(
+            list(self.kinematics_reconstructor.frame_range)
         )
         viz.add_force_plate(num=0, corners=self.experimental_data.platform_corners[0])
         viz.add_force_plate(num=1, corners=self.experimental_data.platform_corners[1])
@@ -258,11 +377,23 @@ class InverseDynamicsPerformer:
         """
         Save the inverse dynamics results.
         """
-        if self.q_reintegrated is None:
-            self.q_reintegrated = 0
         result_file_full_path = self.get_result_file_full_path()
+        outputs = self.outputs()
+        if self.q_reintegrated is None:
+            outputs["q_reintegrated"] = 0
+        outputs["input_hash"] = self.input_hash
         with open(result_file_full_path, "wb") as file:
-            pickle.dump(self.outputs(), file)
+            pickle.dump(outputs, file)
+
+    def __getstate__(self):
+        # The biorbd model cannot be sent to the worker processes, it is loaded again from its file
+        state = self.__dict__.copy()
+        state["biorbd_model"] = self.experimental_data.model_creator.biorbd_model_full_path
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.biorbd_model = ModelRegistry.get_biorbd_model(state["biorbd_model"], "inverse_dynamics_performer")
 
     def inputs(self):
         return {
@@ -277,5 +408,6 @@ class InverseDynamicsPerformer:
         return {
             "tau": self.tau,
             "q_reintegrated": self.q_reintegrated,
+            "reintegration_drift": self.reintegration_drift,
             "is_loaded_inverse_dynamics": self.is_loaded_inverse_dynamics,
         }
@@ -1,5 +1,6 @@
 import os
 import pickle
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
 import numpy as np
 import matplotlib.pyplot as plt
@@ -11,6 +12,9 @@ from gait_analyzer.experimental_data import ExperimentalData
 from gait_analyzer.model_creator import ModelCreator
 from gait_analyzer.events.cyclic_events import CyclicEvents
 from gait_analyzer.events.unique_events import UniqueEvents
+from gait_analyzer.utils.stage_cache import StageCache
+from gait_analyzer.utils.batched_dynamics import BatchedDynamics
+from gait_analyzer.utils.model_registry import ModelRegistry
 
 
 class ReconstructionType(Enum):
@@ -23,6 +27,17 @@ class ReconstructionType(Enum):
     TRF = "trf"  # Trust Region Reflective
     EKF = "ekf"  # Extended Kalman Filter
     LSQ = "lsq"  # BioBuddy's Least Squares
+    SEGMENT_WISE = "segment_wise"  # Levenberg-Marquardt segment by segment (see segment_dict), vectorized over frames
+
+
+class DerivativeMethod(Enum):
+    """
+    Method used to compute the filtered joint angles and their derivatives
+    """
+
+    FINITE_DIFFERENCE = "finite_difference"  # Filtering (filter_type) and then centered finite differences
+    SAVGOL = "savgol"  # Derivatives of the Savitzky-Golay polynomials
+    SMOOTHING_SPLINE = "smoothing_spline"  # Derivatives of a cubic smoothing spline (cutoff at filtfilt_cutoff_freq)
 
 
 segment_dict = {
@@ -148,6 +163,10 @@ class KinematicsReconstructor:
         skip_if_existing: bool,
         animate_kinematics_flag: bool,
         plot_kinematics_flag: bool,
+        n_workers: int = 1,
+        derivative_method: DerivativeMethod = DerivativeMethod.FINITE_DIFFERENCE,
+        max_marker_speed: float = 20,
+        max_distance_deviation: float | None = 0.05,
     ):
         """
         Initialize the KinematicsReconstructor.
@@ -164,13 +183,25 @@ class KinematicsReconstructor:
             The range of cycles to analyze
         reconstruction_type: ReconstructionType
             The type of algorithm to use to perform the reconstruction
-            If the reconstruction_type is a list, the kinematics will be first reconstructed with the first element of the list, and then withe the other ones as a fallback if the reconstruction os not acceptable (<5cm error on the 75e percentile).
+            If the reconstruction_type is a list, the kinematics will be first reconstructed with the first element of the list, and then withe the other ones as a fallback if the reconstruction os not acceptable (<5cm error on the 75e percentile). Only the windows of frames which were not acceptable are reconstructed again with the fallback methods.
         skip_if_existing: bool
-            If True, the kinematics will not be reconstructed if the output file already exists
+            If True, the kinematics will not be reconstructed if the output file already exists, and the frames
+            reconstructed in the previous runs are reused. If False, all the frames are reconstructed again.
         animate_kinematics_flag: bool
             If True, the kinematics will be animated through pyorerun
         plot_kinematics_flag: bool
             If True, the kinematics will be plotted and saved in a .png
+        n_workers: int
+            The number of processes used to reconstruct the kinematics. If n_workers > 1, the frames are split into
+            overlapping chunks which are reconstructed in parallel with the first reconstruction_type (the windows
+            reconstructed again with the fallback methods are also reconstructed in parallel).
+        derivative_method: DerivativeMethod
+            The method used to compute the filtered q, qdot, and qddot from the reconstructed q
+        max_marker_speed: float
+            The maximal speed of a marker (m/s). A faster marker is considered inverted and stops the analysis.
+        max_distance_deviation: float | None
+            The maximal difference between the distance of two markers of a segment and its median (m). A larger
+            difference is only reported as a warning. If None, the distances between the markers are not checked.
         """
         # Checks
         if not isinstance(experimental_data, ExperimentalData):
@@ -197,28 +228,85 @@ class KinematicsReconstructor:
             raise ValueError(
                 "reconstruction_type must be an instance of ReconstructionType or a list of ReconstructionType."
             )
+        if not isinstance(n_workers, int) or n_workers < 1:
+            raise ValueError("n_workers must be a positive integer")
+        if n_workers > 1 and ReconstructionType.EKF in self.reconstruction_type:
+            raise NotImplementedError("The EKF reconstruction cannot be performed by chunks, please use n_workers=1.")
+        if not isinstance(derivative_method, DerivativeMethod):
+            raise ValueError("derivative_method must be an instance of DerivativeMethod.")
+        if not isinstance(max_marker_speed, (int, float)) or max_marker_speed <= 0:
+            raise ValueError("max_marker_speed must be a positive float.")
+        if max_distance_deviation is not None and (
+            not isinstance(max_distance_deviation, (int, float)) or max_distance_deviation <= 0
+        ):
+            raise ValueError("max_distance_deviation must be a positive float or None.")
 
         # Initial attributes
         self.experimental_data = experimental_data
         self.model_creator = model_creator
         self.events = events
         self.cycles_to_analyze = cycles_to_analyze
+        self.skip_if_existing = skip_if_existing
+        self.n_workers = n_workers
+        self.derivative_method = derivative_method
+        self.max_marker_speed = max_marker_speed
+        self.max_distance_deviation = max_distance_deviation
 
         # Parameters of the reconstruction
         self.acceptance_threshold = 0.1  # 10 cm
+        self.chunk_size = 1000  # Number of frames kept from each chunk when n_workers > 1
+        self.chunk_overlap = 100  # Number of frames reconstructed on each side of a chunk and then discarded
+        self.fallback_margin = 10  # Number of frames reconstructed on each side of a rejected window by the next method
+
+        # Parameters of the filtering
+        self.filter_type = "savgol"  # "filtfilt"  # "savgol"
+        self.savgol_window_length = 31
+        self.savgol_polyorder = 3
+        self.filtfilt_order = 4
+        self.filtfilt_cutoff_freq = 6  # Hz
 
         # Extended attributes
         self.frame_range = None
         self.padded_frame_range = None
         self.markers = None
         self.marker_residuals = None
-        self.biorbd_model = biorbd.Model(self.model_creator.biorbd_model_full_path)
+        self.biorbd_model = ModelRegistry.get_biorbd_model(
+            self.model_creator.biorbd_model_full_path, "kinematics_reconstructor"
+        )
         self.t = None
         self.q = None
         self.q_filtered = None
         self.qdot = None
         self.qddot = None
         self.is_loaded_kinematics = False
+        self.ekf_qdot = None  # The joint velocities estimated by the EKF (if the first reconstruction_type is EKF)
+        self.ekf_qddot = None
+        self.suspect_marker_windows = None  # The windows of frames where markers seem to be inverted
+        # The frames reconstructed are shared between the runs with different frame ranges
+        self.full_trial_input_hash = StageCache.hash_inputs(
+            self.experimental_data.input_hash,
+            self.reconstruction_type,
+            self.acceptance_threshold,
+            self.fallback_margin,
+            self.chunk_overlap,
+            self.chunk_size if self.n_workers > 1 else None,
+        )
+        self.input_hash = StageCache.hash_inputs(
+            self.experimental_data.input_hash,
+            self.events.input_hash,
+            self.cycles_to_analyze,
+            self.reconstruction_type,
+            self.acceptance_threshold,
+            self.fallback_margin,
+            self.chunk_overlap,
+            self.chunk_size if self.n_workers > 1 else None,
+            self.derivative_method,
+            self.filter_type,
+            self.savgol_window_length,
+            self.savgol_polyorder,
+            self.filtfilt_order,
+            self.filtfilt_cutoff_freq,
+        )
 
         if skip_if_existing and self.check_if_existing():
             self.is_loaded_kinematics = True
@@ -237,7 +325,7 @@ class KinematicsReconstructor:
 
     def check_if_existing(self) -> bool:
         """
-        Check if the kinematics reconstruction already exists.
+        Check if the kinematics reconstruction already exists and was performed with the same inputs.
         If it exists, load the q.
         .
         Returns
@@ -246,87 +334,180 @@ class KinematicsReconstructor:
             If the kinematics reconstruction already exists
         """
         result_file_full_path = self.get_result_file_full_path()
-        if os.path.exists(result_file_full_path):
-            with open(result_file_full_path, "rb") as file:
-                data = pickle.load(file)
-                self.frame_range = data["frame_range"]
-                self.padded_frame_range = data["padded_frame_range"]
-                self.markers = data["markers"]
-                self.cycles_to_analyze = data["cycles_to_analyze_kin"]
-                self.t = data["t"]
-                self.q = data["q"]
-                self.q_filtered = data["q_filtered"]
-                self.qdot = data["qdot"]
-                self.qddot = data["qddot"]
-                self.biorbd_model = biorbd.Model(data["biorbd_model"])
-                if isinstance(data["reconstruction_type"], str):
-                    self.reconstruction_type = ReconstructionType(data["reconstruction_type"])
-                else:
-                    self.reconstruction_type = [
-                        ReconstructionType(i_recons) for i_recons in data["reconstruction_type"]
-                    ]
-                self.is_loaded_kinematics = True
-            return True
-        else:
+        data = StageCache.load_if_up_to_date(result_file_full_path, self.input_hash)
+        if data is None:
             return False
+        self.frame_range = data["frame_range"]
+        self.padded_frame_range = data["padded_frame_range"]
+        self.markers = data["markers"]
+        self.cycles_to_analyze = data["cycles_to_analyze_kin"]
+        self.t = data["t"]
+        self.q = data["q"]
+        self.q_filtered = data["q_filtered"]
+        self.qdot = data["qdot"]
+        self.qddot = data["qddot"]
+        self.biorbd_model = ModelRegistry.get_biorbd_model(data["biorbd_model"], "kinematics_reconstructor")
+        if isinstance(data["reconstruction_type"], str):
+            self.reconstruction_type = ReconstructionType(data["reconstruction_type"])
+        else:
+            self.reconstruction_type = [ReconstructionType(i_recons) for i_recons in data["reconstruction_type"]]
+        self.derivative_method = DerivativeMethod(data["derivative_method"])
+        self.is_loaded_kinematics = True
+        return True
 
-    def check_for_marker_inversion(self):
-        markers = self.experimental_data.markers_sorted
+    @staticmethod
+    def detect_marker_inversions(
+        markers: np.ndarray,
+        marker_names: list[str],
+        marker_sampling_frequency: float,
+        max_marker_speed: float = 20,
+        max_distance_deviation: float | None = 0.05,
+    ) -> list[dict]:
+        """
+        Detect the frames where markers seem to be inverted, for all markers at once:
+        - the speed of each marker between two consecutive valid frames must be below max_marker_speed,
+        - the distance between the markers of a segment (see segment_dict) must stay close to its median over the
+        trial, which catches the label swaps between the markers of a segment that do not produce a large jump.
+        .
+        Parameters
+        ----------
+        markers: np.ndarray
+            The marker positions (3 x nb_markers x nb_frames)
+        marker_names: list[str]
+            The name of the markers
+        marker_sampling_frequency: float
+            The sampling frequency of the markers
+        max_marker_speed: float
+            The maximal speed of a marker (m/s)
+        max_distance_deviation: float | None
+            The maximal difference between the distance of two markers of a segment and its median (m). If None, the
+            distances are not checked.
+        .
+        Returns
+        -------
+        suspect_windows: list[dict]
+            The windows of suspect frames sorted by frame, each described by the check that failed ("velocity" or
+            "segment_distance"), the marker_names involved, the frames (range), and the max_value reached (m/s or m)
+        """
         nb_markers = markers.shape[1]
+        nb_frames = markers.shape[2]
+        is_valid = np.all(~np.isnan(markers), axis=0)  # nb_markers x nb_frames
+        nb_valid_frames = np.sum(is_valid, axis=1)
+        if np.any(nb_valid_frames < 2):
+            marker_name = marker_names[int(np.argmax(nb_valid_frames < 2))]
+            raise RuntimeError(f"Marker {marker_name} was found in less than two frames.")
+        suspect_windows = []
 
-        # Create mask for valid (non-NaN) data - shape: (3, nb_markers, nb_frames)
-        valid_mask = ~np.isnan(markers)
-        marker_valid = np.all(valid_mask, axis=0)  # shape: (nb_markers, nb_frames)
-
-        for i_marker in range(nb_markers):
-            marker_name = self.biorbd_model.markerNames()[i_marker].to_string()
-
-            # Get indices of valid frames for this marker
-            valid_frames = np.where(marker_valid[i_marker, :])[0]
-
-            if len(valid_frames) < 2:
-                raise RuntimeError(f"Marker {marker_name} was only found in two frames.")
-
-            # Extract valid positions for this marker
-            valid_positions = markers[:, i_marker, valid_frames]  # shape: (3, n_valid)
-
-            # Compute distances between consecutive valid positions
-            position_diffs = np.diff(valid_positions, axis=1)  # shape: (3, n_valid-1)
-            distances = np.linalg.norm(position_diffs, axis=0)  # shape: (n_valid-1,)
-
-            # Check for jumps > 20m/s
-            jump_indices = np.where(
-                distances / np.diff(valid_frames) * self.experimental_data.marker_sampling_frequency > 20
-            )[0]
-
-            if len(jump_indices) > 0:
-                # Report the first jump found
-                jump_idx = jump_indices[0]
-                frame_before = valid_frames[jump_idx]
-                frame_after = valid_frames[jump_idx + 1]
-                jump_distance = distances[jump_idx]
-
-                try:
-                    from pyorerun import c3d
-                except:
-                    raise RuntimeError("To animate the kinematics, you must install Pyorerun.")
-
-                c3d(
-                    self.experimental_data.c3d_full_file_path,
-                    show_forces=False,
-                    show_events=False,
-                    marker_trajectories=True,
-                    show_marker_labels=False,
+        # Speed between each valid frame and the previous valid frame of the same marker
+        frames = np.arange(nb_frames)
+        last_valid_frame = np.maximum.accumulate(np.where(is_valid, frames, -1), axis=1)
+        previous_valid_frame = np.full((nb_markers, nb_frames), -1)
+        previous_valid_frame[:, 1:] = last_valid_frame[:, :-1]
+        has_previous_frame = is_valid & (previous_valid_frame >= 0)
+        previous_positions = np.take_along_axis(markers, np.maximum(previous_valid_frame, 0)[np.newaxis, :, :], axis=2)
+        distances = np.linalg.norm(markers - previous_positions, axis=0)
+        speeds = np.zeros((nb_markers, nb_frames))
+        speeds[has_previous_frame] = (
+            distances[has_previous_frame]
+            / (frames - previous_valid_frame)[has_previous_frame]
+            * marker_sampling_frequency
+        )
+        marker_idx, starts, stops = Operator.get_valid_runs(speeds > max_marker_speed)
+        for i_marker, start, stop in zip(marker_idx, starts, stops):
+            suspect_windows += [
+                {
+                    "check": "velocity",
+                    "marker_names": [marker_names[i_marker]],
+                    "frames": range(int(previous_valid_frame[i_marker, start]), int(stop)),
+                    "max_value": float(np.max(speeds[i_marker, start:stop])),
+                }
+            ]
+
+        # Distance between each pair of markers of the same segment
+        segments_to_check = list(segment_dict.values()) if max_distance_deviation is not None else []
+        for segment in segments_to_check:
+            segment_markers_idx = np.array(segment["markers_idx"])
+            if len(segment_markers_idx) < 2 or np.max(segment_markers_idx) >= nb_markers:
+                continue
+            first_idx, second_idx = np.triu_indices(len(segment_markers_idx), k=1)
+            pair_distances = np.linalg.norm(
+                markers[:, segment_markers_idx[first_idx], :] - markers[:, segment_markers_idx[second_idx], :], axis=0
+            )  # nb_pairs x nb_frames
+            has_distance = np.any(~np.isnan(pair_distances), axis=1)
+            median_distances = np.full((len(first_idx), 1), np.nan)
+            median_distances[has_distance, 0] = np.nanmedian(pair_distances[has_distance, :], axis=1)
+            deviations = np.abs(pair_distances - median_distances)
+            is_inconsistent = deviations > max_distance_deviation  # False where a marker is missing
+            _, starts, stops = Operator.get_valid_runs(np.any(is_inconsistent, axis=0)[np.newaxis, :])
+            for start, stop in zip(starts, stops):
+                inconsistent_pairs = np.any(is_inconsistent[:, start:stop], axis=1)
+                involved_markers = np.unique(
+                    np.concatenate(
+                        (
+                            segment_markers_idx[first_idx[inconsistent_pairs]],
+                            segment_markers_idx[second_idx[inconsistent_pairs]],
+                        )
+                    )
                 )
+                suspect_windows += [
+                    {
+                        "check": "segment_distance",
+                        "marker_names": [marker_names[i_marker] for i_marker in involved_markers],
+                        "frames": range(int(start), int(stop)),
+                        "max_value": float(np.nanmax(deviations[:, start:stop])),
+                    }
+                ]
 
-                raise RuntimeError(
-                    f"Marker {marker_name} seems to be inverted between frames "
-                    f"{frame_before} and {frame_after} as the distance is "
-                    f"{jump_distance:.3f} (larger than 10m/s) see the animation to make sure."
+        return sorted(suspect_windows, key=lambda window: window["frames"].start)
+
+    def check_for_marker_inversion(self):
+        """
+        Check that no marker seems to be inverted (see detect_marker_inversions).
+        The markers moving faster than max_marker_speed stop the analysis (the c3d file is animated before raising an
+        error), while the inconsistent distances between the markers of a segment are only reported as warnings.
+        """
+        marker_names = [marker_name.to_string() for marker_name in self.biorbd_model.markerNames()]
+        self.suspect_marker_windows = self.detect_marker_inversions(
+            self.experimental_data.markers_sorted,
+            marker_names,
+            self.experimental_data.marker_sampling_frequency,
+            max_marker_speed=self.max_marker_speed,
+            max_distance_deviation=self.max_distance_deviation,
+        )
+        if len(self.suspect_marker_windows) == 0:
+            print("No marker inversion detected.")
+            return
+
+        velocity_descriptions = []
+        for window in self.suspect_marker_windows:
+            frames = f"between frames {window['frames'].start} and {window['frames'].stop - 1}"
+            if window["check"] == "velocity":
+                velocity_descriptions += [
+                    f"Marker {window['marker_names'][0]} moves at {window['max_value']:.1f} m/s {frames}"
+                ]
+            else:
+                print(
+                    f"Warning: the distance between the markers {window['marker_names']} varies by "
+                    f"{window['max_value']:.3f} m {frames}, some markers may be inverted."
                 )
+        if len(velocity_descriptions) == 0:
+            return
 
-            print(f"Marker {marker_name} OK: max distance = {np.max(distances):.3f} m")
-        return
+        try:
+            from pyorerun import c3d
+        except:
+            raise RuntimeError("To animate the kinematics, you must install Pyorerun.")
+
+        c3d(
+            self.experimental_data.c3d_full_file_path,
+            show_forces=False,
+            show_events=False,
+            marker_trajectories=True,
+            show_marker_labels=False,
+        )
+        raise RuntimeError(
+            "Some markers seem to be inverted, see the animation to make sure:\n" + "\n".join(velocity_descriptions)
+        )
 
     def perform_kinematics_reconstruction(self):
         """
@@ -344,105 +525,574 @@ class KinematicsReconstructor:
             index_to_keep = range(len(self.frame_range))
         markers = self.experimental_data.markers_sorted[:, :, self.padded_frame_range]
 
-        q_recons = np.ndarray((self.biorbd_model.nbQ(), markers.shape[2]))
-        is_successful_reconstruction = False
-
-        residuals = None
-        for recons_method in self.reconstruction_type:
-            print(f"Performing inverse kinematics reconstruction using {recons_method.value}")
-            if recons_method in [ReconstructionType.ONLY_LM, ReconstructionType.LM, ReconstructionType.TRF]:
-                ik = biorbd.InverseKinematics(self.biorbd_model, markers)
-                q_recons = ik.solve(method=recons_method.value)
-                residuals = ik.sol()["residuals"]
-            elif recons_method == ReconstructionType.LSQ:
-                biobuddy_model = biobuddy.BiomechanicalModelReal().from_biomod(
-                    self.model_creator.biorbd_model_full_path
-                )
-                # TODO: Charbie -> Make this modulable
-                q_regularization_weight = np.zeros((self.biorbd_model.nbQ(),))
-                q_regularization_weight[3:6] = 1.0
-                q_regularization_weight[20:23] = 1.0
-                q_recons, residuals = biobuddy_model.inverse_kinematics(
-                    marker_positions=markers,
-                    marker_names=biobuddy_model.marker_names,
-                    marker_weights=self.model_creator.marker_weights,
-                    method="lm",
-                    q_regularization_weight=q_regularization_weight,
-                    q_target=np.zeros((self.biorbd_model.nbQ(),)),
-                    animate_reconstruction=False,
-                    compute_residual_distance=True,
-                )
-            elif recons_method == ReconstructionType.EKF:
-                # TODO: Charbie -> When using the EKF, these qdot and qddot should be used instead of finite difference
-                _, q_recons, _, _ = biorbd.extended_kalman_filter(
-                    self.biorbd_model, self.experimental_data.c3d_full_file_path
-                )
-                residuals = np.zeros_like(markers)
-                raise Warning(
-                    "The EKF acceptance criteria was not implemented yet. Please see the developers if you encounter this warning."
-                )
+        if self.reconstruction_type[0] == ReconstructionType.EKF:
+            # The EKF estimates the joint angles, velocities, and accelerations in a single pass over the frames
+            print(f"Performing inverse kinematics reconstruction using {ReconstructionType.EKF.value}")
+            q_recons, self.ekf_qdot, self.ekf_qddot, residuals = self.solve_extended_kalman_filter(
+                self.model_creator.biorbd_model_full_path, markers, self.experimental_data.marker_sampling_frequency
+            )
+            self.print_residuals(residuals[:, index_to_keep])
+            if self.reconstruct_rejected_frames_again(markers, index_to_keep, None, q_recons, residuals):
+                # The EKF velocities and accelerations do not match the frames reconstructed again anymore
+                print("Some frames were reconstructed again, so qdot and qddot are computed from the joint angles.")
+                self.ekf_qdot = None
+                self.ekf_qddot = None
+        else:
+            # The frames already reconstructed in a previous run (e.g., with other cycles_to_analyze) are reused
+            full_trial_reconstruction = self.load_full_trial_reconstruction()
+            q_recons = full_trial_reconstruction["q"][:, self.padded_frame_range]
+            residuals = full_trial_reconstruction["residuals"][:, self.padded_frame_range]
+            if self.skip_if_existing:
+                is_reconstructed = full_trial_reconstruction["is_reconstructed"][self.padded_frame_range]
             else:
-                raise NotImplementedError(f"The reconstruction_type {recons_method} is not implemented yet.")
+                # The frames are all reconstructed again, and replace the previous ones in the full trial reconstruction
+                is_reconstructed = np.zeros((len(self.padded_frame_range),), dtype=bool)
 
-            # Check if this reconstruction was acceptable
-            residuals = residuals[:, index_to_keep]
-            print(
-                f"75 percentile between : {np.min(np.nanpercentile(residuals, 75, axis=0))} and "
-                f"{np.max(np.nanpercentile(residuals, 75, axis=0))}"
-            )
-            if np.all(np.nanpercentile(residuals, 75, axis=0) < self.acceptance_threshold):
-                is_successful_reconstruction = True
-                break
+            executor = ProcessPoolExecutor(max_workers=self.n_workers) if self.n_workers > 1 else None
+            try:
+                # Reconstruct the missing frames with the first method (by chunks if n_workers > 1)
+                recons_method = self.reconstruction_type[0]
+                if not np.all(is_reconstructed):
+                    print(
+                        f"Performing inverse kinematics reconstruction using {recons_method.value} on "
+                        f"{np.sum(~is_reconstructed)} frames ({np.sum(is_reconstructed)} frames were already reconstructed)"
+                    )
+                    self.reconstruct_missing_frames(
+                        markers, is_reconstructed, recons_method, executor, q_recons, residuals
+                    )
+                self.print_residuals(residuals[:, index_to_keep])
+                self.reconstruct_rejected_frames_again(markers, index_to_keep, executor, q_recons, residuals)
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+
+            # Only the frames of the cycles are kept, the padding frames are not reliable (they may be a lead-in)
+            full_trial_reconstruction["q"][:, self.frame_range] = q_recons[:, index_to_keep]
+            full_trial_reconstruction["residuals"][:, self.frame_range] = residuals[:, index_to_keep]
+            full_trial_reconstruction["is_reconstructed"][self.frame_range] = True
+            self.save_full_trial_reconstruction(full_trial_reconstruction)
 
-        if not is_successful_reconstruction:
+        residuals = residuals[:, index_to_keep]
+        if not self.is_acceptable_reconstruction(residuals):
             raise RuntimeError(
                 "The reconstruction was not successful :( Please consider using a different method or checking the experimental data labeling."
             )
 
         self.q = q_recons[:, index_to_keep]
+        if self.ekf_qdot is not None:
+            self.ekf_qdot = self.ekf_qdot[:, index_to_keep]
+            self.ekf_qddot = self.ekf_qddot[:, index_to_keep]
         self.t = self.experimental_data.markers_time_vector[self.frame_range]
         self.markers = markers[:, :, index_to_keep]
         self.marker_residuals = residuals
 
+    def reconstruct_rejected_frames_again(
+        self,
+        markers: np.ndarray,
+        index_to_keep: range,
+        executor: ProcessPoolExecutor | None,
+        q_recons: np.ndarray,
+        residuals: np.ndarray,
+    ) -> bool:
+        """
+        Reconstruct only the frames which were not acceptable with the next methods of reconstruction_type.
+        q_recons and residuals are modified in place.
+        .
+        Returns
+        -------
+        bool
+            If some frames were reconstructed again
+        """
+        is_reconstructed_again = False
+        for recons_method in self.reconstruction_type[1:]:
+            windows = self.get_windows_to_reconstruct_again(residuals, index_to_keep)
+            if len(windows) == 0:
+                break
+            if recons_method == ReconstructionType.EKF:
+                raise NotImplementedError("The EKF can only be used as the first reconstruction_type.")
+            print(
+                f"Performing inverse kinematics reconstruction using {recons_method.value} on "
+                f"{sum(len(rejected_frames) for _, rejected_frames in windows)} frames ({len(windows)} window(s))"
+            )
+            self.reconstruct_windows_again(markers, windows, recons_method, executor, q_recons, residuals)
+            self.print_residuals(residuals[:, index_to_keep])
+            is_reconstructed_again = True
+        return is_reconstructed_again
+
+    def get_frame_residuals(self, residuals: np.ndarray) -> np.ndarray:
+        """
+        Get the 75th percentile of the marker residuals of each frame (the acceptance criteria of the reconstruction).
+        """
+        if residuals.shape[1] == 0:
+            return np.zeros((0,))
+        return np.nanpercentile(residuals, 75, axis=0)
+
+    def is_acceptable_reconstruction(self, residuals: np.ndarray) -> bool:
+        """
+        Check if the 75th percentile of the marker residuals of each frame is below the acceptance threshold.
+        """
+        return bool(np.all(self.get_frame_residuals(residuals) < self.acceptance_threshold))
+
+    def print_residuals(self, residuals: np.ndarray):
+        frame_residuals = self.get_frame_residuals(residuals)
+        print(
+            f"75 percentile between : {np.min(frame_residuals)} and {np.max(frame_residuals)} "
+            f"({np.sum(~(frame_residuals < self.acceptance_threshold))} frames above {self.acceptance_threshold})"
+        )
+
+    @staticmethod
+    def solve_inverse_kinematics(
+        biorbd_model_full_path: str, marker_weights, recons_method: ReconstructionType, markers: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Reconstruct the joint angles from the marker positions.
+        This method is static so that it can be executed in a worker process.
+        .
+        Parameters
+        ----------
+        biorbd_model_full_path: str
+            The full path of the .bioMod file
+        marker_weights:
+            The weights of the markers (used by ReconstructionType.LSQ)
+        recons_method: ReconstructionType
+            The algorithm to use (all types except ReconstructionType.EKF, see solve_extended_kalman_filter)
+        markers: np.ndarray
+            The marker positions (3 x nb_markers x nb_frames)
+        .
+        Returns
+        -------
+        q_recons: np.ndarray
+            The joint angles (nb_q x nb_frames)
+        residuals: np.ndarray
+            The distance between the experimental and model markers (nb_markers x nb_frames)
+        """
+        biorbd_model = ModelRegistry.get_biorbd_model(biorbd_model_full_path, "kinematics_reconstructor")
+        if recons_method in [ReconstructionType.ONLY_LM, ReconstructionType.LM, ReconstructionType.TRF]:
+            ik = biorbd.InverseKinematics(biorbd_model, markers)
+            q_recons = ik.solve(method=recons_method.value)
+            residuals = ik.sol()["residuals"]
+        elif recons_method == ReconstructionType.LSQ:
+            biobuddy_model = ModelRegistry.get_biobuddy_model(biorbd_model_full_path, "kinematics_reconstructor")
+            # TODO: Charbie -> Make this modulable
+            q_regularization_weight = np.zeros((biorbd_model.nbQ(),))
+            q_regularization_weight[3:6] = 1.0
+            q_regularization_weight[20:23] = 1.0
+            q_recons, residuals = biobuddy_model.inverse_kinematics(
+                marker_positions=markers,
+                marker_names=biobuddy_model.marker_names,
+                marker_weights=marker_weights,
+                method="lm",
+                q_regularization_weight=q_regularization_weight,
+                q_target=np.zeros((biorbd_model.nbQ(),)),
+                animate_reconstruction=False,
+                compute_residual_distance=True,
+            )
+        elif recons_method == ReconstructionType.SEGMENT_WISE:
+            q_recons, residuals = KinematicsReconstructor.solve_segment_wise_inverse_kinematics(
+                biorbd_model_full_path, markers
+            )
+        else:
+            raise NotImplementedError(f"The reconstruction_type {recons_method} is not implemented yet.")
+        return q_recons, residuals
+
+    @staticmethod
+    def solve_extended_kalman_filter(
+        biorbd_model_full_path: str, markers: np.ndarray, marker_sampling_frequency: float
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Reconstruct the joint angles, velocities, and accelerations with biorbd's Extended Kalman Filter, directly from
+        the marker positions in memory. The missing markers are set at the origin, which is how the filter identifies
+        the occluded markers (the residuals of the missing markers are NaN).
+        .
+        Parameters
+        ----------
+        biorbd_model_full_path: str
+            The full path of the .bioMod file
+        markers: np.ndarray
+            The marker positions (3 x nb_markers x nb_frames)
+        marker_sampling_frequency: float
+            The sampling frequency of the markers
+        .
+        Returns
+        -------
+        q_recons: np.ndarray
+            The joint angles (nb_q x nb_frames)
+        qdot_recons: np.ndarray
+            The joint velocities (nb_qdot x nb_frames)
+        qddot_recons: np.ndarray
+            The joint accelerations (nb_qddot x nb_frames)
+        residuals: np.ndarray
+            The distance between the experimental and model markers (nb_markers x nb_frames)
+        """
+        model = ModelRegistry.get_biorbd_model(biorbd_model_full_path, "kinematics_reconstructor")
+        kalman = biorbd.KalmanReconsMarkers(model, biorbd.KalmanParam(marker_sampling_frequency))
+        q = biorbd.GeneralizedCoordinates(model)
+        qdot = biorbd.GeneralizedVelocity(model)
+        qddot = biorbd.GeneralizedAcceleration(model)
+
+        nb_frames = markers.shape[2]
+        q_recons = np.zeros((model.nbQ(), nb_frames))
+        qdot_recons = np.zeros((model.nbQdot(), nb_frames))
+        qddot_recons = np.zeros((model.nbQddot(), nb_frames))
+        model_markers = np.zeros(markers.shape)
+        # biorbd only considers a marker as occluded if it is exactly at the origin (a NaN would propagate to q)
+        markers_without_nan = np.nan_to_num(markers, nan=0.0)
+        for i_frame in range(nb_frames):
+            target_markers = [biorbd.NodeSegment(marker) for marker in markers_without_nan[:, :, i_frame].T]
+            kalman.reconstructFrame(model, target_markers, q, qdot, qddot)
+            q_recons[:, i_frame] = q.to_array()
+            qdot_recons[:, i_frame] = qdot.to_array()
+            qddot_recons[:, i_frame] = qddot.to_array()
+            for i_marker, marker in enumerate(model.markers(q)):
+                model_markers[:, i_marker, i_frame] = marker.to_array()
+        residuals = np.linalg.norm(model_markers - markers, axis=0)
+        return q_recons, qdot_recons, qddot_recons, residuals
+
+    @staticmethod
+    def solve_segment_wise_inverse_kinematics(
+        biorbd_model_full_path: str, markers: np.ndarray, nb_iterations: int = 30
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Reconstruct the joint angles segment by segment (see segment_dict): the pelvis is reconstructed first, and then
+        the segments of each kinematic chain with the DoFs of their parents fixed.
+        Each sub-problem only has a few DoFs and markers, so it is solved with a Levenberg-Marquardt algorithm
+        vectorized over all the frames: the markers and their jacobian are evaluated on all frames in a single call of
+        a symbolic function of the model, and the small normal equations of all frames are solved at once.
+        .
+        Parameters
+        ----------
+        biorbd_model_full_path: str
+            The full path of the .bioMod file (its DoFs and markers must be ordered as in segment_dict)
+        markers: np.ndarray
+            The marker positions (3 x nb_markers x nb_frames)
+        nb_iterations: int
+            The maximal number of Levenberg-Marquardt iterations for each segment
+        .
+        Returns
+        -------
+        q_recons: np.ndarray
+            The joint angles (nb_q x nb_frames)
+        residuals: np.ndarray
+            The distance between the experimental and model markers (nb_markers x nb_frames)
+        """
+        model_hash = StageCache.hash_file(biorbd_model_full_path)
+        model = BatchedDynamics.get_casadi_model(biorbd_model_full_path, model_hash)
+        nb_q = model.nbQ()
+        nb_markers = markers.shape[1]
+        nb_frames = markers.shape[2]
+        max_dof_index = max(max(segment["dof_idx"]) for segment in segment_dict.values())
+        max_marker_index = max(max(segment["markers_idx"]) for segment in segment_dict.values())
+        if max_dof_index >= nb_q or max_marker_index >= nb_markers or nb_markers != model.nbMarkers():
+            raise ValueError(
+                f"The segment-wise reconstruction requires a model with the DoFs and markers of segment_dict, but the "
+                f"model {biorbd_model_full_path} has {nb_q} DoFs and {model.nbMarkers()} markers."
+            )
+
+        q_recons = np.zeros((nb_q, nb_frames))
+        for segment_name, segment in segment_dict.items():
+            dof_indices = segment["dof_idx"]
+            nb_dofs = len(dof_indices)
+            markers_function = BatchedDynamics.get_markers_function(
+                biorbd_model_full_path, model_hash, tuple(segment["markers_idx"]), tuple(dof_indices)
+            )
+            min_bound = np.array(segment["min_bound"])[:, np.newaxis]
+            max_bound = np.array(segment["max_bound"])[:, np.newaxis]
+
+            # The 3 coordinates of the markers are stacked one marker after the other (3 * nb_segment_markers x nb_frames)
+            experimental_markers = markers[:, segment["markers_idx"], :].transpose(1, 0, 2).reshape(-1, nb_frames)
+            is_visible = ~np.isnan(experimental_markers)
+            experimental_markers = np.where(is_visible, experimental_markers, 0)
+
+            def evaluate(q):
+                model_markers, jacobian = BatchedDynamics.evaluate(markers_function, 1, q)
+                jacobian = jacobian.reshape(-1, nb_frames, nb_dofs).transpose(1, 0, 2)  # nb_frames x 3m x nb_dofs
+                residual = np.where(is_visible, experimental_markers - model_markers, 0)
+                return residual, jacobian * is_visible.T[:, :, np.newaxis], np.sum(residual**2, axis=0)
+
+            if segment_name == "pelvis":
+                # Initialize the translations at the center of the pelvis markers
+                residual, _, _ = evaluate(q_recons)
+                nb_visible = np.sum(is_visible.reshape(-1, 3, nb_frames), axis=0)
+                q_recons[:3, :] = np.sum(residual.reshape(-1, 3, nb_frames), axis=0) / np.maximum(nb_visible, 1)
+                q_recons[dof_indices, :] = np.clip(q_recons[dof_indices, :], min_bound, max_bound)
+
+            residual, jacobian, cost = evaluate(q_recons)
+            damping = np.full((nb_frames,), 1e-3)
+            for _ in range(nb_iterations):
+                jacobian_t = jacobian.transpose(0, 2, 1)
+                hessian = jacobian_t @ jacobian
+                gradient = (jacobian_t @ residual.T[:, :, np.newaxis])[:, :, 0]
+                damped_hessian = hessian + damping[:, np.newaxis, np.newaxis] * (
+                    hessian * np.eye(nb_dofs) + np.eye(nb_dofs)
+                )
+                delta = np.linalg.solve(damped_hessian, gradient[:, :, np.newaxis])[:, :, 0].T
+
+                q_new = q_recons.copy()
+                q_new[dof_indices, :] = np.clip(q_recons[dof_indices, :] + delta, min_bound, max_bound)
+                new_residual, new_jacobian, new_cost = evaluate(q_new)
+
+                # Only the frames which improved are updated, the damping is adapted for each frame
+                is_improved = new_cost < cost
+                q_recons[:, is_improved] = q_new[:, is_improved]
+                residual[:, is_improved] = new_residual[:, is_improved]
+                jacobian[is_improved, :, :] = new_jacobian[is_improved, :, :]
+                cost = np.where(is_improved, new_cost, cost)
+                damping = np.clip(np.where(is_improved, damping / 3, damping * 3), 1e-9, 1e9)
+                if np.max(np.abs(delta)) < 1e-8:
+                    break
+
+        # Distance between the experimental and model markers
+        markers_function = BatchedDynamics.get_markers_function(
+            biorbd_model_full_path, model_hash, tuple(range(nb_markers)), ()
+        )
+        model_markers, _ = BatchedDynamics.evaluate(markers_function, 1, q_recons)
+        model_markers = model_markers.reshape(nb_markers, 3, nb_frames).transpose(1, 0, 2)
+        residuals = np.linalg.norm(model_markers - markers, axis=0)
+        return q_recons, residuals
+
+    def get_chunks(self, frames: range, nb_frames: int, chunk_size: int) -> list[tuple[range, range]]:
+        """
+        Split frames into overlapping chunks.
+        .
+        Parameters
+        ----------
+        frames: range
+            The frames to reconstruct
+        nb_frames: int
+            The total number of frames (the chunks are extended by chunk_overlap frames on each side, within the
+            nb_frames)
+        chunk_size: int
+            The number of frames kept from each chunk
+        .
+        Returns
+        -------
+        chunks: list[tuple[range, range]]
+            The frames reconstructed and the frames kept for each chunk (the kept frames of the chunks do not overlap)
+        """
+        chunks = []
+        for start in range(frames.start, frames.stop, chunk_size):
+            kept_frames = range(start, min(start + chunk_size, frames.stop))
+            solved_frames = range(
+                max(kept_frames.start - self.chunk_overlap, 0), min(kept_frames.stop + self.chunk_overlap, nb_frames)
+            )
+            chunks += [(solved_frames, kept_frames)]
+        return chunks
+
+    def solve_inverse_kinematics_on_windows(
+        self,
+        markers: np.ndarray,
+        windows: list[range],
+        recons_method: ReconstructionType,
+        executor: ProcessPoolExecutor | None,
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        Reconstruct several windows of frames independently (in parallel if an executor is provided).
+        .
+        Parameters
+        ----------
+        markers: np.ndarray
+            The marker positions (3 x nb_markers x nb_frames)
+        windows: list[range]
+            The frames of each window
+        recons_method: ReconstructionType
+            The algorithm to use
+        executor: ProcessPoolExecutor | None
+            The executor used to reconstruct the windows in parallel. If None, they are reconstructed sequentially.
+        .
+        Returns
+        -------
+        solutions: list[tuple[np.ndarray, np.ndarray]]
+            The joint angles and the marker residuals of each window
+        """
+        arguments = [
+            (
+                self.model_creator.biorbd_model_full_path,
+                self.model_creator.marker_weights,
+                recons_method,
+                markers[:, :, window],
+            )
+            for window in windows
+        ]
+        if executor is None:
+            return [KinematicsReconstructor.solve_inverse_kinematics(*argument) for argument in arguments]
+        futures = [
+            executor.submit(KinematicsReconstructor.solve_inverse_kinematics, *argument) for argument in arguments
+        ]
+        return [future.result() for future in futures]
+
+    def reconstruct_missing_frames(
+        self,
+        markers: np.ndarray,
+        is_reconstructed: np.ndarray,
+        recons_method: ReconstructionType,
+        executor: ProcessPoolExecutor | None,
+        q_recons: np.ndarray,
+        residuals: np.ndarray,
+    ):
+        """
+        Reconstruct the frames which were not reconstructed yet.
+        Each window of missing frames is extended by chunk_overlap frames on each side, and split into overlapping
+        chunks reconstructed in parallel if an executor is provided. The solver starts each chunk from a cold start
+        (the q already reconstructed are not used as initial guess), the chunk_overlap frames before the kept frames
+        are only a lead-in during which the solver (which initializes each frame with the solution of the previous one)
+        converges. The overlap is then discarded when the chunks are stitched back together.
+        .
+        Parameters
+        ----------
+        markers: np.ndarray
+            The marker positions (3 x nb_markers x nb_frames)
+        is_reconstructed: np.ndarray
+            If each frame was already reconstructed (nb_frames)
+        recons_method: ReconstructionType
+            The algorithm to use
+        executor: ProcessPoolExecutor | None
+            The executor used to reconstruct the chunks in parallel. If None, each window is reconstructed at once.
+        q_recons: np.ndarray
+            The joint angles of all frames (modified in place)
+        residuals: np.ndarray
+            The marker residuals of all frames (modified in place)
+        """
+        nb_frames = markers.shape[2]
+        _, starts, stops = Operator.get_valid_runs(~is_reconstructed[np.newaxis, :])
+        chunks = []
+        for start, stop in zip(starts, stops):
+            chunk_size = self.chunk_size if executor is not None else stop - start
+            chunks += self.get_chunks(range(start, stop), nb_frames, chunk_size)
+        solutions = self.solve_inverse_kinematics_on_windows(
+            markers, [solved_frames for solved_frames, _ in chunks], recons_method, executor
+        )
+        for (solved_frames, kept_frames), (chunk_q, chunk_residuals) in zip(chunks, solutions):
+            kept_in_chunk = slice(kept_frames.start - solved_frames.start, kept_frames.stop - solved_frames.start)
+            q_recons[:, kept_frames] = chunk_q[:, kept_in_chunk]
+            residuals[:, kept_frames] = chunk_residuals[:, kept_in_chunk]
+
+    def get_windows_to_reconstruct_again(
+        self, residuals: np.ndarray, index_to_keep: range
+    ) -> list[tuple[range, range]]:
+        """
+        Get the contiguous windows of frames which were not acceptable.
+        Each window is extended by fallback_margin frames on each side. The solvers do not accept an initial guess, so
+        each window is solved from a cold start (the q of the neighbouring good frames are not used): the
+        fallback_margin frames before the rejected frames are only a lead-in during which the solver (which initializes
+        each frame with the solution of the previous one) converges, and are then discarded.
+        .
+        Parameters
+        ----------
+        residuals: np.ndarray
+            The marker residuals of all the frames reconstructed (nb_markers x nb_frames)
+        index_to_keep: range
+            The frames on which the acceptance of the reconstruction is checked
+        .
+        Returns
+        -------
+        windows: list[tuple[range, range]]
+            The frames to reconstruct and the rejected frames of each window
+        """
+        nb_frames = residuals.shape[1]
+        is_rejected_frame = np.zeros((1, nb_frames), dtype=bool)
+        is_rejected_frame[0, index_to_keep] = ~(
+            self.get_frame_residuals(residuals[:, index_to_keep]) < self.acceptance_threshold
+        )
+        _, starts, stops = Operator.get_valid_runs(is_rejected_frame)
+        return [
+            (
+                range(max(start - self.fallback_margin, 0), min(stop + self.fallback_margin, nb_frames)),
+                range(start, stop),
+            )
+            for start, stop in zip(starts, stops)
+        ]
+
+    def reconstruct_windows_again(
+        self,
+        markers: np.ndarray,
+        windows: list[tuple[range, range]],
+        recons_method: ReconstructionType,
+        executor: ProcessPoolExecutor | None,
+        q_recons: np.ndarray,
+        residuals: np.ndarray,
+    ):
+        """
+        Reconstruct the rejected frames with another method, and keep the new solution of the frames where it is better.
+        .
+        Parameters
+        ----------
+        markers: np.ndarray
+            The marker positions (3 x nb_markers x nb_frames)
+        windows: list[tuple[range, range]]
+            The frames to reconstruct and the rejected frames of each window (see get_windows_to_reconstruct_again)
+        recons_method: ReconstructionType
+            The algorithm to use
+        executor: ProcessPoolExecutor | None
+            The executor used to reconstruct the windows in parallel. If None, they are reconstructed sequentially.
+        q_recons: np.ndarray
+            The joint angles of all frames (modified in place)
+        residuals: np.ndarray
+            The marker residuals of all frames (modified in place)
+        """
+        solutions = self.solve_inverse_kinematics_on_windows(
+            markers, [solved_frames for solved_frames, _ in windows], recons_method, executor
+        )
+        for (solved_frames, rejected_frames), (window_q, window_residuals) in zip(windows, solutions):
+            rejected_in_window = np.arange(rejected_frames.start, rejected_frames.stop) - solved_frames.start
+            rejected_frames = np.arange(rejected_frames.start, rejected_frames.stop)
+            # The frames without residuals (NaN) are considered as the worst
+            previous_frame_residuals = np.nan_to_num(
+                self.get_frame_residuals(residuals[:, rejected_frames]), nan=np.inf
+            )
+            new_frame_residuals = np.nan_to_num(
+                self.get_frame_residuals(window_residuals[:, rejected_in_window]), nan=np.inf
+            )
+            is_better = new_frame_residuals < previous_frame_residuals
+            q_recons[:, rejected_frames[is_better]] = window_q[:, rejected_in_window[is_better]]
+            residuals[:, rejected_frames[is_better]] = window_residuals[:, rejected_in_window[is_better]]
+
     def filter_kinematics(self):
         """
         Unwrap and filter the joint angles.
         """
 
         def filter(q):
-            filter_type = "savgol"  # "filtfilt"  # "savgol"
+            if self.ekf_qdot is not None:
+                # The EKF already estimated smooth joint angles, velocities, and accelerations
+                return q, self.ekf_qdot, self.ekf_qddot
 
-            # Filter q
             sampling_rate = 1 / (self.t[1] - self.t[0])
-            if filter_type == "savgol":
-                q_filtered = Operator.apply_savgol(q, window_length=31, polyorder=3)
-            elif filter_type == "filtfilt":
-                q_filtered = Operator.apply_filtfilt(q, order=4, sampling_rate=sampling_rate, cutoff_freq=6)
+            if self.derivative_method == DerivativeMethod.SAVGOL:
+                return [
+                    Operator.apply_savgol(
+                        q,
+                        window_length=self.savgol_window_length,
+                        polyorder=self.savgol_polyorder,
+                        deriv=deriv,
+                        delta=1 / sampling_rate,
+                    )
+                    for deriv in range(3)
+                ]
+            elif self.derivative_method == DerivativeMethod.SMOOTHING_SPLINE:
+                return [
+                    Operator.apply_smoothing_spline(
+                        q, sampling_rate=sampling_rate, cutoff_freq=self.filtfilt_cutoff_freq, deriv=deriv
+                    )
+                    for deriv in range(3)
+                ]
+
+            # Filter q
+            if self.filter_type == "savgol":
+                q_filtered = Operator.apply_savgol(
+                    q, window_length=self.savgol_window_length, polyorder=self.savgol_polyorder
+                )
+            elif self.filter_type == "filtfilt":
+                q_filtered = Operator.apply_filtfilt(
+                    q, order=self.filtfilt_order, sampling_rate=sampling_rate, cutoff_freq=self.filtfilt_cutoff_freq
+                )
             else:
                 raise NotImplementedError(
-                    f"filter_type {filter_type} not implemented. It must be 'savgol' or 'filtfilt'."
+                    f"filter_type {self.filter_type} not implemented. It must be 'savgol' or 'filtfilt'."
                 )
 
-            # Compute and filter qdot
-            qdot = np.zeros_like(q)
-            for i_data in range(qdot.shape[0]):
-                qdot[i_data, 0] = (q_filtered[i_data, 1] - q_filtered[i_data, 0]) / (
-                    self.t[1] - self.t[0]
-                )  # Forward finite diff
-                qdot[i_data, 1:-1] = (q_filtered[i_data, 2:] - q_filtered[i_data, :-2]) / (
-                    self.t[2:] - self.t[:-2]
-                )  # Centered finite diff
-                qdot[i_data, -1] = (q_filtered[i_data, -1] - q_filtered[i_data, -2]) / (
-                    self.t[-1] - self.t[-2]
-                )  # Backward finite diff
-
-            # Compute and filter qddot
-            qddot = np.zeros_like(q)
-            for i_data in range(qddot.shape[0]):
-                qddot[i_data, 0] = (qdot[i_data, 1] - qdot[i_data, 0]) / (self.t[1] - self.t[0])
-                qddot[i_data, 1:-1] = (qdot[i_data, 2:] - qdot[i_data, :-2]) / (self.t[2:] - self.t[:-2])
-                qddot[i_data, -1] = (qdot[i_data, -1] - qdot[i_data, -2]) / (self.t[-1] - self.t[-2])
-
+            # Compute qdot and qddot
+            qdot = Operator.compute_finite_differences(q_filtered, self.t)
+            qddot = Operator.compute_finite_differences(qdot, self.t)
             return q_filtered, qdot, qddot
 
         self.q_filtered, self.qdot, self.qddot = filter(self.q)
@@ -523,11 +1173,7 @@ class KinematicsReconstructor:
         muscle_names = [m.to_string() for m in self.biorbd_model.muscleNames()]
 
         # Force plates
-        analog_idx = Operator.from_marker_frame_to_analog_frame(
-            self.experimental_data.analogs_time_vector,
-            self.experimental_data.markers_time_vector,
-            list(frame_range),
-        )
+        analog_idx = self.experimental_data.time_base.marker_to_analog_frame(list(frame_range))
 
         # EMGs
         emg_data = []
@@ -566,13 +1212,58 @@ class KinematicsReconstructor:
         result_file_full_path = f"{result_folder}/inv_kin_{trial_name}.pkl"
         return result_file_full_path
 
+    def get_full_trial_reconstruction_file_full_path(self):
+        trial_name = self.experimental_data.c3d_full_file_path.split("/")[-1][:-4]
+        return f"{self.experimental_data.result_folder}/inv_kin_full_{trial_name}.pkl"
+
+    def load_full_trial_reconstruction(self) -> dict:
+        """
+        Load the joint angles and marker residuals of all the frames of the trial reconstructed in the previous runs
+        (with the same marker data, model, and reconstruction parameters, including the chunk_overlap and chunk_size).
+        Only the frames kept in a previous run (not its padding frames) are marked as reconstructed.
+        .
+        Returns
+        -------
+        full_trial_reconstruction: dict
+            The q (nb_q x nb_marker_frames), residuals (nb_markers x nb_marker_frames), and is_reconstructed
+            (nb_marker_frames) of the trial (empty if nothing was reconstructed yet)
+        """
+        data = StageCache.load_if_up_to_date(
+            self.get_full_trial_reconstruction_file_full_path(), self.full_trial_input_hash
+        )
+        if data is not None:
+            return data
+        nb_frames = self.experimental_data.nb_marker_frames
+        return {
+            "q": np.zeros((self.biorbd_model.nbQ(), nb_frames)),
+            "residuals": np.zeros((self.experimental_data.markers_sorted.shape[1], nb_frames)),
+            "is_reconstructed": np.zeros((nb_frames,), dtype=bool),
+        }
+
+    def save_full_trial_reconstruction(self, full_trial_reconstruction: dict):
+        full_trial_reconstruction["input_hash"] = self.full_trial_input_hash
+        with open(self.get_full_trial_reconstruction_file_full_path(), "wb") as file:
+            pickle.dump(full_trial_reconstruction, file)
+
     def save_kinematics_reconstruction(self):
         """
         Save the kinematics reconstruction.
         """
         result_file_full_path = self.get_result_file_full_path()
+        outputs = self.outputs()
+        outputs["input_hash"] = self.input_hash
         with open(result_file_full_path, "wb") as file:
-            pickle.dump(self.outputs(), file)
+            pickle.dump(outputs, file)
+
+    def __getstate__(self):
+        # The biorbd model cannot be sent to the worker processes, it is loaded again from its file
+        state = self.__dict__.copy()
+        state["biorbd_model"] = self.model_creator.biorbd_model_full_path
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.biorbd_model = ModelRegistry.get_biorbd_model(state["biorbd_model"], "kinematics_reconstructor")
 
     def inputs(self):
         return {
@@ -588,6 +1279,7 @@ class KinematicsReconstructor:
         return {
             "biorbd_model": self.model_creator.biorbd_model_full_path,
             "reconstruction_type": reconstruction_type,
+            "derivative_method": self.derivative_method.value,
             "cycles_to_analyze_kin": self.cycles_to_analyze,
             "frame_range": self.frame_range,
             "padded_frame_range": self.padded_frame_range,
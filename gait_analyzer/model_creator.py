@@ -2,9 +2,7 @@ import os
 import pickle
 from copy import deepcopy
 import numpy as np
-import biorbd
 import ezc3d
-from pyomeca import Analogs
 
 from biobuddy import (
     BiomechanicalModelReal,
@@ -24,7 +22,10 @@ from biobuddy import (
     AxisWiseScaling,
     RotoTransMatrix,
 )
+from gait_analyzer.operator import Operator
 from gait_analyzer.subject import Subject
+from gait_analyzer.utils.stage_cache import StageCache
+from gait_analyzer.utils.model_registry import ModelRegistry
 
 
 class OsimModels:
@@ -413,6 +414,7 @@ class ModelCreator:
         skip_if_existing: bool,
         animate_model_flag: bool,
         vtp_geometry_path: str,
+        reuse_existing_model: bool = False,
     ):
         """
         Initialize the ModelCreator.
@@ -433,6 +435,10 @@ class ModelCreator:
             If the model already exists, skip the creation.
         animate_model_flag: bool
             If True, animate the model after creating it.
+        reuse_existing_model: bool
+            If True, an existing model created with the same inputs is used even if skip_if_existing is False (the
+            AnalysisPerformer sets it for the trials following the first trial of a subject, so that the model is
+            created once per subject).
         """
 
         # Checks
@@ -457,6 +463,8 @@ class ModelCreator:
             raise ValueError("animate_model_flag must be a boolean.")
         if not isinstance(vtp_geometry_path, str):
             raise ValueError("vtp_geometry_path must be a string.")
+        if not isinstance(reuse_existing_model, bool):
+            raise ValueError("reuse_existing_model must be a boolean.")
 
         # Initial attributes
         self.subject = subject
@@ -482,11 +490,12 @@ class ModelCreator:
         self.marker_weights = None  # This will be set later by the scale tool
         self.new_model_created = False
         self.mvc_values = None  # This will be set later by the get_mvc_values method
+        self.input_hash = self.get_input_hash()
 
         # Create the models
-        if skip_if_existing and self.check_if_existing():
+        if (skip_if_existing or reuse_existing_model) and self.check_if_existing():
             print(f"The model {self.biorbd_model_full_path} already exists, so it is being used.")
-            self.biorbd_model = biorbd.Model(self.biorbd_model_full_path)
+            self.biorbd_model = ModelRegistry.get_biorbd_model(self.biorbd_model_full_path, "model_creator")
         else:
             print(f"The model {self.biorbd_model_full_path} is being created...")
             self.read_osim_model()
@@ -497,16 +506,31 @@ class ModelCreator:
             else:
                 self.relocate_joint_centers_functionally(animate_model_flag)
             self.create_biorbd_model()
-            self.biorbd_model = biorbd.Model(self.biorbd_model_full_path)
+            self.biorbd_model = ModelRegistry.get_biorbd_model(self.biorbd_model_full_path, "model_creator")
             self.get_mvc_values(plot_emg_flag=False)
             self.save_model()
 
         if animate_model_flag:
             self.animate_model()
 
+    def get_input_hash(self) -> str:
+        """
+        Hash the inputs used to create the model (trials, original OpenSim model, and parameters).
+        """
+        return StageCache.hash_inputs(
+            self.subject.subject_mass,
+            self.osim_model_type.osim_model_name,
+            StageCache.hash_file(self.osim_model_type.original_osim_model_full_path),
+            StageCache.hash_file(self.osim_model_type.xml_setup_file),
+            StageCache.hash_file(self.static_trial),
+            StageCache.hash_folder(self.functional_trials_path) if self.functional_trials_path is not None else None,
+            StageCache.hash_folder(self.mvc_trials_path),
+            self.q_regularization_weight,
+        )
+
     def check_if_existing(self) -> bool:
         """
-        Check if the model already exists.
+        Check if the model already exists and was created with the same inputs.
         If it exists, load the model and the mvc_values.
         .
         Returns
@@ -522,15 +546,15 @@ class ModelCreator:
             + self.subject.subject_name
             + ".pkl"
         )
-        if os.path.exists(result_file_full_path):
-            with open(result_file_full_path, "rb") as file:
-                data = pickle.load(file)
-                self.new_model_created = False
-                self.mvc_values = data["mvc_values"]
-                self.marker_weights = data["marker_weights"]
-            return True
-        else:
+        if not os.path.exists(self.biorbd_model_full_path):
+            return False
+        data = StageCache.load_if_up_to_date(result_file_full_path, self.input_hash)
+        if data is None:
             return False
+        self.new_model_created = False
+        self.mvc_values = data["mvc_values"]
+        self.marker_weights = data["marker_weights"]
+        return True
 
     def read_osim_model(self):
         self.model = BiomechanicalModelReal().from_osim(
@@ -715,19 +739,17 @@ class ModelCreator:
                 if mvc_trial["parameters"]["ANALOG"]["UNITS"]["value"][0] == "V":
                     emg_units = 1_000_000  # Convert to microV
 
-                for name in analog_names:
+                for i_analog, name in enumerate(analog_names):
                     if mvc.endswith(name + ".c3d"):
-                        emg = Analogs.from_c3d(
-                            os.path.join(self.mvc_trials_path, mvc), suffix_delimiter=".", usecols=[name]
-                        )
+                        # Process the EMG signal directly from the analogs already loaded
                         emg_processed = (
-                            emg.meca.interpolate_missing_data()
-                            .meca.band_pass(order=2, cutoff=[10, 425])
-                            .meca.center()
-                            .meca.abs()
-                            .meca.low_pass(order=4, cutoff=5, freq=emg.rate)
-                        ) * emg_units
-                        emg_values[name] = np.array(emg_processed)
+                            Operator.process_emg(
+                                mvc_trial["data"]["analogs"][0, i_analog : i_analog + 1, :],
+                                sampling_rate=mvc_trial["header"]["analogs"]["frame_rate"],
+                            )
+                            * emg_units
+                        )
+                        emg_values[name] = emg_processed
                         mvc_values[name] = float(np.nanmax(emg_processed))
         self.mvc_values = mvc_values
 
@@ -761,8 +783,19 @@ class ModelCreator:
         with open(result_file_full_path, "wb") as file:
             outputs = self.outputs()
             outputs["biorbd_model"] = None  # Remove the biorbd model from the outputs because it is not picklable
+            outputs["input_hash"] = self.input_hash
             pickle.dump(outputs, file)
 
+    def __getstate__(self):
+        # The biorbd model cannot be sent to the worker processes, it is loaded again from its file
+        state = self.__dict__.copy()
+        state["biorbd_model"] = self.biorbd_model_full_path
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.biorbd_model = ModelRegistry.get_biorbd_model(state["biorbd_model"], "model_creator")
+
     def inputs(self):
         return {
             "subject_name": self.subject.subject_name,
@@ -0,0 +1,232 @@
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from gait_analyzer.model_creator import ModelCreator
+from gait_analyzer.kinematics_reconstructor import KinematicsReconstructor
+from gait_analyzer.inverse_dynamics_performer import InverseDynamicsPerformer
+from gait_analyzer.experimental_data import ExperimentalData
+from gait_analyzer.events.cyclic_events import CyclicEvents
+from gait_analyzer.optimal_estimator import OptimalEstimator
+from gait_analyzer.subject import Subject
+
+
+class MultiCycleOptimalEstimator:
+    """
+    This class performs the optimal estimation (see OptimalEstimator) of several cycles of the same trial.
+    One OCP is built and solved per cycle, and the cycles are solved concurrently in worker processes (each OCP using
+    a bounded number of threads). The results of each cycle are saved in its own file, so the cycles already
+    estimated are skipped if skip_if_existing is True.
+    """
+
+    def __init__(
+        self,
+        cycles_to_analyze: list[int] | range,
+        subject: Subject,
+        model_creator: ModelCreator,
+        experimental_data: ExperimentalData,
+        events: CyclicEvents,
+        kinematics_reconstructor: KinematicsReconstructor,
+        inverse_dynamic_performer: InverseDynamicsPerformer,
+        skip_if_existing: bool,
+        n_workers: int = 1,
+        nb_threads_per_cycle: int = 1,
+    ):
+        """
+        Initialize the MultiCycleOptimalEstimator.
+        .
+        Parameters
+        ----------
+        cycles_to_analyze: list[int] | range
+            The number of the cycles to analyze.
+        subject: Subject
+            The subject to analyze.
+        model_creator: ModelCreator
+            The model creator for this subject.
+        experimental_data: ExperimentalData
+            The experimental data to match.
+        events: CyclicEvents
+            The events of the gait cycle to split the trial into appropriate phases.
+        kinematics_reconstructor: KinematicsReconstructor
+            The kinematics reconstructor to use.
+        inverse_dynamic_performer: InverseDynamicsPerformer
+            The inverse dynamics performer to use.
+        skip_if_existing: bool
+            If True, the cycles for which the results already exist are not estimated again.
+        n_workers: int
+            The number of cycles estimated concurrently (each in its own process). If 1, the cycles are estimated one
+            after the other in this process.
+        nb_threads_per_cycle: int
+            The number of threads used by the OCP of each cycle (the total number of threads is
+            n_workers * nb_threads_per_cycle). When n_workers > 1, the threads of the native libraries of each worker
+            process are also limited to this number (see limit_threads).
+        """
+
+        # Checks
+        if not isinstance(cycles_to_analyze, (list, range)) or not all(
+            isinstance(cycle, int) for cycle in cycles_to_analyze
+        ):
+            raise ValueError("cycles_to_analyze must be a list or a range of int")
+        if len(cycles_to_analyze) == 0:
+            raise ValueError("cycles_to_analyze must contain at least one cycle")
+        if not isinstance(events, CyclicEvents):
+            raise ValueError("events must be an CyclicEvents")
+        if not isinstance(skip_if_existing, bool):
+            raise ValueError("skip_if_existing must be a boolean")
+        if not isinstance(n_workers, int) or n_workers < 1:
+            raise ValueError("n_workers must be a positive integer")
+        if not isinstance(nb_threads_per_cycle, int) or nb_threads_per_cycle < 1:
+            raise ValueError("nb_threads_per_cycle must be a positive integer")
+
+        # Initial attributes
+        self.cycles_to_analyze = list(cycles_to_analyze)
+        self.subject = subject
+        self.model_creator = model_creator
+        self.experimental_data = experimental_data
+        self.events = events
+        self.kinematics_reconstructor = kinematics_reconstructor
+        self.inverse_dynamic_performer = inverse_dynamic_performer
+        self.skip_if_existing = skip_if_existing
+        self.n_workers = n_workers
+        self.nb_threads_per_cycle = nb_threads_per_cycle
+
+        # Extended attributes
+        self.cycle_results = {}  # {cycle: outputs of the OptimalEstimator}
+        self.cycle_status = {}  # {cycle: "CVG", "DVG", or the traceback of the error}
+
+        # Execution
+        print(f"Performing optimal estimation of {len(self.cycles_to_analyze)} cycles...")
+        # The model without contacts is generated once here instead of concurrently by each cycle
+        OptimalEstimator.generate_no_contacts_model(self.model_creator.biorbd_model_full_path)
+        self.estimate_cycles()
+        self.print_status()
+
+    @staticmethod
+    def limit_threads(nb_threads: int):
+        """
+        Limit the number of threads of the native libraries in a worker process (initializer of the
+        ProcessPoolExecutor), so that the n_workers processes do not each use all the cores.
+        The environment variables are read by the libraries loaded afterward (e.g., the OpenMP linear solver of IPOPT,
+        which is only loaded when the OCP is solved), and the libraries already loaded (e.g., the BLAS of numpy) are
+        limited using threadpoolctl if it is installed.
+        .
+        Parameters
+        ----------
+        nb_threads: int
+            The maximal number of threads of each native library
+        """
+        for variable in ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]:
+            os.environ[variable] = str(nb_threads)
+        try:
+            from threadpoolctl import threadpool_limits
+        except ImportError:
+            return
+        threadpool_limits(limits=nb_threads)
+
+    @staticmethod
+    def estimate_cycle(
+        cycle_to_analyze: int,
+        subject: Subject,
+        model_creator: ModelCreator,
+        experimental_data: ExperimentalData,
+        events: CyclicEvents,
+        kinematics_reconstructor: KinematicsReconstructor,
+        inverse_dynamic_performer: InverseDynamicsPerformer,
+        skip_if_existing: bool,
+        nb_threads: int,
+    ) -> dict:
+        """
+        Perform the optimal estimation of one cycle.
+        This method is static so that it can be executed in a worker process.
+        .
+        Returns
+        -------
+        outputs: dict
+            The outputs of the OptimalEstimator of this cycle
+        """
+        optimal_estimator = OptimalEstimator(
+            cycle_to_analyze=cycle_to_analyze,
+            subject=subject,
+            model_creator=model_creator,
+            experimental_data=experimental_data,
+            events=events,
+            kinematics_reconstructor=kinematics_reconstructor,
+            inverse_dynamic_performer=inverse_dynamic_performer,
+            plot_solution_flag=False,
+            animate_solution_flag=False,
+            skip_if_existing=skip_if_existing,
+            nb_threads=nb_threads,
+            show_online_optim_flag=False,
+        )
+        return optimal_estimator.outputs()
+
+    def estimate_cycles(self):
+        """
+        Estimate all the cycles (concurrently if n_workers > 1). The cycles which failed do not stop the others, their
+        error is stored in cycle_status.
+        """
+        arguments = {
+            cycle: (
+                cycle,
+                self.subject,
+                self.model_creator,
+                self.experimental_data,
+                self.events,
+                self.kinematics_reconstructor,
+                self.inverse_dynamic_performer,
+                self.skip_if_existing,
+                self.nb_threads_per_cycle,
+            )
+            for cycle in self.cycles_to_analyze
+        }
+
+        if self.n_workers == 1:
+            for cycle in self.cycles_to_analyze:
+                try:
+                    self.store_cycle_results(cycle, self.estimate_cycle(*arguments[cycle]))
+                except Exception:
+                    self.cycle_status[cycle] = traceback.format_exc()
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=self.n_workers, initializer=self.limit_threads, initargs=(self.nb_threads_per_cycle,)
+        ) as executor:
+            futures = {executor.submit(self.estimate_cycle, *arguments[cycle]): cycle for cycle in arguments}
+            for future in as_completed(futures):
+                cycle = futures[future]
+                try:
+                    self.store_cycle_results(cycle, future.result())
+                except Exception:
+                    self.cycle_status[cycle] = traceback.format_exc()
+
+    def store_cycle_results(self, cycle: int, outputs: dict):
+        self.cycle_results[cycle] = outputs
+        self.cycle_status[cycle] = outputs["opt_status"]
+
+    def print_status(self):
+        nb_converged = sum(status == "CVG" for status in self.cycle_status.values())
+        print(f"{nb_converged}/{len(self.cycles_to_analyze)} cycles converged.")
+        for cycle in self.cycles_to_analyze:
+            if self.cycle_status[cycle] not in ["CVG", "DVG"]:
+                print(f"The optimal estimation of the cycle {cycle} failed:\n{self.cycle_status[cycle]}")
+            elif self.cycle_status[cycle] == "DVG":
+                print(f"The optimal estimation of the cycle {cycle} did not converge.")
+
+    def inputs(self):
+        return {
+            "cycles_to_analyze": self.cycles_to_analyze,
+            "biorbd_model_path": self.model_creator.biorbd_model_full_path,
+            "experimental_data": self.experimental_data,
+            "events": self.events,
+            "kinematics_reconstructor": self.kinematics_reconstructor,
+        }
+
+    def outputs(self):
+        return {
+            "cycles_to_analyze_opt": self.cycles_to_analyze,
+            "opt_status_per_cycle": [self.cycle_status[cycle] for cycle in self.cycles_to_analyze],
+            "optimal_estimation_per_cycle": {
+                f"cycle_{cycle}": {key: value for key, value in outputs.items() if value is not None}
+                for cycle, outputs in self.cycle_results.items()
+            },
+        }
@@ -1,5 +1,9 @@
+from functools import lru_cache
 import numpy as np
-from scipy.signal import butter, filtfilt, savgol_filter
+from scipy.signal import butter, filtfilt, savgol_filter, sosfiltfilt
+from scipy.interpolate import make_smoothing_spline
+
+from gait_analyzer.time_base import TimeBase
 
 
 class Operator:
@@ -7,12 +11,14 @@ class Operator:
     @staticmethod
     def moving_average(x: np.array, window_size: int):
         """
-        Compute the moving average of a signal
+        Compute the centered moving average of a signal.
+        At the edges, the average is computed on the part of the window which is inside the signal. The windows
+        containing a NaN are NaN.
         .
         Parameters
         ----------
         x: np.array
-            The signal to be averaged (for now, this can only be a vector)
+            The signal to be averaged (nb_frames vector, or ... x nb_frames array averaged along the last axis)
         window_size: int
             The size of the window to compute the average on
         .
@@ -24,60 +30,214 @@ class Operator:
         # Checks
         if window_size % 2 == 0:
             raise ValueError("window_size must be an odd number")
-        if len(x.shape) != 1:
-            if len(x.shape) == 2 and x.shape[1] == 1:
-                x = x.flatten()
-            else:
-                raise ValueError("x must be a vector")
-        if x.shape[0] / 2 < window_size:
+        if len(x.shape) == 2 and x.shape[1] == 1:
+            x = x.flatten()
+        if x.shape[-1] / 2 < window_size:
             raise ValueError("window_size must be smaller than half of the length of the signal")
 
-        # Compute the moving average
-        x_averaged = np.zeros_like(x)
-        for i in range(len(x)):
-            if i < window_size // 2:
-                x_averaged[i] = np.mean(x[: i + window_size // 2 + 1])
-            elif i >= len(x) - window_size // 2:
-                x_averaged[i] = np.mean(x[i - window_size // 2 :])
-            else:
-                x_averaged[i] = np.mean(x[i - window_size // 2 : i + window_size // 2 + 1])
-        return x_averaged
+        # Compute the moving average from the cumulative sum (x[lo:hi].sum() = cumsum[hi] - cumsum[lo])
+        nb_frames = x.shape[-1]
+        half_window = window_size // 2
+        is_nan = np.isnan(x)
+        cumulative_sum = np.zeros(x.shape[:-1] + (nb_frames + 1,))
+        np.cumsum(np.where(is_nan, 0, x), axis=-1, out=cumulative_sum[..., 1:])
+        # The NaNs are counted so that only the windows containing a NaN are NaN
+        cumulative_nb_nans = np.zeros(x.shape[:-1] + (nb_frames + 1,), dtype=int)
+        np.cumsum(is_nan, axis=-1, out=cumulative_nb_nans[..., 1:])
+        frames = np.arange(nb_frames)
+        lower_bounds = np.maximum(frames - half_window, 0)
+        upper_bounds = np.minimum(frames + half_window + 1, nb_frames)
+        x_averaged = (cumulative_sum[..., upper_bounds] - cumulative_sum[..., lower_bounds]) / (
+            upper_bounds - lower_bounds
+        )
+        x_averaged[(cumulative_nb_nans[..., upper_bounds] - cumulative_nb_nans[..., lower_bounds]) > 0] = np.nan
+        # Same type as the signal (as np.zeros_like(x) filled with the averages)
+        return x_averaged.astype(x.dtype, copy=False)
 
     @staticmethod
-    def apply_filtfilt(data: np.ndarray, order: int, sampling_rate: int, cutoff_freq: int):
+    @lru_cache(maxsize=None)
+    def get_butter_sos(order: int, cutoff_freq: float, sampling_rate: float, btype: str = "low") -> np.ndarray:
+        """
+        Design a digital Butterworth filter in second-order sections.
+        The designs are cached since the same filters are applied to every trial.
+        .
+        Parameters
+        ----------
+        order: int
+            The order of the Butterworth filter
+        cutoff_freq: float
+            The cutoff frequency of the filter in Hz
+        sampling_rate: float
+            The sampling rate of the data in Hz
+        btype: str
+            The type of filter ("low", "high")
+        .
+        Returns
+        -------
+        sos: np.ndarray
+            The second-order sections of the filter (it is shared between the calls, so it must not be modified)
+        """
+        nyquist = 0.5 * sampling_rate
+        return butter(order, cutoff_freq / nyquist, btype=btype, analog=False, output="sos")
+
+    @staticmethod
+    def get_valid_runs(is_valid: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Get the contiguous runs of valid frames of all channels at once (run-length encoding).
+        .
+        Parameters
+        ----------
+        is_valid: np.ndarray
+            If each frame of each channel is valid (nb_channels x nb_frames)
+        .
+        Returns
+        -------
+        channel_idx: np.ndarray
+            The channel of each run
+        starts: np.ndarray
+            The first frame of each run
+        stops: np.ndarray
+            The frame after the last frame of each run
+        """
+        padded = np.zeros((is_valid.shape[0], is_valid.shape[1] + 2), dtype=np.int8)
+        padded[:, 1:-1] = is_valid
+        changes = np.diff(padded, axis=1)
+        # np.nonzero returns the indices sorted by channel then frame, so the starts and stops are aligned
+        channel_idx, starts = np.nonzero(changes == 1)
+        _, stops = np.nonzero(changes == -1)
+        return channel_idx, starts, stops
+
+    @staticmethod
+    def interpolate_short_gaps(channels: np.ndarray, max_gap_length: int) -> np.ndarray:
+        """
+        Linearly interpolate the gaps (NaN runs) of at most max_gap_length frames which are surrounded by valid frames.
+        .
+        Parameters
+        ----------
+        channels: np.ndarray
+            The data (nb_channels x nb_frames)
+        max_gap_length: int
+            The maximal number of consecutive missing frames to interpolate
+        .
+        Returns
+        -------
+        interpolated_channels: np.ndarray
+            A copy of the data with the short gaps interpolated
+        """
+        interpolated_channels = np.array(channels, dtype=float)
+        channel_idx, starts, stops = Operator.get_valid_runs(np.isnan(channels))
+        gap_lengths = stops - starts
+        is_short_interior_gap = (starts > 0) & (stops < channels.shape[1]) & (gap_lengths <= max_gap_length)
+        channel_idx = channel_idx[is_short_interior_gap]
+        starts = starts[is_short_interior_gap]
+        stops = stops[is_short_interior_gap]
+        gap_lengths = gap_lengths[is_short_interior_gap]
+        if gap_lengths.shape[0] == 0:
+            return interpolated_channels
+
+        # Index of each missing frame in its gap
+        gap_of_each_frame = np.repeat(np.arange(gap_lengths.shape[0]), gap_lengths)
+        frame_in_gap = np.arange(gap_of_each_frame.shape[0]) - np.repeat(
+            np.cumsum(gap_lengths) - gap_lengths, gap_lengths
+        )
+        left_values = channels[channel_idx, starts - 1][gap_of_each_frame]
+        right_values = channels[channel_idx, stops][gap_of_each_frame]
+        ratio = (frame_in_gap + 1) / (gap_lengths[gap_of_each_frame] + 1)
+        interpolated_channels[channel_idx[gap_of_each_frame], starts[gap_of_each_frame] + frame_in_gap] = (
+            left_values + (right_values - left_values) * ratio
+        )
+        return interpolated_channels
+
+    @staticmethod
+    def apply_per_valid_run(data: np.ndarray, filter_function, max_gap_to_interpolate: int = 0) -> np.ndarray:
+        """
+        Apply a filter along the last axis of the data on each contiguous run of valid (non-NaN) frames separately, so
+        that the filter is never applied across a gap.
+        The runs sharing the same first and last frames (e.g., the three coordinates of an occluded marker) are filtered
+        together in a single vectorized call.
+        .
+        Parameters
+        ----------
+        data: np.ndarray
+            The data to be filtered (... x nb_frames)
+        filter_function: Callable
+            The function filtering a nb_channels x nb_run_frames array along its last axis
+        max_gap_to_interpolate: int
+            The gaps of at most this number of frames are linearly interpolated before filtering (they are then part
+            of the filtered signal). If 0, no gap is interpolated.
+        .
+        Returns
+        -------
+        filtered_data: np.ndarray
+            The filtered data (NaN where the data was NaN and was not interpolated)
+        """
+        channels = np.asarray(data, dtype=float).reshape(-1, data.shape[-1])
+        is_valid = ~np.isnan(channels)
+        if np.all(is_valid):
+            return filter_function(channels).reshape(data.shape)
+
+        if max_gap_to_interpolate > 0:
+            channels = Operator.interpolate_short_gaps(channels, max_gap_to_interpolate)
+            is_valid = ~np.isnan(channels)
+
+        filtered_channels = np.zeros_like(channels)
+        filtered_channels[:, :] = np.nan
+        channel_idx, starts, stops = Operator.get_valid_runs(is_valid)
+        run_keys, run_idx = np.unique(starts * (channels.shape[1] + 1) + stops, return_inverse=True)
+        for i_run, run_key in enumerate(run_keys):
+            start, stop = divmod(int(run_key), channels.shape[1] + 1)
+            this_channel_idx = channel_idx[run_idx == i_run]
+            filtered_channels[this_channel_idx, start:stop] = filter_function(channels[this_channel_idx, start:stop])
+        return filtered_channels.reshape(data.shape)
+
+    @staticmethod
+    def apply_filtfilt(
+        data: np.ndarray, order: int, sampling_rate: int, cutoff_freq: int, max_gap_to_interpolate: int = 0
+    ):
         """
         TODO: @ophlariviere -> This was taken from biomechanics tools, could you provide a ref for it ?
         .
-        Apply a low-pass Butterworth filter to the data using scipy.filtfilt
+        Apply a zero-phase low-pass Butterworth filter to the data using scipy.sosfiltfilt
         .
         Parameters
         ----------
         data: np.ndarray
-            The data to be filtered (for now, this can only be a nb_data x nb_frames array)
+            The data to be filtered (nb_data x nb_frames or nb_platforms x nb_data x nb_frames array, the filter is
+            applied along the last axis on each run of non-NaN frames separately)
         order: int
             The order of the Butterworth filter
         sampling_rate: int
             The sampling rate of the data in Hz
         cutoff_freq: int
             The cutoff frequency of the filter in Hz
+        max_gap_to_interpolate: int
+            The gaps of at most this number of frames are linearly interpolated before filtering
         .
         Returns
         -------
         filtered_data: np.ndarray
-            The filtered data
+            The filtered data (the runs not longer than the padding of the filter are not filtered)
         """
-        nyquist = 0.5 * sampling_rate
-        normal_cutoff = cutoff_freq / nyquist
-        b, a = butter(order, normal_cutoff, btype="low", analog=False)
-        filtered_data = np.zeros_like(data)
-        filtered_data[:, :] = np.nan
-        for i_data in range(data.shape[0]):
-            non_nan_idx = ~np.isnan(data[i_data, :])
-            filtered_data[i_data, non_nan_idx] = filtfilt(b, a, data[i_data, non_nan_idx], axis=0)
-        return filtered_data
+        sos = Operator.get_butter_sos(order, float(cutoff_freq), float(sampling_rate))
+        # Same default padding as scipy.signal.sosfiltfilt
+        padlen = 3 * (2 * sos.shape[0] + 1 - min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum()))
+
+        def filter_function(channels):
+            if channels.shape[-1] <= padlen:
+                return channels
+            return sosfiltfilt(sos, channels, axis=-1, padlen=padlen)
+
+        return Operator.apply_per_valid_run(data, filter_function, max_gap_to_interpolate)
 
     @staticmethod
-    def apply_savgol(data: np.ndarray, window_length: int, polyorder: int):
+    def apply_savgol(
+        data: np.ndarray,
+        window_length: int,
+        polyorder: int,
+        max_gap_to_interpolate: int = 0,
+        deriv: int = 0,
+        delta: float = 1.0,
+    ):
         """
         TODO: @ophlariviere -> This was taken from biomechanics tools, could you provide a ref for it ?
         .
@@ -86,25 +246,172 @@ class Operator:
         Parameters
         ----------
         data: np.ndarray
-            The data to be filtered (for now, this can only be a nb_data x nb_frames array)
+            The data to be filtered (nb_data x nb_frames or nb_platforms x nb_data x nb_frames array, the filter is
+            applied along the last axis on each run of non-NaN frames separately)
         window_length: int
-            The length of the filter window
+            The length of the filter window (the runs shorter than the window are not filtered)
         polyorder: int
             The order of the polynomial to fit
+        max_gap_to_interpolate: int
+            The gaps of at most this number of frames are linearly interpolated before filtering
+        deriv: int
+            The order of the derivative to compute from the fitted polynomials (0 to only filter the data)
+        delta: float
+            The time between two frames (only used if deriv > 0)
         .
         Returns
         -------
         filtered_data: np.ndarray
-            The filtered data
-        """
-        filtered_data = np.zeros_like(data)
-        filtered_data[:, :] = np.nan
-        for i_data in range(data.shape[0]):
-            non_nan_idx = ~np.isnan(data[i_data, :])
-            filtered_data[i_data, non_nan_idx] = savgol_filter(
-                data[i_data, non_nan_idx], window_length=window_length, polyorder=polyorder, axis=0
+            The filtered data (or its derivative, NaN on the runs shorter than the window if deriv > 0)
+        """
+
+        def filter_function(channels):
+            if channels.shape[-1] < window_length:
+                return channels if deriv == 0 else np.full_like(channels, np.nan)
+            return savgol_filter(
+                channels, window_length=window_length, polyorder=polyorder, deriv=deriv, delta=delta, axis=-1
             )
-        return filtered_data
+
+        return Operator.apply_per_valid_run(data, filter_function, max_gap_to_interpolate)
+
+    @staticmethod
+    def apply_smoothing_spline(
+        data: np.ndarray, sampling_rate: float, cutoff_freq: float, deriv: int = 0, max_gap_to_interpolate: int = 0
+    ):
+        """
+        Fit a cubic smoothing spline to the data and evaluate it (or its derivatives) at each frame.
+        The smoothing spline minimizes sum((y - g)**2) + lam * integral(g''**2), which behaves as a zero-phase low-pass
+        filter of gain 1 / (1 + lam / sampling_rate * (2 * pi * f)**4), so lam is chosen to have a gain of 1/2 at
+        cutoff_freq. All the channels sharing the same valid frames are fitted at once.
+        .
+        Parameters
+        ----------
+        data: np.ndarray
+            The data to be filtered (nb_data x nb_frames array, the spline is fitted along the last axis on each run of
+            non-NaN frames separately)
+        sampling_rate: float
+            The sampling rate of the data in Hz
+        cutoff_freq: float
+            The cutoff frequency of the equivalent low-pass filter in Hz
+        deriv: int
+            The order of the derivative to evaluate (0 to only filter the data)
+        max_gap_to_interpolate: int
+            The gaps of at most this number of frames are linearly interpolated before fitting
+        .
+        Returns
+        -------
+        filtered_data: np.ndarray
+            The filtered data (or its derivative, the runs shorter than 5 frames are not filtered, or NaN if deriv > 0)
+        """
+        lam = sampling_rate / (2 * np.pi * cutoff_freq) ** 4
+
+        def filter_function(channels):
+            nb_frames = channels.shape[-1]
+            if nb_frames < 5:
+                return channels if deriv == 0 else np.full_like(channels, np.nan)
+            time_vector = np.arange(nb_frames) / sampling_rate
+            spline = make_smoothing_spline(time_vector, channels, lam=lam, axis=-1)
+            return spline(time_vector, nu=deriv)
+
+        return Operator.apply_per_valid_run(data, filter_function, max_gap_to_interpolate)
+
+    @staticmethod
+    def compute_finite_differences(data: np.ndarray, time_vector: np.ndarray) -> np.ndarray:
+        """
+        Compute the time derivative of the data with centered finite differences (forward and backward finite
+        differences on the first and last frames), for all the channels at once.
+        .
+        Parameters
+        ----------
+        data: np.ndarray
+            The data to differentiate (... x nb_frames)
+        time_vector: np.ndarray
+            The time of each frame
+        .
+        Returns
+        -------
+        data_derivative: np.ndarray
+            The time derivative of the data (... x nb_frames)
+        """
+        data_derivative = np.zeros_like(data)
+        data_derivative[..., 0] = (data[..., 1] - data[..., 0]) / (time_vector[1] - time_vector[0])
+        data_derivative[..., 1:-1] = (data[..., 2:] - data[..., :-2]) / (time_vector[2:] - time_vector[:-2])
+        data_derivative[..., -1] = (data[..., -1] - data[..., -2]) / (time_vector[-1] - time_vector[-2])
+        return data_derivative
+
+    @staticmethod
+    def process_emg(
+        emg: np.ndarray,
+        sampling_rate: float,
+        band_pass_cutoff: tuple[float, float] = (10, 425),
+        band_pass_order: int = 2,
+        low_pass_cutoff: float = 5,
+        low_pass_order: int = 4,
+    ) -> np.ndarray:
+        """
+        Compute the envelope of raw EMG signals directly on the analog array (without reading the c3d file again).
+        The treatment is the same as pyomeca's:
+        emg.meca.interpolate_missing_data().meca.band_pass().meca.center().meca.abs().meca.low_pass()
+        .
+        Parameters
+        ----------
+        emg: np.ndarray
+            The raw EMG signals (nb_muscles x nb_analog_frames)
+        sampling_rate: float
+            The sampling rate of the EMG signals in Hz
+        band_pass_cutoff: tuple[float, float]
+            The cutoff frequencies of the band-pass Butterworth filter in Hz
+        band_pass_order: int
+            The order of the band-pass Butterworth filter
+        low_pass_cutoff: float
+            The cutoff frequency of the low-pass Butterworth filter used to compute the envelope in Hz
+        low_pass_order: int
+            The order of the low-pass Butterworth filter used to compute the envelope
+        .
+        Returns
+        -------
+        emg_envelope: np.ndarray
+            The envelope of the EMG signals (nb_muscles x nb_analog_frames). It is NaN before the first and after the
+            last recorded frame of each muscle.
+        """
+        # Checks
+        if len(emg.shape) != 2:
+            raise ValueError("emg must be a nb_muscles x nb_analog_frames array")
+
+        # The missing data inside the signals are interpolated, but the missing data at the beginning and end of the
+        # trial stay NaN (as with pyomeca), so that a missing EMG is not mistaken for a muscle at rest
+        emg = np.array(emg, dtype=float)
+        emg_envelope = np.full_like(emg, np.nan)
+        nyquist = sampling_rate / 2
+        b_band_pass, a_band_pass = butter(band_pass_order, np.array(band_pass_cutoff) / nyquist, btype="bandpass")
+        b_low_pass, a_low_pass = butter(low_pass_order, low_pass_cutoff / nyquist, btype="low")
+        padlen = 3 * max(len(a_band_pass), len(b_band_pass), len(a_low_pass), len(b_low_pass))
+
+        # The muscles recorded on the same frames are processed together
+        is_valid = ~np.isnan(emg)
+        nb_frames = emg.shape[1]
+        starts = np.argmax(is_valid, axis=1)
+        stops = nb_frames - np.argmax(is_valid[:, ::-1], axis=1)
+        spans = {}
+        for i_muscle in np.where(np.any(is_valid, axis=1))[0]:
+            spans.setdefault((starts[i_muscle], stops[i_muscle]), []).append(i_muscle)
+
+        for (start, stop), muscles in spans.items():
+            if stop - start <= padlen:
+                # Too short to be filtered, the envelope stays NaN
+                continue
+            emg_processed = emg[muscles, start:stop]
+            frames = np.arange(stop - start)
+            for i_muscle in np.where(np.any(np.isnan(emg_processed), axis=1))[0]:
+                non_nan_idx = ~np.isnan(emg_processed[i_muscle, :])
+                emg_processed[i_muscle, :] = np.interp(
+                    frames, frames[non_nan_idx], emg_processed[i_muscle, non_nan_idx]
+                )
+            emg_processed = filtfilt(b_band_pass, a_band_pass, emg_processed, axis=1)
+            emg_processed -= np.mean(emg_processed, axis=1, keepdims=True)
+            emg_processed = np.abs(emg_processed)
+            emg_envelope[muscles, start:stop] = filtfilt(b_low_pass, a_low_pass, emg_processed, axis=1)
+        return emg_envelope
 
     @staticmethod
     def from_marker_frame_to_analog_frame(
@@ -112,6 +419,7 @@ class Operator:
     ) -> int | list[int] | np.ndarray[int]:
         """
         This function converts a marker frame index into an analog frame index since the analogs are sampled at a higher frequency than the markers.
+        When several conversions are needed, prefer the TimeBase of the ExperimentalData (which is only created once).
         .
         Parameters
         ----------
@@ -127,21 +435,8 @@ class Operator:
         analog_idx: int | list[int] | np.ndarray[int]
             The analog frame index
         """
-        analog_to_marker_ratio = int(round(analogs_time_vector.shape[0] / markers_time_vector.shape[0]))
-        all_idx = list(range(0, len(analogs_time_vector), analog_to_marker_ratio))
-        if isinstance(marker_idx, int):
-            analog_idx = all_idx[marker_idx]
-        elif isinstance(marker_idx, list):
-            analog_idx = [all_idx[idx] for idx in marker_idx]
-        elif isinstance(marker_idx, np.ndarray):
-            if len(marker_idx.shape) != 1:
-                raise ValueError("marker_idx must be a 1D numpy array.")
-            analog_idx = np.zeros_like(marker_idx).astype(int)
-            for i_idx in range(marker_idx.shape[0]):
-                analog_idx[i_idx] = all_idx[marker_idx[i_idx]]
-        else:
-            raise ValueError("marker_idx must be an int or a list of int or a np.ndarray of int.")
-        return analog_idx
+        time_base = TimeBase.from_time_vectors(analogs_time_vector, markers_time_vector)
+        return time_base.marker_to_analog_frame(marker_idx)
 
     @staticmethod
     def from_analog_frame_to_marker_frame(
@@ -149,6 +444,7 @@ class Operator:
     ) -> int | list[int] | np.ndarray[int]:
         """
         This function converts an analog frame index into a marker frame index since the analogs are sampled at a higher frequency than the markers.
+        When several conversions are needed, prefer the TimeBase of the ExperimentalData (which is only created once).
         .
         Parameters
         ----------
@@ -164,17 +460,5 @@ class Operator:
         marker_idx: int | list[int] | np.ndarray[int]
             The marker frame index
         """
-        analog_to_marker_ratio = int(round(analogs_time_vector.shape[0] / markers_time_vector.shape[0]))
-        if isinstance(analog_idx, int):
-            marker_idx = int(round(analog_idx / analog_to_marker_ratio))
-        elif isinstance(analog_idx, list):
-            marker_idx = [int(round(idx / analog_to_marker_ratio)) for idx in analog_idx]
-        elif isinstance(analog_idx, np.ndarray):
-            if len(analog_idx.shape) != 1:
-                raise ValueError("analog_idx must be a 1D numpy array.")
-            marker_idx = np.zeros_like(analog_idx).astype(int)
-            for i_idx in range(analog_idx.shape[0]):
-                marker_idx[i_idx] = int(np.round(analog_idx[i_idx] / analog_to_marker_ratio))
-        else:
-            raise ValueError("analog_idx must be an int or a list of int or a np.ndarray of int.")
-        return marker_idx
+        time_base = TimeBase.from_time_vectors(analogs_time_vector, markers_time_vector)
+        return time_base.analog_to_marker_frame(analog_idx)
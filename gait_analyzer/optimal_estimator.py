@@ -1,8 +1,8 @@
 import os
 import pickle
+from copy import deepcopy
 import numpy as np
 import casadi as cas
-import biorbd
 import biobuddy
 
 try:
@@ -10,13 +10,14 @@ try:
 except ImportError:
     print("Skipped Bioptim import as it is not installed")
 
-from gait_analyzer.operator import Operator
 from gait_analyzer.model_creator import ModelCreator
 from gait_analyzer.kinematics_reconstructor import KinematicsReconstructor
 from gait_analyzer.inverse_dynamics_performer import InverseDynamicsPerformer
 from gait_analyzer.experimental_data import ExperimentalData
 from gait_analyzer.events.cyclic_events import CyclicEvents
 from gait_analyzer.subject import Subject
+from gait_analyzer.utils.stage_cache import StageCache
+from gait_analyzer.utils.model_registry import ModelRegistry
 
 
 class OptimalEstimator:
@@ -39,6 +40,8 @@ class OptimalEstimator:
         plot_solution_flag: bool,
         animate_solution_flag: bool,
         skip_if_existing: bool,
+        nb_threads: int = 10,
+        show_online_optim_flag: bool = True,
     ):
         """
         Initialize the OptimalEstimator.
@@ -67,6 +70,10 @@ class OptimalEstimator:
         skip_if_existing: bool
             If True, the optimal estimation will be skipped if the results already exist.
             If False, the optimal estimation will be performed even if the results already exist.
+        nb_threads: int
+            The number of threads used by the OCP to evaluate the dynamics of the nodes.
+        show_online_optim_flag: bool
+            If True, the convergence of the optimization is plotted while it is solved.
         """
 
         # Checks
@@ -84,6 +91,10 @@ class OptimalEstimator:
             raise ValueError("kinematics_reconstructor must be a KinematicsReconstructor")
         if not isinstance(inverse_dynamic_performer, InverseDynamicsPerformer):
             raise ValueError("inverse_dynamic_performer must be a InverseDynamicsPerformer")
+        if not isinstance(nb_threads, int) or nb_threads < 1:
+            raise ValueError("nb_threads must be a positive integer")
+        if not isinstance(show_online_optim_flag, bool):
+            raise ValueError("show_online_optim_flag must be a boolean")
 
         # Initial attributes
         self.cycle_to_analyze = cycle_to_analyze
@@ -93,6 +104,8 @@ class OptimalEstimator:
         self.events = events
         self.kinematics_reconstructor = kinematics_reconstructor
         self.inverse_dynamic_performer = inverse_dynamic_performer
+        self.nb_threads = nb_threads
+        self.show_online_optim_flag = show_online_optim_flag
 
         # Extended attributes
         self.ocp = None
@@ -116,6 +129,13 @@ class OptimalEstimator:
         self.opt_status = "CVG"
         self.muscle_forces = None
         self.is_loaded_optimal_solution = False
+        self.input_hash = StageCache.hash_inputs(
+            self.cycle_to_analyze,
+            self.model_creator.input_hash,
+            self.events.input_hash,
+            self.kinematics_reconstructor.input_hash,
+            self.inverse_dynamic_performer.input_hash,
+        )
 
         # Execution
         if skip_if_existing and self.check_if_existing():
@@ -124,10 +144,12 @@ class OptimalEstimator:
         else:
             print("Performing optimal estimation...")
 
-            self.generate_no_contacts_model()
-            self.prepare_reduced_experimental_data(plot_exp_data_flag=False, animate_exp_data_flag=True)
+            self.generate_no_contacts_model(self.model_creator.biorbd_model_full_path)
+            self.prepare_reduced_experimental_data(
+                plot_exp_data_flag=False, animate_exp_data_flag=animate_solution_flag
+            )
             self.prepare_ocp_fext(with_residual_forces=True)
-            self.solve(show_online_optim=True)
+            self.solve(show_online_optim=self.show_online_optim_flag)
             self.extract_muscle_forces()
             self.save_optimal_reconstruction()
 
@@ -140,7 +162,18 @@ class OptimalEstimator:
         if animate_solution_flag:
             self.animate_solution()
 
-    def generate_no_contacts_model(self):
+    @staticmethod
+    def generate_no_contacts_model(biorbd_model_full_path: str):
+        """
+        Generate the model without the DoFs of the toes and hands used by the OCP.
+        The model is only generated again if the original model was modified since, so that the estimations of
+        several cycles running concurrently do not rewrite it.
+        """
+        no_contact_model_full_path = biorbd_model_full_path.replace(".bioMod", "_no_contacts.bioMod")
+        if os.path.exists(no_contact_model_full_path) and os.path.getmtime(
+            no_contact_model_full_path
+        ) >= os.path.getmtime(biorbd_model_full_path):
+            return
 
         segments_to_remove_dofs_from = [
             "toes_r_rotation_transform",
@@ -153,7 +186,8 @@ class OptimalEstimator:
             "fingers_l_rotation_transform",
         ]
 
-        no_contact_model = biobuddy.BiomechanicalModelReal().from_biomod(self.model_creator.biorbd_model_full_path)
+        # The model of the registry is shared, so it is copied before removing the DoFs
+        no_contact_model = deepcopy(ModelRegistry.get_biobuddy_model(biorbd_model_full_path, "optimal_estimator"))
         for segment in no_contact_model.segments:
             if segment.name in segments_to_remove_dofs_from:
                 segment.rotations = biobuddy.Rotations.NONE
@@ -162,7 +196,7 @@ class OptimalEstimator:
                 segment.q_ranges = None
                 segment.qdot_ranges = None
 
-        no_contact_model.to_biomod(self.model_creator.biorbd_model_full_path.replace(".bioMod", "_no_contacts.bioMod"))
+        no_contact_model.to_biomod(no_contact_model_full_path)
 
     def prepare_reduced_experimental_data(self, plot_exp_data_flag: bool = False, animate_exp_data_flag: bool = False):
         """
@@ -171,18 +205,14 @@ class OptimalEstimator:
         """
         # self.model_ocp = self.biorbd_model_path.replace(".bioMod", "_heelL_toesL.bioMod")
         self.model_ocp = self.model_creator.biorbd_model_full_path.replace(".bioMod", "_no_contacts.bioMod")
-        model = biorbd.Model(self.model_ocp)
+        model = ModelRegistry.get_biorbd_model(self.model_ocp, "optimal_estimator")
 
         # One full cycle
         cycle_timings = self.events.events["right_leg_heel_touch"]
         this_sequence_analogs = list(
             range(cycle_timings[self.cycle_to_analyze], cycle_timings[self.cycle_to_analyze + 1])
         )
-        this_sequence_markers = Operator.from_analog_frame_to_marker_frame(
-            analogs_time_vector=self.experimental_data.analogs_time_vector,
-            markers_time_vector=self.experimental_data.markers_time_vector,
-            analog_idx=this_sequence_analogs,
-        )
+        this_sequence_markers = self.experimental_data.time_base.analog_to_marker_frame(this_sequence_analogs)
 
         # Skipping some frames to lighten the OCP
         marker_start = this_sequence_markers[0]
@@ -250,12 +280,8 @@ class OptimalEstimator:
         muscle_names = [m.to_string() for m in model.muscleNames()]
         nb_muscles = len(muscle_names)
         self.emg_normalized_exp_ocp = np.zeros((nb_muscles, self.n_shooting + 1))
-        for i_frame, marker_frame in enumerate(idx_to_keep):
-            idx_analogs = Operator.from_marker_frame_to_analog_frame(
-                analogs_time_vector=self.experimental_data.analogs_time_vector,
-                markers_time_vector=self.experimental_data.markers_time_vector,
-                marker_idx=int(marker_frame),
-            )
+        all_idx_analogs = self.experimental_data.time_base.marker_to_analog_frame(idx_to_keep)
+        for i_frame, idx_analogs in enumerate(all_idx_analogs):
             self.f_ext_exp_ocp["left_leg"][:, i_frame] = np.mean(
                 self.experimental_data.f_ext_sorted[0, :, idx_analogs - 5 : idx_analogs + 5], axis=1
             )
@@ -663,7 +689,7 @@ class OptimalEstimator:
             constraints=constraints,
             # phase_transitions=phase_transitions,
             use_sx=False,
-            n_threads=10,
+            n_threads=self.nb_threads,
         )
         ocp.add_plot_penalty()
         ocp.add_plot_ipopt_outputs()
@@ -742,41 +768,39 @@ class OptimalEstimator:
 
     def check_if_existing(self):
         """
-        Check if the events detection already exists.
-        If it exists, load the events.
+        Check if the optimal estimation already exists and was performed with the same inputs.
+        If it exists, load the solution.
         .
         Returns
         -------
         bool
-            If the events detection already exists
+            If the optimal estimation already exists
         """
         result_file_full_path = self.get_result_file_full_path()
-        if os.path.exists(result_file_full_path):
-            with open(result_file_full_path, "rb") as file:
-                data = pickle.load(file)
-                self.model_ocp = data["model_ocp"]
-                self.q_exp_ocp = data["q_exp_ocp"]
-                self.qdot_exp_ocp = data["qdot_exp_ocp"]
-                self.tau_exp_ocp = data["tau_exp_ocp"]
-                self.f_ext_exp_ocp = data["f_ext_exp_ocp"]
-                self.markers_exp_ocp = data["markers_exp_ocp"]
-                self.emg_exp_ocp = data["emg_exp_ocp"]
-                self.n_shooting = data["n_shooting"]
-                self.phase_time = data["phase_time"]
-                self.q_opt = data["q_opt"]
-                self.qdot_opt = data["qdot_opt"]
-                self.tau_opt = data["tau_opt"]
-                self.muscles_opt = data["muscles_opt"]
-                self.f_ext_value_opt = data["f_ext_value_opt"]
-                self.f_ext_position_opt = data["f_ext_position_opt"]
-                self.opt_status = data["opt_status"]
-                self.muscle_forces = data["muscle_forces"]
-            return True
-        else:
+        data = StageCache.load_if_up_to_date(result_file_full_path, self.input_hash)
+        if data is None:
             return False
+        self.model_ocp = data["model_ocp"]
+        self.q_exp_ocp = data["q_exp_ocp"]
+        self.qdot_exp_ocp = data["qdot_exp_ocp"]
+        self.tau_exp_ocp = data["tau_exp_ocp"]
+        self.f_ext_exp_ocp = data["f_ext_exp_ocp"]
+        self.markers_exp_ocp = data["markers_exp_ocp"]
+        self.emg_exp_ocp = data["emg_exp_ocp"]
+        self.n_shooting = data["n_shooting"]
+        self.phase_time = data["phase_time"]
+        self.q_opt = data["q_opt"]
+        self.qdot_opt = data["qdot_opt"]
+        self.tau_opt = data["tau_opt"]
+        self.muscles_opt = data["muscles_opt"]
+        self.f_ext_value_opt = data["f_ext_value_opt"]
+        self.f_ext_position_opt = data["f_ext_position_opt"]
+        self.opt_status = data["opt_status"]
+        self.muscle_forces = data["muscle_forces"]
+        return True
 
     def extract_muscle_forces(self):
-        model = biorbd.Model(self.model_ocp)
+        model = ModelRegistry.get_biorbd_model(self.model_ocp, "optimal_estimator")
         self.muscle_forces = np.zeros((model.nbMuscles(), self.n_shooting))
         for i_frame in range(self.n_shooting):
             muscles = model.stateSet()
@@ -790,7 +814,9 @@ class OptimalEstimator:
         if result_folder is None:
             result_folder = self.experimental_data.result_folder
         trial_name = self.experimental_data.c3d_full_file_path.split("/")[-1][:-4]
-        result_file_full_path = f"{result_folder}/optim_estim_{trial_name}_{self.opt_status}.pkl"
+        result_file_full_path = (
+            f"{result_folder}/optim_estim_{trial_name}_cycle{self.cycle_to_analyze}_{self.opt_status}.pkl"
+        )
         return result_file_full_path
 
     def save_optimal_reconstruction(self):
@@ -798,8 +824,10 @@ class OptimalEstimator:
         Save the optimal estimation reconstruction.
         """
         result_file_full_path = self.get_result_file_full_path()
+        outputs = self.outputs()
+        outputs["input_hash"] = self.input_hash
         with open(result_file_full_path, "wb") as file:
-            pickle.dump(self.outputs(), file)
+            pickle.dump(outputs, file)
 
     def inputs(self):
         return {
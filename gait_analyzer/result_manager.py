@@ -1,20 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
 from gait_analyzer.biomechanics_quantities.angular_momentum_calculator import AngularMomentumCalculator
 from gait_analyzer.model_creator import ModelCreator
 from gait_analyzer.experimental_data import ExperimentalData
 from gait_analyzer.inverse_dynamics_performer import InverseDynamicsPerformer
 from gait_analyzer.events.cyclic_events import CyclicEvents
 from gait_analyzer.events.unique_events import UniqueEvents
-from gait_analyzer.kinematics_reconstructor import KinematicsReconstructor
+from gait_analyzer.kinematics_reconstructor import KinematicsReconstructor, DerivativeMethod
 from gait_analyzer.optimal_estimator import OptimalEstimator
+from gait_analyzer.multi_cycle_optimal_estimator import MultiCycleOptimalEstimator
 from gait_analyzer.subject import Subject, Side
+from gait_analyzer.utils.model_registry import ModelRegistry
 
 
 class ResultManager:
     """
     This class contains all the results from the gait analysis and is the main class handling all types of analysis to perform on the experimental data.
+    Each analysis is a stage whose dependencies are declared in stage_dependencies, so that the stages that do not
+    depend on each other (e.g., the inverse dynamics and the angular momentum) can be run concurrently.
     """
 
-    def __init__(self, subject: Subject, cycles_to_analyze: range, static_trial: str, result_folder: str):
+    # The stages (attribute names) that must be computed before each stage
+    stage_dependencies = {
+        "model_creator": [],
+        # The EMG are processed with the experimental data (ExperimentalData.normalized_emg), not in a stage of their own
+        "experimental_data": ["model_creator"],
+        "events": ["model_creator", "experimental_data"],
+        "kinematics_reconstructor": ["model_creator", "experimental_data", "events"],
+        "inverse_dynamics_performer": ["model_creator", "experimental_data", "kinematics_reconstructor"],
+        "angular_momentum_calculator": ["model_creator", "experimental_data", "kinematics_reconstructor"],
+        "optimal_estimator": [
+            "model_creator",
+            "experimental_data",
+            "events",
+            "kinematics_reconstructor",
+            "inverse_dynamics_performer",
+        ],
+        "multi_cycle_optimal_estimator": [
+            "model_creator",
+            "experimental_data",
+            "events",
+            "kinematics_reconstructor",
+            "inverse_dynamics_performer",
+        ],
+    }
+
+    # The method to call to add each stage
+    stage_methods = {
+        "model_creator": "create_model()",
+        "experimental_data": "add_experimental_data()",
+        "events": "add_cyclic_events() or ResultManager.add_unique_events()",
+        "kinematics_reconstructor": "reconstruct_kinematics()",
+        "inverse_dynamics_performer": "perform_inverse_dynamics()",
+        "angular_momentum_calculator": "compute_angular_momentum()",
+        "optimal_estimator": "estimate_optimally()",
+        "multi_cycle_optimal_estimator": "estimate_optimally_multi_cycle()",
+    }
+
+    def __init__(
+        self,
+        subject: Subject,
+        cycles_to_analyze: range,
+        static_trial: str,
+        result_folder: str,
+        max_workers: int = 1,
+        reuse_existing_model: bool = False,
+    ):
         """
         Initialize the ResultManager.
         .
@@ -28,6 +79,18 @@ class ResultManager:
             The full file path of the static trial ([...]_static.c3d)
         result_folder: str
             The folder where the results will be saved. It will look like result_folder/subject_name.
+        max_workers: int
+            The maximal number of stages to run concurrently.
+            If 1, each stage is computed as soon as its method is called (e.g., ResultManager.reconstruct_kinematics()).
+            If > 1, the stages are only registered when their method is called, and they are computed in threads by
+            ResultManager.run_stages(), each stage being launched as soon as the stages it depends on are done.
+            Please note that the stages are run in threads and not in processes since they share non-picklable
+            biorbd objects (each stage uses its own biorbd.Model though, see ModelRegistry). The biorbd calls keep the
+            GIL (SWIG wrappers), so the threads give little speedup: only the numpy/scipy parts and the file I/O of
+            the stages can overlap. Also, the animations and plots should not be requested when max_workers > 1.
+        reuse_existing_model: bool
+            If True, ResultManager.create_model() uses an existing model created with the same inputs even if its
+            skip_if_existing is False (see the reuse_existing_model argument of analysis_to_perform in AnalysisPerformer).
         """
         # Checks:
         if not isinstance(subject, Subject):
@@ -40,12 +103,18 @@ class ResultManager:
             raise ValueError("static_trial must be a string")
         if not isinstance(result_folder, str):
             raise ValueError("result_folder must be a string")
+        if not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError("max_workers must be a positive integer")
+        if not isinstance(reuse_existing_model, bool):
+            raise ValueError("reuse_existing_model must be a boolean")
 
         # Initial attributes
         self.subject = subject
         self.cycles_to_analyze = cycles_to_analyze
         self.result_folder = result_folder
         self.static_trial = static_trial
+        self.max_workers = max_workers
+        self.reuse_existing_model = reuse_existing_model
 
         # Extended attributes
         self.experimental_data = None
@@ -55,7 +124,78 @@ class ResultManager:
         self.kinematics_reconstructor = None
         self.inverse_dynamics_performer = None
         self.optimal_estimator = None
+        self.multi_cycle_optimal_estimator = None
         self.angular_momentum_calculator = None
+        self.pending_stages = {}
+
+    def add_stage(self, stage_name: str, stage_builder):
+        """
+        Register a stage of the analysis and compute it right away if the stages are not run concurrently.
+        .
+        Parameters
+        ----------
+        stage_name: str
+            The name of the stage (the attribute of the ResultManager where the stage will be stored)
+        stage_builder: Callable
+            The function creating the stage. It is only called once all the stages it depends on are done.
+        """
+        # Checks
+        if getattr(self, stage_name) is not None or stage_name in self.pending_stages:
+            raise Exception(f"{stage_name} was already added to the ResultManager")
+        for dependency in self.stage_dependencies[stage_name]:
+            if getattr(self, dependency) is None and dependency not in self.pending_stages:
+                raise Exception(
+                    f"Please add the {dependency} first by running ResultManager.{self.stage_methods[dependency]}"
+                )
+
+        self.pending_stages[stage_name] = stage_builder
+        if self.max_workers == 1:
+            self.run_stages()
+
+    def get_ready_stages(self) -> list[str]:
+        """
+        Get the pending stages for which all the dependencies were already computed.
+        """
+        return [
+            stage_name
+            for stage_name in self.pending_stages
+            if all(getattr(self, dependency) is not None for dependency in self.stage_dependencies[stage_name])
+        ]
+
+    def run_stages(self):
+        """
+        Compute all the pending stages.
+        If max_workers > 1, the independent stages are run concurrently in threads. Since the biorbd calls keep the GIL,
+        this only gives a small speedup (see max_workers in __init__).
+        """
+        if len(self.pending_stages) == 0:
+            return
+
+        if self.max_workers == 1:
+            while len(self.pending_stages) > 0:
+                ready_stages = self.get_ready_stages()
+                if len(ready_stages) == 0:
+                    raise RuntimeError(
+                        f"The stages {list(self.pending_stages.keys())} cannot be computed since their dependencies are missing."
+                    )
+                stage_name = ready_stages[0]
+                setattr(self, stage_name, self.pending_stages.pop(stage_name)())
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running_stages = {}
+            while len(self.pending_stages) > 0 or len(running_stages) > 0:
+                for stage_name in self.get_ready_stages():
+                    running_stages[executor.submit(self.pending_stages.pop(stage_name))] = stage_name
+                if len(running_stages) == 0:
+                    raise RuntimeError(
+                        f"The stages {list(self.pending_stages.keys())} cannot be computed since their dependencies are missing."
+                    )
+                done, _ = wait(running_stages, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage_name = running_stages.pop(future)
+                    # If the stage failed, the error is raised here
+                    setattr(self, stage_name, future.result())
 
     def create_model(
         self,
@@ -70,23 +210,21 @@ class ResultManager:
         """
         Create and add the biorbd model to the ResultManager
         """
-
-        # Checks
-        if self.model_creator is not None:
-            raise Exception("Biorbd model already added")
-
-        # Add ModelCreator
-        self.model_creator = ModelCreator(
-            subject=self.subject,
-            static_trial=self.static_trial,
-            functional_trials_path=functional_trials_path,
-            mvc_trials_path=mvc_trials_path,
-            models_result_folder=f"{self.result_folder}/models",
-            osim_model_type=osim_model_type,
-            q_regularization_weight=q_regularization_weight,
-            skip_if_existing=skip_if_existing,
-            animate_model_flag=animate_model_flag,
-            vtp_geometry_path=vtp_geometry_path,
+        self.add_stage(
+            "model_creator",
+            lambda: ModelCreator(
+                subject=self.subject,
+                static_trial=self.static_trial,
+                functional_trials_path=functional_trials_path,
+                mvc_trials_path=mvc_trials_path,
+                models_result_folder=f"{self.result_folder}/models",
+                osim_model_type=osim_model_type,
+                q_regularization_weight=q_regularization_weight,
+                skip_if_existing=skip_if_existing,
+                animate_model_flag=animate_model_flag,
+                vtp_geometry_path=vtp_geometry_path,
+                reuse_existing_model=self.reuse_existing_model,
+            ),
         )
 
     def add_experimental_data(
@@ -95,56 +233,39 @@ class ResultManager:
         markers_to_ignore: list[str] = [],
         analogs_to_ignore: list[str] = [],
         animate_c3d_flag: bool = False,
+        c3d_cache_folder: str | None = None,
     ):
-
-        # Checks
-        if self.experimental_data is not None:
-            raise Exception("Experimental data already added")
-        if self.model_creator is None:
-            raise Exception("Please add the biorbd model first by running ResultManager.create_biorbd_model()")
-
-        # Add experimental data
-        self.experimental_data = ExperimentalData(
-            c3d_file_name=c3d_file_name,
-            markers_to_ignore=markers_to_ignore,
-            analogs_to_ignore=analogs_to_ignore,
-            result_folder=self.result_folder,
-            model_creator=self.model_creator,
-            animate_c3d_flag=animate_c3d_flag,
+        self.add_stage(
+            "experimental_data",
+            lambda: ExperimentalData(
+                c3d_file_name=c3d_file_name,
+                markers_to_ignore=markers_to_ignore,
+                analogs_to_ignore=analogs_to_ignore,
+                result_folder=self.result_folder,
+                model_creator=self.model_creator,
+                animate_c3d_flag=animate_c3d_flag,
+                c3d_cache_folder=c3d_cache_folder,
+            ),
         )
 
     def add_cyclic_events(self, force_plate_sides: list[Side], skip_if_existing: bool, plot_phases_flag: bool = False):
-
-        # Checks
-        if self.model_creator is None:
-            raise Exception("Please add the biorbd model first by running ResultManager.create_model()")
-        if self.experimental_data is None:
-            raise Exception("Please add the experimental data first by running ResultManager.add_experimental_data()")
-        if self.events is not None:
-            raise Exception("CyclicEvents or UniqueEvents were already added to the ResultManager")
-
-        # Add events
-        self.events = CyclicEvents(
-            experimental_data=self.experimental_data,
-            force_plate_sides=force_plate_sides,
-            skip_if_existing=skip_if_existing,
-            plot_phases_flag=plot_phases_flag,
+        self.add_stage(
+            "events",
+            lambda: CyclicEvents(
+                experimental_data=self.experimental_data,
+                force_plate_sides=force_plate_sides,
+                skip_if_existing=skip_if_existing,
+                plot_phases_flag=plot_phases_flag,
+            ),
         )
 
     def add_unique_events(self, skip_if_existing: bool, plot_phases_flag: bool = False):
-
-        # Checks
-        if self.model_creator is None:
-            raise Exception("Please add the biorbd model first by running ResultManager.create_model()")
-        if self.experimental_data is None:
-            raise Exception("Please add the experimental data first by running ResultManager.add_experimental_data()")
-        if self.events is not None:
-            raise Exception("CyclicEvents or UniqueEvents were already added to the ResultManager")
-
-        # Add events
-        self.events = UniqueEvents(
-            experimental_data=self.experimental_data,
-            skip_if_existing=skip_if_existing,
+        self.add_stage(
+            "events",
+            lambda: UniqueEvents(
+                experimental_data=self.experimental_data,
+                skip_if_existing=skip_if_existing,
+            ),
         )
 
     def reconstruct_kinematics(
@@ -153,73 +274,65 @@ class ResultManager:
         skip_if_existing: bool = False,
         animate_kinematics_flag: bool = False,
         plot_kinematics_flag: bool = False,
+        n_workers: int = 1,
+        derivative_method: DerivativeMethod = DerivativeMethod.FINITE_DIFFERENCE,
+        max_marker_speed: float = 20,
+        max_distance_deviation: float | None = 0.05,
     ):
-        # Checks
-        if self.model_creator is None:
-            raise Exception("Please add the biorbd model first by running ResultManager.create_model()")
-        if self.experimental_data is None:
-            raise Exception("Please add the experimental data first by running ResultManager.add_experimental_data()")
-        if self.events is None:
-            raise Exception(
-                "Please run the events detection first by running ResultManager.add_cyclic_events() or ResultManager.add_unique_events()"
-            )
-        if self.kinematics_reconstructor is not None:
-            raise Exception("kinematics_reconstructor already added")
-
-        # Reconstruct kinematics
-        self.kinematics_reconstructor = KinematicsReconstructor(
-            self.experimental_data,
-            self.model_creator,
-            self.events,
-            self.cycles_to_analyze,
-            reconstruction_type=reconstruction_type,
-            skip_if_existing=skip_if_existing,
-            animate_kinematics_flag=animate_kinematics_flag,
-            plot_kinematics_flag=plot_kinematics_flag,
+        self.add_stage(
+            "kinematics_reconstructor",
+            lambda: KinematicsReconstructor(
+                self.experimental_data,
+                self.model_creator,
+                self.events,
+                self.cycles_to_analyze,
+                reconstruction_type=reconstruction_type,
+                skip_if_existing=skip_if_existing,
+                animate_kinematics_flag=animate_kinematics_flag,
+                plot_kinematics_flag=plot_kinematics_flag,
+                n_workers=n_workers,
+                derivative_method=derivative_method,
+                max_marker_speed=max_marker_speed,
+                max_distance_deviation=max_distance_deviation,
+            ),
         )
 
     def perform_inverse_dynamics(
-        self, skip_if_existing: bool, reintegrate_flag: bool = True, animate_dynamics_flag: bool = False
+        self,
+        skip_if_existing: bool,
+        reintegrate_flag: bool = True,
+        animate_dynamics_flag: bool = False,
+        batched_flag: bool = False,
+        nb_threads: int = 1,
     ):
-        # Checks
-        if self.model_creator is None:
-            raise Exception("Please add the biorbd model first by running ResultManager.create_model()")
-        if self.experimental_data is None:
-            raise Exception("Please add the experimental data first by running ResultManager.add_experimental_data()")
-        if self.kinematics_reconstructor is None:
-            raise Exception(
-                "Please add the kinematics reconstructor first by running ResultManager.reconstruct_kinematics()"
-            )
-        if self.inverse_dynamics_performer is not None:
-            raise Exception("inverse_dynamics_performer already added")
-
-        # Perform inverse dynamics
-        self.inverse_dynamics_performer = InverseDynamicsPerformer(
-            self.experimental_data,
-            self.kinematics_reconstructor,
-            skip_if_existing=skip_if_existing,
-            reintegrate_flag=reintegrate_flag,
-            animate_dynamics_flag=animate_dynamics_flag,
+        self.add_stage(
+            "inverse_dynamics_performer",
+            lambda: InverseDynamicsPerformer(
+                self.experimental_data,
+                self.kinematics_reconstructor,
+                skip_if_existing=skip_if_existing,
+                reintegrate_flag=reintegrate_flag,
+                animate_dynamics_flag=animate_dynamics_flag,
+                batched_flag=batched_flag,
+                nb_threads=nb_threads,
+            ),
         )
 
-    def compute_angular_momentum(self, skip_if_existing: bool = False):
-        if self.model_creator is None:
-            raise Exception("Please add the biorbd model first by running ResultManager.create_model()")
-        if self.experimental_data is None:
-            raise Exception("Please add the experimental data first by running ResultManager.add_experimental_data()")
-        if self.kinematics_reconstructor is None:
-            raise Exception(
-                "Please add the kinematics reconstructor first by running ResultManager.reconstruct_kinematics()"
-            )
-        if self.angular_momentum_calculator is not None:
-            raise Exception("Angular momentum has already been calculated")
-
-        self.angular_momentum_calculator = AngularMomentumCalculator(
-            self.model_creator.biorbd_model,
-            self.experimental_data,
-            self.kinematics_reconstructor,
-            self.subject,
-            skip_if_existing=skip_if_existing,
+    def compute_angular_momentum(self, skip_if_existing: bool = False, batched_flag: bool = False, nb_threads: int = 1):
+        self.add_stage(
+            "angular_momentum_calculator",
+            lambda: AngularMomentumCalculator(
+                # This stage runs concurrently with the inverse dynamics, so it must not share its model
+                ModelRegistry.get_biorbd_model(
+                    self.model_creator.biorbd_model_full_path, "angular_momentum_calculator"
+                ),
+                self.experimental_data,
+                self.kinematics_reconstructor,
+                self.subject,
+                skip_if_existing=skip_if_existing,
+                batched_flag=batched_flag,
+                nb_threads=nb_threads,
+            ),
         )
 
     def estimate_optimally(
@@ -229,33 +342,41 @@ class ResultManager:
         animate_solution_flag: bool = False,
         skip_if_existing: bool = False,
     ):
+        self.add_stage(
+            "optimal_estimator",
+            lambda: OptimalEstimator(
+                cycle_to_analyze=cycle_to_analyze,
+                subject=self.subject,
+                model_creator=self.model_creator,
+                experimental_data=self.experimental_data,
+                events=self.events,
+                kinematics_reconstructor=self.kinematics_reconstructor,
+                inverse_dynamic_performer=self.inverse_dynamics_performer,
+                plot_solution_flag=plot_solution_flag,
+                animate_solution_flag=animate_solution_flag,
+                skip_if_existing=skip_if_existing,
+            ),
+        )
 
-        # Checks
-        if self.model_creator is None:
-            raise Exception("Please add the biorbd model first by running ResultManager.create_model()")
-        if self.experimental_data is None:
-            raise Exception("Please add the experimental data first by running ResultManager.add_experimental_data()")
-        if self.events is None:
-            raise Exception(
-                "Please run the events detection first by running ResultManager.add_cyclic_events() or ResultManager.add_unique_events()"
-            )
-        if self.kinematics_reconstructor is None:
-            raise Exception(
-                "Please run the kinematics reconstruction first by running ResultManager.estimate_optimally()"
-            )
-        if self.inverse_dynamics_performer is None:
-            raise Exception("Please run the inverse dynamics first by running ResultManager.perform_inverse_dynamics()")
-
-        # Perform the optimal estimation optimization
-        self.optimal_estimator = OptimalEstimator(
-            cycle_to_analyze=cycle_to_analyze,
-            subject=self.subject,
-            model_creator=self.model_creator,
-            experimental_data=self.experimental_data,
-            events=self.events,
-            kinematics_reconstructor=self.kinematics_reconstructor,
-            inverse_dynamic_performer=self.inverse_dynamics_performer,
-            plot_solution_flag=plot_solution_flag,
-            animate_solution_flag=animate_solution_flag,
-            skip_if_existing=skip_if_existing,
+    def estimate_optimally_multi_cycle(
+        self,
+        cycles_to_analyze: list[int] | range,
+        skip_if_existing: bool = False,
+        n_workers: int = 1,
+        nb_threads_per_cycle: int = 1,
+    ):
+        self.add_stage(
+            "multi_cycle_optimal_estimator",
+            lambda: MultiCycleOptimalEstimator(
+                cycles_to_analyze=cycles_to_analyze,
+                subject=self.subject,
+                model_creator=self.model_creator,
+                experimental_data=self.experimental_data,
+                events=self.events,
+                kinematics_reconstructor=self.kinematics_reconstructor,
+                inverse_dynamic_performer=self.inverse_dynamics_performer,
+                skip_if_existing=skip_if_existing,
+                n_workers=n_workers,
+                nb_threads_per_cycle=nb_threads_per_cycle,
+            ),
         )
@@ -5,6 +5,7 @@ import numpy as np
 from gait_analyzer.operator import Operator
 from gait_analyzer.plots.plot_utils import split_cycle, split_cycles, mean_cycles
 from gait_analyzer.plots.plot_utils import EventIndexType, LegToPlot, PlotType
+from gait_analyzer.utils.result_store import ResultStore
 
 
 class OrganizedResult:
@@ -111,8 +112,13 @@ class OrganizedResult:
         condition_name = None
         subject_name = None
         if current_file.endswith("results.pkl"):
-            with open(current_file, "rb") as f:
-                data = pickle.load(f)
+            store_folder = ResultStore.get_store_folder(current_file)
+            if ResultStore.is_up_to_date(store_folder, current_file):
+                # Only the arrays needed are read from the disk (the .pkl is read if it was modified after the store)
+                data = ResultStore.load(store_folder)
+            else:
+                with open(current_file, "rb") as f:
+                    data = pickle.load(f)
             subject_name = data["subject_name"]
             subject_mass = data["subject_mass"]
             condition_name = partial_output_file_name.replace(subject_name, "").replace("_results.pkl", "")
@@ -0,0 +1,175 @@
+import numpy as np
+
+
+class TimeBase:
+    """
+    This class maps the marker frames to the analog frames (and vice versa) of a trial.
+    The analogs are sampled at a higher frequency than the markers, so each marker frame corresponds to
+    analog_to_marker_ratio analog frames. The ratio and the analog frame of each marker frame are computed only once,
+    and the conversions accept int, list or np.ndarray of indices (the same type is returned).
+    """
+
+    def __init__(self, nb_marker_frames: int, nb_analog_frames: int, markers_dt: float, analogs_dt: float):
+        """
+        Initialize the TimeBase.
+        .
+        Parameters
+        ----------
+        nb_marker_frames: int
+            The number of marker frames
+        nb_analog_frames: int
+            The number of analog frames
+        markers_dt: float
+            The time between two marker frames
+        analogs_dt: float
+            The time between two analog frames
+        """
+        # Checks
+        if not isinstance(nb_marker_frames, int) or nb_marker_frames < 1:
+            raise ValueError("nb_marker_frames must be a positive integer")
+        if not isinstance(nb_analog_frames, int) or nb_analog_frames < 1:
+            raise ValueError("nb_analog_frames must be a positive integer")
+
+        # Initial attributes
+        self.nb_marker_frames = nb_marker_frames
+        self.nb_analog_frames = nb_analog_frames
+        self.markers_dt = markers_dt
+        self.analogs_dt = analogs_dt
+
+        # Extended attributes
+        self.analog_to_marker_ratio = int(round(nb_analog_frames / nb_marker_frames))
+        self.analog_frame_of_marker_frames = np.arange(0, nb_analog_frames, self.analog_to_marker_ratio)
+        self.markers_time_vector = np.linspace(0, markers_dt * nb_marker_frames, nb_marker_frames)
+        self.analogs_time_vector = np.linspace(0, analogs_dt * nb_analog_frames, nb_analog_frames)
+
+    @staticmethod
+    def from_time_vectors(analogs_time_vector: np.ndarray, markers_time_vector: np.ndarray) -> "TimeBase":
+        """
+        Create the TimeBase from the time vectors saved in the results.
+        """
+        nb_marker_frames = markers_time_vector.shape[0]
+        nb_analog_frames = analogs_time_vector.shape[0]
+        markers_dt = markers_time_vector[-1] / nb_marker_frames if nb_marker_frames > 1 else 0
+        analogs_dt = analogs_time_vector[-1] / nb_analog_frames if nb_analog_frames > 1 else 0
+        return TimeBase(nb_marker_frames, nb_analog_frames, float(markers_dt), float(analogs_dt))
+
+    @staticmethod
+    def convert(idx: int | list[int] | np.ndarray, converted_idx: np.ndarray, name: str):
+        """
+        Return the converted indices with the same type as the indices to convert.
+        """
+        if isinstance(idx, (int, np.integer)):
+            return int(converted_idx)
+        elif isinstance(idx, (list, range)):
+            return converted_idx.tolist()
+        elif isinstance(idx, np.ndarray):
+            if len(idx.shape) != 1:
+                raise ValueError(f"{name} must be a 1D numpy array.")
+            return converted_idx
+        else:
+            raise ValueError(f"{name} must be an int or a list of int or a np.ndarray of int.")
+
+    def marker_to_analog_frame(self, marker_idx: int | list[int] | np.ndarray) -> int | list[int] | np.ndarray:
+        """
+        Convert marker frame indices into analog frame indices.
+        .
+        Parameters
+        ----------
+        marker_idx: int | list[int] | np.ndarray[int]
+            The marker frame indices to convert
+        .
+        Returns
+        -------
+        analog_idx: int | list[int] | np.ndarray[int]
+            The analog frame indices
+        """
+        if not isinstance(marker_idx, (int, np.integer, list, range, np.ndarray)):
+            raise ValueError("marker_idx must be an int or a list of int or a np.ndarray of int.")
+        analog_idx = self.analog_frame_of_marker_frames[np.asarray(marker_idx, dtype=int)]
+        return TimeBase.convert(marker_idx, analog_idx, "marker_idx")
+
+    def analog_to_marker_frame(self, analog_idx: int | list[int] | np.ndarray) -> int | list[int] | np.ndarray:
+        """
+        Convert analog frame indices into the closest marker frame indices.
+        .
+        Parameters
+        ----------
+        analog_idx: int | list[int] | np.ndarray[int]
+            The analog frame indices to convert
+        .
+        Returns
+        -------
+        marker_idx: int | list[int] | np.ndarray[int]
+            The marker frame indices
+        """
+        if not isinstance(analog_idx, (int, np.integer, list, range, np.ndarray)):
+            raise ValueError("analog_idx must be an int or a list of int or a np.ndarray of int.")
+        marker_idx = np.round(np.asarray(analog_idx) / self.analog_to_marker_ratio).astype(int)
+        return TimeBase.convert(analog_idx, marker_idx, "analog_idx")
+
+    def get_analog_windows(self, marker_idx: int | list[int] | np.ndarray, half_window: int = None) -> np.ndarray:
+        """
+        Get the analog frame indices around each marker frame, [analog_idx - half_window, analog_idx + half_window[.
+        .
+        Parameters
+        ----------
+        marker_idx: int | list[int] | np.ndarray[int]
+            The marker frame indices
+        half_window: int
+            The number of analog frames taken before each marker frame. If None, half of the analog frames of a marker
+            frame time lapse are taken on each side.
+        .
+        Returns
+        -------
+        analog_windows: np.ndarray
+            The analog frame indices (2 * half_window vector for an int, nb_marker_frames x 2 * half_window otherwise)
+        """
+        if half_window is None:
+            half_window = self.analog_to_marker_ratio // 2
+        analog_idx = np.asarray(self.marker_to_analog_frame(marker_idx))
+        return analog_idx[..., np.newaxis] + np.arange(-half_window, half_window)
+
+    def average_over_marker_frames(self, analog_data: np.ndarray, half_window: int = None) -> np.ndarray:
+        """
+        Downsample analog data to the marker frames by averaging the analog frames around each marker frame (the same
+        windows as get_analog_windows). The decimation is computed for all marker frames at once by reshaping the
+        padded data into nb_marker_frames x analog_to_marker_ratio blocks. At the edges of the trial, only the analog
+        frames inside the trial are averaged (the marker frames whose window has no analog frame inside the trial are
+        NaN).
+        .
+        Parameters
+        ----------
+        analog_data: np.ndarray
+            The data sampled at the analog frequency (... x nb_analog_frames)
+        half_window: int
+            The number of analog frames taken before each marker frame. If None, half of the analog frames of a marker
+            frame time lapse are taken on each side.
+        .
+        Returns
+        -------
+        marker_rate_data: np.ndarray
+            The data averaged at the marker frequency (... x nb_marker_frames)
+        """
+        if half_window is None:
+            half_window = self.analog_to_marker_ratio // 2
+        if 2 * half_window > self.analog_to_marker_ratio:
+            raise ValueError(
+                f"The window ({2 * half_window} frames) must not be longer than the analog to marker ratio ({self.analog_to_marker_ratio})."
+            )
+        if analog_data.shape[-1] != self.nb_analog_frames:
+            raise ValueError(f"analog_data must have {self.nb_analog_frames} frames, got {analog_data.shape[-1]}.")
+
+        # The block of the marker frame i starts half_window frames before its analog frame
+        nb_padded_frames = self.nb_marker_frames * self.analog_to_marker_ratio
+        nb_frames_kept = min(self.nb_analog_frames, nb_padded_frames - half_window)
+        padded_data = np.zeros(analog_data.shape[:-1] + (nb_padded_frames,))
+        padded_data[..., half_window : half_window + nb_frames_kept] = analog_data[..., :nb_frames_kept]
+        nb_valid_frames = np.zeros((nb_padded_frames,))
+        nb_valid_frames[half_window : half_window + nb_frames_kept] = 1
+
+        # Only the first 2 * half_window frames of each block are in the window
+        new_shape = analog_data.shape[:-1] + (self.nb_marker_frames, self.analog_to_marker_ratio)
+        data_sum = padded_data.reshape(new_shape)[..., : 2 * half_window].sum(axis=-1)
+        nb_valid_frames = nb_valid_frames.reshape(new_shape[-2:])[:, : 2 * half_window].sum(axis=-1)
+        # The marker frames without analog frames in their window (e.g., a short last window) are NaN
+        return np.where(nb_valid_frames > 0, data_sum / np.maximum(nb_valid_frames, 1), np.nan)
@@ -0,0 +1,279 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+import casadi as cas
+
+
+class BatchedDynamics:
+    """
+    This class builds the symbolic functions of the biomechanical quantities of a model once (using the CasADi backend
+    of biorbd), and evaluates them on all the frames of a trial in a single call (using CasADi's map) instead of
+    calling the biorbd model frame by frame from python.
+    The symbolic functions are built only once per model and per process (the hash of the .bioMod file is part of
+    the key, so a model file that was rewritten is loaded again).
+    """
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_casadi_model(biorbd_model_full_path: str, model_hash: str):
+        """
+        Get the model loaded with the CasADi backend of biorbd.
+        .
+        Parameters
+        ----------
+        biorbd_model_full_path: str
+            The full path of the .bioMod file
+        model_hash: str
+            The hash of the .bioMod file (see StageCache.hash_file)
+        .
+        Returns
+        -------
+        model: biorbd_casadi.Model
+            The symbolic model
+        """
+        try:
+            import biorbd_casadi
+        except ImportError:
+            raise RuntimeError(
+                "The batched evaluation requires the CasADi backend of biorbd (biorbd_casadi), please install it."
+            )
+        return biorbd_casadi.Model(biorbd_model_full_path)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_inverse_dynamics_function(
+        biorbd_model_full_path: str, model_hash: str, platform_segment_names: tuple[str, ...]
+    ):
+        """
+        Get the function computing the generalized forces from q, qdot, qddot, and the external forces.
+        .
+        Parameters
+        ----------
+        biorbd_model_full_path: str
+            The full path of the .bioMod file
+        model_hash: str
+            The hash of the .bioMod file (see StageCache.hash_file)
+        platform_segment_names: tuple[str, ...]
+            The name of the segment on which the external forces of each platform are applied
+        .
+        Returns
+        -------
+        inverse_dynamics: cas.Function
+            The function (q, qdot, qddot, f_ext) -> tau, where f_ext contains the 9 components (CoP, moments, forces)
+            of each platform one after the other
+        """
+        import biorbd_casadi
+
+        model = BatchedDynamics.get_casadi_model(biorbd_model_full_path, model_hash)
+        q = cas.MX.sym("q", model.nbQ(), 1)
+        qdot = cas.MX.sym("qdot", model.nbQdot(), 1)
+        qddot = cas.MX.sym("qddot", model.nbQddot(), 1)
+        f_ext = cas.MX.sym("f_ext", 9 * len(platform_segment_names), 1)
+
+        f_ext_set = model.externalForceSet()
+        for i_platform, segment_name in enumerate(platform_segment_names):
+            platform_f_ext = f_ext[9 * i_platform : 9 * (i_platform + 1)]
+            f_ext_set.add(segment_name, platform_f_ext[3:9], platform_f_ext[:3])
+        tau = model.InverseDynamics(
+            biorbd_casadi.GeneralizedCoordinates(q),
+            biorbd_casadi.GeneralizedVelocity(qdot),
+            biorbd_casadi.GeneralizedAcceleration(qddot),
+            f_ext_set,
+        ).to_mx()
+        return BatchedDynamics.create_function(
+            "inverse_dynamics", [q, qdot, qddot, f_ext], [tau], ["q", "qdot", "qddot", "f_ext"], ["tau"]
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_forward_dynamics_function(
+        biorbd_model_full_path: str, model_hash: str, platform_segment_names: tuple[str, ...]
+    ):
+        """
+        Get the function computing the generalized accelerations from q, qdot, tau, and the external forces.
+        .
+        Parameters
+        ----------
+        biorbd_model_full_path: str
+            The full path of the .bioMod file
+        model_hash: str
+            The hash of the .bioMod file (see StageCache.hash_file)
+        platform_segment_names: tuple[str, ...]
+            The name of the segment on which the external forces of each platform are applied
+        .
+        Returns
+        -------
+        forward_dynamics: cas.Function
+            The function (q, qdot, tau, f_ext) -> qddot, where f_ext contains the 9 components (CoP, moments, forces)
+            of each platform one after the other
+        """
+        import biorbd_casadi
+
+        model = BatchedDynamics.get_casadi_model(biorbd_model_full_path, model_hash)
+        q = cas.MX.sym("q", model.nbQ(), 1)
+        qdot = cas.MX.sym("qdot", model.nbQdot(), 1)
+        tau = cas.MX.sym("tau", model.nbGeneralizedTorque(), 1)
+        f_ext = cas.MX.sym("f_ext", 9 * len(platform_segment_names), 1)
+
+        f_ext_set = model.externalForceSet()
+        for i_platform, segment_name in enumerate(platform_segment_names):
+            platform_f_ext = f_ext[9 * i_platform : 9 * (i_platform + 1)]
+            f_ext_set.add(segment_name, platform_f_ext[3:9], platform_f_ext[:3])
+        qddot = model.ForwardDynamics(
+            biorbd_casadi.GeneralizedCoordinates(q),
+            biorbd_casadi.GeneralizedVelocity(qdot),
+            biorbd_casadi.GeneralizedTorque(tau),
+            f_ext_set,
+        ).to_mx()
+        return BatchedDynamics.create_function(
+            "forward_dynamics", [q, qdot, tau, f_ext], [qddot], ["q", "qdot", "tau", "f_ext"], ["qddot"]
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_angular_momentum_function(biorbd_model_full_path: str, model_hash: str, segment_indices: tuple[int, ...]):
+        """
+        Get the function computing the angular momentum of the whole body and of the segments from q and qdot.
+        .
+        Parameters
+        ----------
+        biorbd_model_full_path: str
+            The full path of the .bioMod file
+        model_hash: str
+            The hash of the .bioMod file (see StageCache.hash_file)
+        segment_indices: tuple[int, ...]
+            The index of the angular momentum of each segment in the output of CalcSegmentsAngularMomentum
+        .
+        Returns
+        -------
+        angular_momentum: cas.Function
+            The function (q, qdot) -> (total_angular_momentum, segments_angular_momentum), where the 3 components of
+            the angular momentum of each segment are stacked one segment after the other
+        """
+        import biorbd_casadi
+
+        model = BatchedDynamics.get_casadi_model(biorbd_model_full_path, model_hash)
+        q = cas.MX.sym("q", model.nbQ(), 1)
+        qdot = cas.MX.sym("qdot", model.nbQdot(), 1)
+        q_biorbd = biorbd_casadi.GeneralizedCoordinates(q)
+        qdot_biorbd = biorbd_casadi.GeneralizedVelocity(qdot)
+
+        total_angular_momentum = model.angularMomentum(q_biorbd, qdot_biorbd, True).to_mx()
+        segments_angular_momentum = model.CalcSegmentsAngularMomentum(q_biorbd, qdot_biorbd, True)
+        segments_angular_momentum = cas.vertcat(*[segments_angular_momentum[i].to_mx() for i in segment_indices])
+        return BatchedDynamics.create_function(
+            "angular_momentum",
+            [q, qdot],
+            [total_angular_momentum, segments_angular_momentum],
+            ["q", "qdot"],
+            ["total_angular_momentum", "segments_angular_momentum"],
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_markers_function(
+        biorbd_model_full_path: str, model_hash: str, marker_indices: tuple[int, ...], dof_indices: tuple[int, ...]
+    ):
+        """
+        Get the function computing the position of some markers and their jacobian with respect to some DoFs.
+        .
+        Parameters
+        ----------
+        biorbd_model_full_path: str
+            The full path of the .bioMod file
+        model_hash: str
+            The hash of the .bioMod file (see StageCache.hash_file)
+        marker_indices: tuple[int, ...]
+            The index of the markers in the model
+        dof_indices: tuple[int, ...]
+            The index of the DoFs with respect to which the jacobian is computed
+        .
+        Returns
+        -------
+        markers: cas.Function
+            The function q -> (markers, markers_jacobian), where the 3 coordinates of the markers are stacked one
+            marker after the other (3 * nb_markers) and the jacobian is 3 * nb_markers x nb_dofs
+        """
+        import biorbd_casadi
+
+        model = BatchedDynamics.get_casadi_model(biorbd_model_full_path, model_hash)
+        q = cas.MX.sym("q", model.nbQ(), 1)
+        all_markers = model.markers(biorbd_casadi.GeneralizedCoordinates(q))
+        markers = cas.vertcat(*[all_markers[i_marker].to_mx() for i_marker in marker_indices])
+        markers_jacobian = cas.jacobian(markers, q)[:, list(dof_indices)]
+        return BatchedDynamics.create_function(
+            "markers", [q], [markers, markers_jacobian], ["q"], ["markers", "markers_jacobian"]
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def get_mapped_function(function: cas.Function, nb_frames: int, nb_threads: int) -> cas.Function:
+        """
+        Get the function mapped over nb_frames frames. Mapping a large function is not negligible, so the mapped
+        functions are kept for the next evaluations of the same number of frames (e.g. the iterations of a solver).
+        """
+        if nb_threads > 1:
+            return function.map(nb_frames, "thread", min(nb_threads, os.cpu_count()))
+        return function.map(nb_frames, "serial")
+
+    @staticmethod
+    def evaluate(function: cas.Function, nb_threads: int, *inputs: np.ndarray) -> np.ndarray | tuple[np.ndarray, ...]:
+        """
+        Evaluate a function on all the frames at once.
+        .
+        Parameters
+        ----------
+        function: cas.Function
+            The function to evaluate on each frame
+        nb_threads: int
+            The number of threads used to evaluate the frames (1 to evaluate them serially)
+        inputs: np.ndarray
+            The inputs of the function (nb_elements x nb_frames each)
+        .
+        Returns
+        -------
+        outputs: np.ndarray | tuple[np.ndarray, ...]
+            The outputs of the function (nb_elements x nb_frames each)
+        """
+        if not isinstance(nb_threads, int) or nb_threads < 1:
+            raise ValueError("nb_threads must be a positive integer")
+        mapped_function = BatchedDynamics.get_mapped_function(function, inputs[0].shape[1], nb_threads)
+
+        # The inputs and outputs are read and written directly in the memory of numpy arrays (converting large DM is
+        # much slower than the evaluation itself). CasADi stores the matrices column by column, hence the transpositions.
+        buffer, evaluate_buffer = mapped_function.buffer()
+        inputs = [np.ascontiguousarray(np.asarray(value, dtype=float).T) for value in inputs]
+        for i_input, value in enumerate(inputs):
+            if value.T.shape != mapped_function.size_in(i_input):
+                raise ValueError(
+                    f"The input {function.name_in(i_input)} must be of shape {function.size_in(i_input)[0]} x nb_frames, "
+                    f"got {value.T.shape}."
+                )
+            buffer.set_arg(i_input, memoryview(value))
+        outputs = []
+        for i_output in range(mapped_function.n_out()):
+            nb_rows, nb_columns = mapped_function.size_out(i_output)
+            output = np.zeros((nb_columns, nb_rows))
+            buffer.set_res(i_output, memoryview(output))
+            outputs += [output]
+        evaluate_buffer()
+
+        if len(outputs) == 1:
+            return outputs[0].T
+        return tuple(output.T for output in outputs)
+
+    @staticmethod
+    def create_function(
+        name: str, inputs: list[cas.MX], outputs: list[cas.MX], input_names: list[str], output_names: list[str]
+    ) -> cas.Function:
+        """
+        Create a function with dense outputs (so that they can be written in numpy arrays by evaluate), expanded to SX
+        when possible since it is much faster to evaluate.
+        """
+        function = cas.Function(name, inputs, [cas.densify(output) for output in outputs], input_names, output_names)
+        try:
+            return function.expand()
+        except RuntimeError:
+            # Some operations cannot be expanded, the function is then evaluated as MX
+            return function
@@ -0,0 +1,87 @@
+import os
+
+import ezc3d
+import numpy as np
+
+from gait_analyzer.utils.stage_cache import StageCache
+from gait_analyzer.utils.result_store import ResultStore
+
+
+class C3dCache:
+    """
+    This class reads the data needed from a c3d file (markers, analogs, force platforms, and sampling metadata).
+    If a cache folder is provided, the parsed arrays are saved in a sub-folder named after the hash of the content of
+    the c3d file, and are memory-mapped on the next runs instead of parsing the c3d file again with ezc3d.
+    Since the cache is keyed by the content of the c3d file, a modified c3d file is automatically parsed again.
+    """
+
+    @staticmethod
+    def read_c3d(c3d_full_file_path: str) -> dict:
+        """
+        Parse a c3d file with ezc3d (including the force platform extraction).
+        .
+        Parameters
+        ----------
+        c3d_full_file_path: str
+            The full path of the c3d file to read
+        .
+        Returns
+        -------
+        c3d_data: dict
+            The data needed from the c3d file. The platform data are stacked on the first axis.
+        """
+        c3d = ezc3d.c3d(c3d_full_file_path, extract_forceplat_data=True)
+        platforms = c3d["data"]["platform"]
+        nb_analog_frames = c3d["data"]["analogs"].shape[2]
+        c3d_data = {
+            "points": c3d["data"]["points"][:3, :, :],
+            "point_labels": list(c3d["parameters"]["POINT"]["LABELS"]["value"]),
+            "point_units": c3d["parameters"]["POINT"]["UNITS"]["value"][0],
+            "point_rate": float(c3d["parameters"]["POINT"]["RATE"]["value"][0]),
+            "point_frame_rate": float(c3d["header"]["points"]["frame_rate"]),
+            "analogs": c3d["data"]["analogs"][0, :, :],
+            "analog_labels": list(c3d["parameters"]["ANALOG"]["LABELS"]["value"]),
+            "analog_units": list(c3d["parameters"]["ANALOG"]["UNITS"]["value"]),
+            "analog_rate": float(c3d["parameters"]["ANALOG"]["RATE"]["value"][0]),
+            "analog_frame_rate": float(c3d["header"]["analogs"]["frame_rate"]),
+            "platform_force": np.zeros((len(platforms), 3, nb_analog_frames)),
+            "platform_moment": np.zeros((len(platforms), 3, nb_analog_frames)),
+            "platform_tz": np.zeros((len(platforms), 3, nb_analog_frames)),
+            "platform_center_of_pressure": np.zeros((len(platforms), 3, nb_analog_frames)),
+            "platform_corners": np.zeros((len(platforms), 3, 4)),
+        }
+        for i_platform, platform in enumerate(platforms):
+            c3d_data["platform_force"][i_platform, :, :] = platform["force"]
+            c3d_data["platform_moment"][i_platform, :, :] = platform["moment"]
+            c3d_data["platform_tz"][i_platform, :, :] = platform["Tz"]
+            c3d_data["platform_center_of_pressure"][i_platform, :, :] = platform["center_of_pressure"]
+            c3d_data["platform_corners"][i_platform, :, :] = platform["corners"]
+        return c3d_data
+
+    @staticmethod
+    def load(c3d_full_file_path: str, cache_folder: str | None) -> dict:
+        """
+        Get the data needed from a c3d file, using the cache if possible.
+        .
+        Parameters
+        ----------
+        c3d_full_file_path: str
+            The full path of the c3d file to read
+        cache_folder: str | None
+            The folder where the parsed c3d files are cached. If None, the c3d file is parsed without caching.
+        .
+        Returns
+        -------
+        c3d_data: dict
+            The data needed from the c3d file (the arrays are read-only when loaded from the cache)
+        """
+        if cache_folder is None:
+            return C3dCache.read_c3d(c3d_full_file_path)
+
+        c3d_name = os.path.basename(c3d_full_file_path)[:-4]
+        store_folder = os.path.join(cache_folder, f"{c3d_name}_{StageCache.hash_file(c3d_full_file_path)}")
+        if not ResultStore.exists(store_folder):
+            os.makedirs(cache_folder, exist_ok=True)
+            # Another process may cache the same c3d file at the same time, the first store written is kept
+            ResultStore.save(C3dCache.read_c3d(c3d_full_file_path), store_folder, overwrite=False)
+        return dict(ResultStore.load(store_folder))
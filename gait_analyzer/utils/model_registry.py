@@ -0,0 +1,99 @@
+import os
+import threading
+from typing import Any, Callable
+
+import biorbd
+import biobuddy
+
+
+class ModelRegistry:
+    """
+    This class keeps the models already parsed in this process, so that the same .bioMod is not parsed again by each
+    trial of the same subject.
+    The models hold mutable states (e.g., the kinematics computed last, the external forces, the muscle states), so
+    each stage of the analysis gets its own instance, which is never handed to another stage (two stages running in
+    concurrent threads never share a model). The instance of a stage is reused by the same stage of the next trials.
+    The models are keyed by the path and the modification time of the file, so a model file that was rewritten (e.g.,
+    by ModelCreator) is parsed again.
+    """
+
+    # The models already parsed in this process {(file_path, model_type, stage_name): (modification_time, size, model)}
+    models = {}
+    nb_hits = 0
+    nb_misses = 0
+    lock = threading.Lock()
+
+    @staticmethod
+    def get_model(model_full_path: str, model_type: str, stage_name: str, loader: Callable[[str], Any]) -> Any:
+        """
+        Get the model of a stage, parsing the file only if it was not already parsed for this stage since its last
+        modification.
+        .
+        Parameters
+        ----------
+        model_full_path: str
+            The full path of the model file
+        model_type: str
+            The name of the type of model (the same file can be parsed as different types of models)
+        stage_name: str
+            The name of the stage using the model (e.g., "kinematics_reconstructor"), each stage gets its own instance
+        loader: Callable[[str], Any]
+            The function parsing the model file
+        .
+        Returns
+        -------
+        model: Any
+            The parsed model, only used by this stage
+        """
+        stat = os.stat(model_full_path)
+        key = (os.path.abspath(model_full_path), model_type, stage_name)
+        with ModelRegistry.lock:
+            if key in ModelRegistry.models:
+                modification_time, size, model = ModelRegistry.models[key]
+                if modification_time == stat.st_mtime_ns and size == stat.st_size:
+                    ModelRegistry.nb_hits += 1
+                    return model
+            ModelRegistry.nb_misses += 1
+            model = loader(model_full_path)
+            ModelRegistry.models[key] = (stat.st_mtime_ns, stat.st_size, model)
+            return model
+
+    @staticmethod
+    def get_biorbd_model(biorbd_model_full_path: str, stage_name: str):
+        """
+        Get the biorbd.Model of a .bioMod file for a stage of the analysis.
+        """
+        return ModelRegistry.get_model(biorbd_model_full_path, "biorbd", stage_name, biorbd.Model)
+
+    @staticmethod
+    def get_biobuddy_model(biorbd_model_full_path: str, stage_name: str):
+        """
+        Get the biobuddy.BiomechanicalModelReal of a .bioMod file for a stage of the analysis.
+        """
+        return ModelRegistry.get_model(
+            biorbd_model_full_path,
+            "biobuddy",
+            stage_name,
+            lambda path: biobuddy.BiomechanicalModelReal().from_biomod(path),
+        )
+
+    @staticmethod
+    def get_statistics() -> dict[str, int]:
+        """
+        Get the number of models handed out without parsing (hits) and with parsing (misses) since the last clear().
+        """
+        return {
+            "nb_hits": ModelRegistry.nb_hits,
+            "nb_misses": ModelRegistry.nb_misses,
+            "nb_models": len(ModelRegistry.models),
+        }
+
+    @staticmethod
+    def clear():
+        """
+        Forget all the models and reset the counters.
+        """
+        with ModelRegistry.lock:
+            ModelRegistry.models.clear()
+            ModelRegistry.nb_hits = 0
+            ModelRegistry.nb_misses = 0
@@ -0,0 +1,118 @@
+import importlib
+from importlib import metadata
+from datetime import datetime
+
+import git
+
+
+class Provenance:
+    """
+    This class collects the provenance information (version of the code and of the packages used) saved along with
+    each result.
+    The versions are collected in-process (package metadata and git repository) only once per process and are then
+    reused for every trial, so saving the results of a trial does not have to call conda or git again.
+    """
+
+    # The packages for which the version is saved {package_name: key_in_the_results}
+    packages_to_report = {
+        "biorbd": "biorbd_version",
+        "pyomeca": "pyomeca_version",
+        "ezc3d": "ezc3d_version",
+        "bioptim": "bioptim_version",
+    }
+
+    # The versions already collected in this process
+    versions = None
+
+    @staticmethod
+    def get_package_version(package_name: str) -> str:
+        """
+        Get the version of an installed package without importing it if possible.
+        Packages installed through conda-forge do not always have python metadata, so the __version__ of the module
+        is used as a fallback.
+        .
+        Parameters
+        ----------
+        package_name: str
+            The name of the package
+        .
+        Returns
+        -------
+        version: str
+            The version of the package or "Not installed"
+        """
+        try:
+            return metadata.version(package_name)
+        except metadata.PackageNotFoundError:
+            pass
+        try:
+            module = importlib.import_module(package_name)
+        except ImportError:
+            return "Not installed"
+        return str(getattr(module, "__version__", "Unknown"))
+
+    @staticmethod
+    def get_git_information() -> dict:
+        """
+        Get the commit, branch and tag of the gait_analyzer repository.
+        """
+        try:
+            repo = git.Repo(search_parent_directories=True)
+        except (git.exc.InvalidGitRepositoryError, git.exc.NoSuchPathError):
+            print("The gait_analyzer git repository was not found, the version of the code will not be saved.")
+            return {
+                "commit_id": "Unknown",
+                "git_date": "Unknown",
+                "branch": "Unknown",
+                "tag": "No tag",
+                "gait_analyzer_version": "Unknown",
+            }
+
+        try:
+            branch = str(repo.active_branch)
+        except TypeError:
+            branch = "Detached HEAD"
+        try:
+            tag = repo.git.describe("--tags")
+        except git.exc.GitCommandError:
+            tag = "No tag"
+        return {
+            "commit_id": str(repo.commit()),
+            "git_date": repo.git.log("-1", "--format=%cd"),
+            "branch": branch,
+            "tag": tag,
+            "gait_analyzer_version": repo.git.version_info,
+        }
+
+    @staticmethod
+    def get_versions() -> dict:
+        """
+        Get the version of the code and of the packages used.
+        They are only collected the first time this method is called in this process.
+        """
+        if Provenance.versions is None:
+            versions = Provenance.get_git_information()
+            for package_name, key in Provenance.packages_to_report.items():
+                versions[key] = Provenance.get_package_version(package_name)
+            Provenance.versions = versions
+        return dict(Provenance.versions)
+
+    @staticmethod
+    def get_provenance(versions: dict = None) -> dict:
+        """
+        Get the provenance information to attach to a result (versions and date of the analysis).
+        .
+        Parameters
+        ----------
+        versions: dict
+            The versions already collected (e.g., by the parent process when the trials are analyzed in parallel).
+            If None, the versions collected in this process are used.
+        .
+        Returns
+        -------
+        provenance: dict
+            The versions and the date of the analysis
+        """
+        provenance = dict(versions) if versions is not None else Provenance.get_versions()
+        provenance["date_of_the_analysis"] = datetime.now().strftime("%b-%d-%Y-%H-%M-%S")
+        return provenance
@@ -0,0 +1,215 @@
+import os
+import json
+import pickle
+import shutil
+import tempfile
+from collections.abc import Mapping
+
+import numpy as np
+
+
+class ResultStore:
+    """
+    This class saves the results of a trial in a columnar format: each numerical array is saved in its own
+    uncompressed .npy file, the other values (names, events, ranges, ...) are saved in a small pickle, and a JSON
+    manifest lists where each result is stored.
+    The readers can then memory-map only the arrays they need (e.g., q_filtered) instead of unpickling all the results
+    (markers, analogs, EMG, f_ext, ...).
+    The nested dictionaries are flattened using "/" in the keys of the manifest (e.g.,
+    "segments_angular_momentum/pelvis"), so the "~" and "/" of the keys are escaped as "~0" and "~1" (as in a JSON
+    pointer).
+    """
+
+    manifest_file_name = "manifest.json"
+    objects_file_name = "objects.pkl"
+
+    @staticmethod
+    def get_store_folder(result_file_name: str) -> str:
+        """
+        Get the folder of the store associated with a result file (with or without the .pkl extension).
+        """
+        if result_file_name.endswith(".pkl"):
+            result_file_name = result_file_name[:-4]
+        return f"{result_file_name}_arrays"
+
+    @staticmethod
+    def escape_key(key: str) -> str:
+        return key.replace("~", "~0").replace("/", "~1")
+
+    @staticmethod
+    def unescape_key(escaped_key: str) -> str:
+        return escaped_key.replace("~1", "/").replace("~0", "~")
+
+    @staticmethod
+    def get_file_stamp(file_path: str) -> dict:
+        stat = os.stat(file_path)
+        return {"modification_time": stat.st_mtime_ns, "size": stat.st_size}
+
+    @staticmethod
+    def is_stored_array(value) -> bool:
+        return isinstance(value, np.ndarray) and value.dtype.kind in "biufc"
+
+    @staticmethod
+    def save(result_dict: dict, store_folder: str, source_file: str | None = None, overwrite: bool = True):
+        """
+        Save the results in the store folder.
+        .
+        Parameters
+        ----------
+        result_dict: dict
+            The results to save (see AnalysisPerformer.save_subject_results)
+        store_folder: str
+            The folder where the results will be saved (it is replaced if it already exists)
+        source_file: str | None
+            The file containing the same results (e.g., the .pkl), its modification time and size are saved in the
+            manifest so that a store older than this file is not used (see is_up_to_date)
+        overwrite: bool
+            If False and the store folder already exists (e.g., it was written by another process in the meantime),
+            the existing store is kept and the new one is discarded
+        """
+        # The store is first written in a temporary folder so that a reader never sees a partially written store. Its
+        # name is unique so that several processes can write the same store at the same time.
+        parent_folder = os.path.dirname(os.path.abspath(store_folder))
+        temporary_folder = tempfile.mkdtemp(prefix=f"{os.path.basename(store_folder)}_tmp_", dir=parent_folder)
+
+        arrays = {}
+        objects = {}
+
+        def add_values(values: dict, prefix: str):
+            for key, value in values.items():
+                full_key = f"{prefix}{ResultStore.escape_key(key)}"
+                if isinstance(value, dict) and len(value) > 0 and all(isinstance(k, str) for k in value.keys()):
+                    add_values(value, prefix=f"{full_key}/")
+                elif ResultStore.is_stored_array(value):
+                    array_file_name = f"array_{len(arrays)}.npy"
+                    np.save(os.path.join(temporary_folder, array_file_name), value)
+                    arrays[full_key] = {"file": array_file_name, "dtype": value.dtype.str, "shape": list(value.shape)}
+                else:
+                    objects[full_key] = value
+
+        add_values(result_dict, prefix="")
+
+        with open(os.path.join(temporary_folder, ResultStore.objects_file_name), "wb") as file:
+            pickle.dump(objects, file)
+        with open(os.path.join(temporary_folder, ResultStore.manifest_file_name), "w") as file:
+            manifest = {"arrays": arrays, "objects": list(objects.keys())}
+            if source_file is not None:
+                manifest["source"] = ResultStore.get_file_stamp(source_file)
+            json.dump(manifest, file, indent=2)
+
+        if os.path.exists(store_folder):
+            if not overwrite:
+                shutil.rmtree(temporary_folder)
+                return
+            shutil.rmtree(store_folder)
+        try:
+            os.rename(temporary_folder, store_folder)
+        except OSError:
+            # Another process wrote the store folder since it was removed
+            shutil.rmtree(temporary_folder)
+            if overwrite or not ResultStore.exists(store_folder):
+                raise
+
+    @staticmethod
+    def exists(store_folder: str) -> bool:
+        return os.path.exists(os.path.join(store_folder, ResultStore.manifest_file_name))
+
+    @staticmethod
+    def is_up_to_date(store_folder: str, source_file: str) -> bool:
+        """
+        Check if the store exists and was saved from the current version of the source file (e.g., the .pkl was not
+        written again without the store since then).
+        .
+        Parameters
+        ----------
+        store_folder: str
+            The folder where the results were saved
+        source_file: str
+            The file containing the same results (see save)
+        .
+        Returns
+        -------
+        bool
+            If the store can be used instead of the source file
+        """
+        if not ResultStore.exists(store_folder):
+            return False
+        with open(os.path.join(store_folder, ResultStore.manifest_file_name), "r") as file:
+            manifest = json.load(file)
+        return manifest.get("source") == ResultStore.get_file_stamp(source_file)
+
+    @staticmethod
+    def load(store_folder: str) -> "StoredResult":
+        """
+        Open the results saved in a store folder.
+        The arrays are only memory-mapped (read-only) when they are accessed.
+        .
+        Parameters
+        ----------
+        store_folder: str
+            The folder where the results were saved
+        .
+        Returns
+        -------
+        stored_result: StoredResult
+            The results, which can be accessed like the dictionary saved in the .pkl
+        """
+        if not ResultStore.exists(store_folder):
+            raise FileNotFoundError(f"The result store {store_folder} does not exist.")
+        return StoredResult(store_folder)
+
+
+class StoredResult(Mapping):
+    """
+    Read-only access to the results saved by the ResultStore.
+    """
+
+    def __init__(self, store_folder: str):
+        self.store_folder = store_folder
+        with open(os.path.join(store_folder, ResultStore.manifest_file_name), "r") as file:
+            manifest = json.load(file)
+        self.arrays = manifest["arrays"]
+        self.object_keys = manifest["objects"]
+        self.objects = None  # Only loaded if a value that is not an array is accessed
+
+        # The top level keys (the nested dictionaries were flattened using "/")
+        self.keys_list = []
+        for full_key in list(self.arrays.keys()) + self.object_keys:
+            key = ResultStore.unescape_key(full_key.split("/")[0])
+            if key not in self.keys_list:
+                self.keys_list += [key]
+
+    def get_value(self, full_key: str):
+        """
+        Get the value of a flattened key (whose parts are escaped, see ResultStore.escape_key).
+        """
+        if full_key in self.arrays:
+            return np.load(os.path.join(self.store_folder, self.arrays[full_key]["file"]), mmap_mode="r")
+        if full_key in self.object_keys:
+            if self.objects is None:
+                with open(os.path.join(self.store_folder, ResultStore.objects_file_name), "rb") as file:
+                    self.objects = pickle.load(file)
+            return self.objects[full_key]
+
+        # Rebuild the nested dictionary
+        prefix = f"{full_key}/"
+        sub_keys = []
+        for key in list(self.arrays.keys()) + self.object_keys:
+            if key.startswith(prefix):
+                sub_key = key[len(prefix) :].split("/")[0]
+                if sub_key not in sub_keys:
+                    sub_keys += [sub_key]
+        if len(sub_keys) == 0:
+            raise KeyError(full_key)
+        return {ResultStore.unescape_key(sub_key): self.get_value(f"{prefix}{sub_key}") for sub_key in sub_keys}
+
+    def __getitem__(self, key: str):
+        if key not in self.keys_list:
+            raise KeyError(key)
+        return self.get_value(ResultStore.escape_key(key))
+
+    def __iter__(self):
+        return iter(self.keys_list)
+
+    def __len__(self):
+        return len(self.keys_list)
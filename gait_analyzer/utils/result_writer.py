@@ -0,0 +1,150 @@
+import os
+import queue
+import pickle
+import threading
+import traceback
+from scipy.io import savemat
+
+from gait_analyzer.utils.result_store import ResultStore
+
+
+class ResultWriter:
+    """
+    This class saves the results of the trials in a background thread, so that the next trial can be analyzed while
+    the results of the previous one are written (savemat can take tens of seconds on long trials).
+    The errors that occurred while writing are raised by the next call to submit(), flush() or close().
+    """
+
+    def __init__(self, save_mat: bool, save_result_store: bool, max_queued_results: int = 2):
+        """
+        Initialize the ResultWriter and start its thread.
+        .
+        Parameters
+        ----------
+        save_mat: bool
+            If True, the results are also saved in a .mat file
+        save_result_store: bool
+            If True, the results are also saved in a ResultStore
+        max_queued_results: int
+            The maximal number of results waiting to be written (submit() blocks when it is reached to limit the memory used)
+        """
+        # Checks
+        if not isinstance(save_mat, bool):
+            raise ValueError("save_mat must be a boolean")
+        if not isinstance(save_result_store, bool):
+            raise ValueError("save_result_store must be a boolean")
+        if not isinstance(max_queued_results, int) or max_queued_results < 1:
+            raise ValueError("max_queued_results must be a positive integer")
+
+        # Initial attributes
+        self.save_mat = save_mat
+        self.save_result_store = save_result_store
+
+        # Extended attributes
+        self.queue = queue.Queue(maxsize=max_queued_results)
+        self.errors = []  # (result_file_name, traceback)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def write(result_dict: dict, result_file_name: str, save_mat: bool, save_result_store: bool):
+        """
+        Save the results of a trial.
+        .
+        Parameters
+        ----------
+        result_dict: dict
+            The results to save
+        result_file_name: str
+            The name of the file where the results will be saved (without extension)
+        save_mat: bool
+            If True, the results are also saved in a .mat file
+        save_result_store: bool
+            If True, the results are also saved in a ResultStore
+        """
+        # For python analysis
+        with open(result_file_name + ".pkl", "wb") as f:
+            pickle.dump(result_dict, f)
+        # For matlab analysis
+        if save_mat:
+            savemat(result_file_name + ".mat", result_dict)
+        # For reading only some of the arrays
+        if save_result_store:
+            ResultStore.save(
+                result_dict, ResultStore.get_store_folder(result_file_name), source_file=result_file_name + ".pkl"
+            )
+
+    @staticmethod
+    def export_mat_files(result_folder: str):
+        """
+        Create the .mat files of the results that were saved without them (e.g., with save_mat=False).
+        .
+        Parameters
+        ----------
+        result_folder: str
+            The folder containing the results (the subfolders are also explored)
+        """
+        for folder, _, file_names in os.walk(result_folder):
+            for file_name in file_names:
+                if file_name.endswith("_results.pkl"):
+                    result_file_name = os.path.join(folder, file_name[:-4])
+                    if not os.path.exists(result_file_name + ".mat"):
+                        with open(result_file_name + ".pkl", "rb") as f:
+                            result_dict = pickle.load(f)
+                        savemat(result_file_name + ".mat", result_dict)
+                        print(f"Exported {result_file_name}.mat")
+
+    def run(self):
+        """
+        Write the results submitted until None is received.
+        """
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                result_dict, result_file_name = item
+                ResultWriter.write(result_dict, result_file_name, self.save_mat, self.save_result_store)
+            except Exception:
+                self.errors += [(item[1], traceback.format_exc())]
+            finally:
+                self.queue.task_done()
+
+    def submit(self, result_dict: dict, result_file_name: str):
+        """
+        Add results to write.
+        .
+        Parameters
+        ----------
+        result_dict: dict
+            The results to save (they should not be modified afterward)
+        result_file_name: str
+            The name of the file where the results will be saved (without extension)
+        """
+        self.raise_errors()
+        if not self.thread.is_alive():
+            raise RuntimeError("The ResultWriter was already closed.")
+        self.queue.put((result_dict, result_file_name))
+
+    def raise_errors(self):
+        if len(self.errors) > 0:
+            errors = self.errors
+            self.errors = []
+            error_messages = "\n".join(f"{result_file_name}:\n{error}" for result_file_name, error in errors)
+            raise RuntimeError(f"The results of {len(errors)} trial(s) could not be saved.\n{error_messages}")
+
+    def flush(self):
+        """
+        Wait until all the results submitted are written.
+        """
+        self.queue.join()
+        self.raise_errors()
+
+    def close(self):
+        """
+        Write the remaining results and stop the thread.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.raise_errors()
@@ -0,0 +1,140 @@
+import os
+import pickle
+import hashlib
+from enum import Enum
+
+import numpy as np
+
+
+class StageCache:
+    """
+    This class handles the content hashes used to decide if the results of a stage of the analysis can be reused.
+    Each stage hashes its real inputs (file contents, parameters, and the hash of the stages it depends on) and saves
+    this hash along with its results. The results are only reused if the hash of the current inputs is the same, so
+    changing an input (e.g., relabeling a c3d) only recomputes the stages that depend on it.
+    """
+
+    # The file hashes already computed in this process {(file_path, modification_time, size): hash}
+    file_hashes = {}
+
+    @staticmethod
+    def hash_file(file_path: str) -> str:
+        """
+        Hash the content of a file.
+        The hash is memoized as long as the file is not modified, so the same c3d or bioMod is only read once.
+        .
+        Parameters
+        ----------
+        file_path: str
+            The path of the file to hash
+        .
+        Returns
+        -------
+        file_hash: str
+            The sha256 of the content of the file
+        """
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+        if key not in StageCache.file_hashes:
+            sha = hashlib.sha256()
+            with open(file_path, "rb") as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    sha.update(chunk)
+            StageCache.file_hashes[key] = sha.hexdigest()
+        return StageCache.file_hashes[key]
+
+    @staticmethod
+    def hash_folder(folder_path: str, extension: str = ".c3d") -> str:
+        """
+        Hash the name and content of all the files of a folder with a specific extension (e.g., the MVC trials).
+        .
+        Parameters
+        ----------
+        folder_path: str
+            The path of the folder to hash
+        extension: str
+            Only the files with this extension are considered
+        .
+        Returns
+        -------
+        folder_hash: str
+            The sha256 of the names and contents of the files
+        """
+        file_names = sorted(file for file in os.listdir(folder_path) if file.endswith(extension))
+        return StageCache.hash_inputs(
+            *[(file, StageCache.hash_file(os.path.join(folder_path, file))) for file in file_names]
+        )
+
+    @staticmethod
+    def hash_inputs(*inputs) -> str:
+        """
+        Hash the inputs of a stage.
+        .
+        Parameters
+        ----------
+        inputs: Any
+            The inputs to hash (None, bool, int, float, str, np.ndarray, range, Enum, or list/tuple/dict of these)
+        .
+        Returns
+        -------
+        input_hash: str
+            The sha256 of the inputs
+        """
+        sha = hashlib.sha256()
+        for value in inputs:
+            StageCache.update_hash(sha, value)
+        return sha.hexdigest()
+
+    @staticmethod
+    def update_hash(sha, value):
+        """
+        Add a value to the hash (the type of the value is hashed too so that 1 and "1" have different hashes).
+        """
+        if value is None or isinstance(value, (bool, int, float, str, np.integer, np.floating)):
+            sha.update(f"{type(value).__name__}:{value!r};".encode())
+        elif isinstance(value, np.ndarray):
+            sha.update(f"ndarray:{value.dtype.str}:{value.shape};".encode())
+            sha.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, range):
+            sha.update(f"range:{value.start}:{value.stop}:{value.step};".encode())
+        elif isinstance(value, Enum):
+            sha.update(f"{type(value).__name__}:{value.value!r};".encode())
+        elif isinstance(value, (list, tuple)):
+            sha.update(f"{type(value).__name__}:{len(value)}[".encode())
+            for element in value:
+                StageCache.update_hash(sha, element)
+            sha.update(b"]")
+        elif isinstance(value, dict):
+            sha.update(f"dict:{len(value)}{{".encode())
+            for key in sorted(value.keys(), key=str):
+                StageCache.update_hash(sha, key)
+                StageCache.update_hash(sha, value[key])
+            sha.update(b"}")
+        else:
+            raise ValueError(f"The input of type {type(value)} cannot be hashed by the StageCache.")
+
+    @staticmethod
+    def load_if_up_to_date(result_file_full_path: str, input_hash: str) -> dict | None:
+        """
+        Load the results of a stage only if they were computed with the same inputs.
+        .
+        Parameters
+        ----------
+        result_file_full_path: str
+            The pickle file where the results of the stage were saved
+        input_hash: str
+            The hash of the current inputs of the stage
+        .
+        Returns
+        -------
+        data: dict | None
+            The results of the stage, or None if they do not exist or if they are outdated
+        """
+        if not os.path.exists(result_file_full_path):
+            return None
+        with open(result_file_full_path, "rb") as file:
+            data = pickle.load(file)
+        if data.get("input_hash") != input_hash:
+            print(f"The inputs used to compute {result_file_full_path} have changed, so it is being recomputed.")
+            return None
+        return data
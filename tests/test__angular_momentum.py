@@ -0,0 +1,109 @@
+import pytest
+import numpy as np
+import numpy.testing as npt
+
+biorbd = pytest.importorskip("biorbd")
+
+from gait_analyzer.biomechanics_quantities.angular_momentum_calculator import AngularMomentumCalculator
+
+# A small model with segments without DoFs between the segments with DoFs (as in the models converted from OpenSim)
+BIOMOD = """version 4
+gravity 0 0 -9.81
+
+segment pelvis
+    translations xyz
+    rotations xyz
+    mass 10
+    com 0 0 0.1
+    inertia
+        0.1 0 0
+        0 0.1 0
+        0 0 0.1
+endsegment
+
+segment thigh_offset
+    parent pelvis
+    rt 0 0 0 xyz 0.1 0 0
+endsegment
+
+segment thigh
+    parent thigh_offset
+    rotations xy
+    mass 7
+    com 0 0 -0.2
+    inertia
+        0.12 0 0
+        0 0.12 0
+        0 0 0.02
+endsegment
+
+segment shank_rotation_transform
+    parent thigh
+    rt 0 0 0 xyz 0 0 -0.4
+endsegment
+
+segment shank
+    parent shank_rotation_transform
+    rotations x
+    mass 3
+    com 0 0 -0.2
+    inertia
+        0.05 0 0
+        0 0.05 0
+        0 0 0.01
+endsegment
+"""
+
+
+def get_calculator(tmp_path, q: np.ndarray, qdot: np.ndarray) -> AngularMomentumCalculator:
+    biorbd_model_full_path = str(tmp_path / "model.bioMod")
+    with open(biorbd_model_full_path, "w") as file:
+        file.write(BIOMOD)
+    # Only the attributes used by the computations are set (the other stages are not needed)
+    calculator = AngularMomentumCalculator.__new__(AngularMomentumCalculator)
+    calculator.model = biorbd.Model(biorbd_model_full_path)
+    calculator.biorbd_model_full_path = biorbd_model_full_path
+    calculator.q = q
+    calculator.qdot = qdot
+    calculator.nb_frames = q.shape[1]
+    calculator.nb_threads = 1
+    return calculator
+
+
+def test_segments_with_dofs(tmp_path):
+    calculator = get_calculator(tmp_path, np.zeros((9, 1)), np.zeros((9, 1)))
+    segment_names, segment_indices = calculator.extract_segments_with_dofs()
+    npt.assert_equal(segment_names, ["pelvis", "thigh", "shank"])
+    npt.assert_equal(segment_indices, [0, 2, 4])
+
+
+def test_segments_angular_momentum(tmp_path):
+    # Only the shank moves, so only the shank has an angular momentum
+    nb_frames = 5
+    q = np.random.default_rng(0).uniform(-0.5, 0.5, (9, nb_frames))
+    qdot = np.zeros((9, nb_frames))
+    qdot[8, :] = 2.0
+    calculator = get_calculator(tmp_path, q, qdot)
+    calculator.compute_segments_angular_momentum()
+    npt.assert_almost_equal(calculator.segments_angular_momentum["pelvis"], 0)
+    npt.assert_almost_equal(calculator.segments_angular_momentum["thigh"], 0)
+    npt.assert_array_less(1e-3, np.linalg.norm(calculator.segments_angular_momentum["shank"], axis=0))
+
+
+def test_batched_angular_momentum(tmp_path):
+    pytest.importorskip("biorbd_casadi")
+    nb_frames = 5
+    rng = np.random.default_rng(0)
+    q = rng.uniform(-0.5, 0.5, (9, nb_frames))
+    qdot = rng.uniform(-2.0, 2.0, (9, nb_frames))
+    calculator = get_calculator(tmp_path, q, qdot)
+    calculator.compute_total_angular_momentum()
+    calculator.compute_segments_angular_momentum()
+    total_angular_momentum = calculator.total_angular_momentum
+    segments_angular_momentum = calculator.segments_angular_momentum
+
+    calculator.compute_batched_angular_momentum()
+    npt.assert_almost_equal(calculator.total_angular_momentum, total_angular_momentum)
+    npt.assert_equal(list(calculator.segments_angular_momentum.keys()), list(segments_angular_momentum.keys()))
+    for segment_name, angular_momentum in segments_angular_momentum.items():
+        npt.assert_almost_equal(calculator.segments_angular_momentum[segment_name], angular_momentum)
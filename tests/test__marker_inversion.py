@@ -0,0 +1,71 @@
+import pytest
+import numpy as np
+import numpy.testing as npt
+
+from gait_analyzer.kinematics_reconstructor import KinematicsReconstructor
+
+
+def get_markers(nb_frames: int = 300, marker_sampling_frequency: float = 100):
+    # Rigid marker clusters translating at 1 m/s
+    rng = np.random.default_rng(0)
+    offsets = rng.uniform(-0.05, 0.05, (3, 69, 1))
+    offsets[:, [0, 1, 2, 3, 49], 0] = np.array(
+        [[0.0, 0.0, 0.0], [0.15, 0.0, 0.0], [0.0, 0.02, 0.0], [0.15, 0.02, 0.0], [0.07, 0.1, 0.0]]
+    ).T
+    translation = np.zeros((3, 1, nb_frames))
+    translation[0, 0, :] = np.arange(nb_frames) / marker_sampling_frequency
+    markers = offsets + translation
+    # A marker missing for a few frames
+    markers[:, 5, 50:60] = np.nan
+    marker_names = [f"marker_{i_marker}" for i_marker in range(69)]
+    return markers, marker_names, marker_sampling_frequency
+
+
+def test_no_marker_inversion():
+    markers, marker_names, marker_sampling_frequency = get_markers()
+    suspect_windows = KinematicsReconstructor.detect_marker_inversions(markers, marker_names, marker_sampling_frequency)
+    npt.assert_equal(len(suspect_windows), 0)
+
+
+def test_marker_jump():
+    markers, marker_names, marker_sampling_frequency = get_markers()
+    markers[2, 30, 200:206] += 0.5
+    suspect_windows = KinematicsReconstructor.detect_marker_inversions(
+        markers, marker_names, marker_sampling_frequency, max_distance_deviation=None
+    )
+    npt.assert_equal(len(suspect_windows), 2)
+    for window, frames in zip(suspect_windows, [range(199, 201), range(205, 207)]):
+        npt.assert_equal(window["check"], "velocity")
+        npt.assert_equal(window["marker_names"], ["marker_30"])
+        npt.assert_equal(window["frames"], frames)
+        npt.assert_almost_equal(window["max_value"], np.sqrt(0.5**2 + 0.01**2) * marker_sampling_frequency)
+
+    # The distances between the head markers are also inconsistent
+    suspect_windows = KinematicsReconstructor.detect_marker_inversions(markers, marker_names, marker_sampling_frequency)
+    distance_windows = [window for window in suspect_windows if window["check"] == "segment_distance"]
+    npt.assert_equal(len(distance_windows), 1)
+    npt.assert_equal(distance_windows[0]["frames"], range(200, 206))
+    assert "marker_30" in distance_windows[0]["marker_names"]
+
+
+def test_marker_swap_within_segment():
+    markers, marker_names, marker_sampling_frequency = get_markers()
+    # The labels of two pelvis markers are swapped, which is too slow to be detected by the velocity check
+    markers[:, [0, 1], 100:120] = markers[:, [1, 0], 100:120]
+    suspect_windows = KinematicsReconstructor.detect_marker_inversions(markers, marker_names, marker_sampling_frequency)
+    npt.assert_equal([window["check"] for window in suspect_windows], ["segment_distance"])
+    npt.assert_equal(suspect_windows[0]["frames"], range(100, 120))
+    assert {"marker_0", "marker_1"}.issubset(suspect_windows[0]["marker_names"])
+
+    # The distance check can be turned off
+    suspect_windows = KinematicsReconstructor.detect_marker_inversions(
+        markers, marker_names, marker_sampling_frequency, max_distance_deviation=None
+    )
+    npt.assert_equal(len(suspect_windows), 0)
+
+
+def test_marker_found_in_less_than_two_frames():
+    markers, marker_names, marker_sampling_frequency = get_markers()
+    markers[:, 7, 1:] = np.nan
+    with pytest.raises(RuntimeError, match="Marker marker_7 was found in less than two frames."):
+        KinematicsReconstructor.detect_marker_inversions(markers, marker_names, marker_sampling_frequency)
@@ -0,0 +1,175 @@
+import pytest
+import numpy as np
+import numpy.testing as npt
+from scipy.signal import savgol_filter, sosfiltfilt
+
+from gait_analyzer.operator import Operator
+
+
+def get_sinusoids(sampling_rate: float = 100, duration: float = 5):
+    t = np.arange(int(duration * sampling_rate)) / sampling_rate
+    amplitudes = np.array([[0.5], [0.2]])
+    pulsations = 2 * np.pi * np.array([[1.0], [2.0]])
+    q = amplitudes * np.sin(pulsations * t)
+    qdot = amplitudes * pulsations * np.cos(pulsations * t)
+    qddot = -amplitudes * pulsations**2 * np.sin(pulsations * t)
+    return t, [q, qdot, qddot]
+
+
+@pytest.mark.parametrize("deriv", [0, 1, 2])
+def test_savgol_derivatives(deriv):
+    sampling_rate = 100
+    t, references = get_sinusoids(sampling_rate)
+    estimate = Operator.apply_savgol(references[0], 11, 3, deriv=deriv, delta=1 / sampling_rate)
+    # The edges are excluded since the fitted polynomials are less accurate there
+    tolerance = 5e-2 * np.max(np.abs(references[deriv]))
+    npt.assert_array_less(np.abs(estimate - references[deriv])[:, 20:-20], tolerance)
+
+
+@pytest.mark.parametrize("deriv", [0, 1, 2])
+def test_smoothing_spline_derivatives(deriv):
+    sampling_rate = 100
+    t, references = get_sinusoids(sampling_rate)
+    estimate = Operator.apply_smoothing_spline(references[0], sampling_rate, cutoff_freq=10, deriv=deriv)
+    tolerance = 5e-2 * np.max(np.abs(references[deriv]))
+    npt.assert_array_less(np.abs(estimate - references[deriv])[:, 20:-20], tolerance)
+
+
+def test_smoothing_spline_cutoff():
+    # The gain of the smoothing spline is 1/2 at the cutoff frequency
+    sampling_rate = 100
+    cutoff_freq = 6
+    t = np.arange(20 * sampling_rate) / sampling_rate
+    signal = np.sin(2 * np.pi * cutoff_freq * t)[np.newaxis, :]
+    filtered_signal = Operator.apply_smoothing_spline(signal, sampling_rate, cutoff_freq)
+    npt.assert_almost_equal(np.max(np.abs(filtered_signal[:, 200:-200])), 0.5, decimal=2)
+
+
+@pytest.mark.parametrize("deriv", [0, 1])
+def test_derivatives_with_gaps(deriv):
+    sampling_rate = 100
+    t, references = get_sinusoids(sampling_rate)
+    q = references[0].copy()
+    q[0, 200:210] = np.nan
+    q[1, 497:] = np.nan
+
+    filters = [
+        lambda data: Operator.apply_savgol(data, 11, 3, deriv=deriv, delta=1 / sampling_rate),
+        lambda data: Operator.apply_smoothing_spline(data, sampling_rate, cutoff_freq=10, deriv=deriv),
+    ]
+    for filter_function in filters:
+        filtered_q = filter_function(q)
+        # The gaps stay NaN and each run of valid frames is processed separately
+        npt.assert_equal(np.isnan(filtered_q), np.isnan(q))
+        npt.assert_almost_equal(filtered_q[:1, :200], filter_function(q[:1, :200]))
+        npt.assert_almost_equal(filtered_q[:1, 210:], filter_function(q[:1, 210:]))
+        npt.assert_almost_equal(filtered_q[1:, :497], filter_function(q[1:, :497]))
+
+
+def get_noisy_data_with_gaps():
+    rng = np.random.default_rng(0)
+    data = np.sin(np.linspace(0, 10, 300))[np.newaxis, :] + rng.normal(0, 0.05, (3, 300))
+    data[0, 100:105] = np.nan
+    # A short run of 2 frames between two gaps
+    data[1, 50:60] = np.nan
+    data[1, 62:70] = np.nan
+    data[2, :] = 1.0
+    return data
+
+
+def test_filtfilt_with_gaps():
+    data = get_noisy_data_with_gaps()
+    filtered_data = Operator.apply_filtfilt(data, order=4, sampling_rate=100, cutoff_freq=6)
+    sos = Operator.get_butter_sos(4, 6.0, 100.0)
+
+    npt.assert_equal(np.isnan(filtered_data), np.isnan(data))
+    # Each run is filtered separately
+    npt.assert_almost_equal(filtered_data[0, :100], sosfiltfilt(sos, data[0, :100]))
+    npt.assert_almost_equal(filtered_data[0, 105:], sosfiltfilt(sos, data[0, 105:]))
+    npt.assert_almost_equal(filtered_data[1, 70:], sosfiltfilt(sos, data[1, 70:]))
+    # The runs too short for the padding of the filter are not filtered
+    npt.assert_almost_equal(filtered_data[1, 60:62], data[1, 60:62])
+    npt.assert_almost_equal(filtered_data[2, :], 1.0)
+
+    # The short gaps can be interpolated before filtering
+    filtered_data = Operator.apply_filtfilt(data, 4, 100, 6, max_gap_to_interpolate=5)
+    assert not np.any(np.isnan(filtered_data[0, :]))
+    npt.assert_equal(np.isnan(filtered_data[1, :]), np.isnan(data[1, :]))
+
+
+def test_savgol_with_gaps():
+    data = get_noisy_data_with_gaps()
+    filtered_data = Operator.apply_savgol(data, window_length=31, polyorder=3)
+
+    npt.assert_equal(np.isnan(filtered_data), np.isnan(data))
+    npt.assert_almost_equal(filtered_data[0, :100], savgol_filter(data[0, :100], 31, 3))
+    npt.assert_almost_equal(filtered_data[0, 105:], savgol_filter(data[0, 105:], 31, 3))
+    # The runs shorter than the window are not filtered (and their derivatives are NaN)
+    npt.assert_almost_equal(filtered_data[1, 60:62], data[1, 60:62])
+    derivative = Operator.apply_savgol(data, window_length=31, polyorder=3, deriv=1, delta=0.01)
+    assert np.all(np.isnan(derivative[1, 60:62]))
+    npt.assert_almost_equal(derivative[2, :], 0.0)
+
+
+def loop_moving_average(x: np.ndarray, window_size: int):
+    # The previous implementation of Operator.moving_average
+    x_averaged = np.zeros_like(x)
+    for i in range(len(x)):
+        if i < window_size // 2:
+            x_averaged[i] = np.mean(x[: i + window_size // 2 + 1])
+        elif i >= len(x) - window_size // 2:
+            x_averaged[i] = np.mean(x[i - window_size // 2 :])
+        else:
+            x_averaged[i] = np.mean(x[i - window_size // 2 : i + window_size // 2 + 1])
+    return x_averaged
+
+
+@pytest.mark.parametrize("window_size", [1, 5, 21])
+@pytest.mark.parametrize("nan_frames", [[], [0], [100], [100, 101, 150], [199]])
+def test_moving_average(window_size, nan_frames):
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(200,))
+    x[nan_frames] = np.nan
+
+    x_averaged = Operator.moving_average(x, window_size)
+    expected = loop_moving_average(x, window_size)
+    npt.assert_almost_equal(x_averaged, expected)
+    # Only the windows containing a NaN are NaN
+    npt.assert_equal(np.isnan(x_averaged), np.isnan(expected))
+
+    # The channels of a 2D array are averaged separately
+    x_2d = np.vstack((x, x[::-1]))
+    x_2d_averaged = Operator.moving_average(x_2d, window_size)
+    npt.assert_almost_equal(x_2d_averaged[0, :], expected)
+    npt.assert_almost_equal(x_2d_averaged[1, :], loop_moving_average(x[::-1], window_size))
+
+
+def test_moving_average_dtype():
+    x = np.arange(50) ** 2
+    x_averaged = Operator.moving_average(x, 5)
+    npt.assert_equal(x_averaged.dtype, x.dtype)
+    npt.assert_equal(x_averaged, loop_moving_average(x, 5))
+    x = np.linspace(0, 1, 50, dtype=np.float32)
+    npt.assert_equal(Operator.moving_average(x, 5).dtype, np.float32)
+    with pytest.raises(ValueError, match="window_size must be an odd number"):
+        Operator.moving_average(x, 4)
+
+
+def test_process_emg_with_missing_data():
+    sampling_rate = 2000
+    rng = np.random.default_rng(0)
+    emg = rng.normal(0, 1, (3, 4000)) * np.abs(np.sin(np.linspace(0, 6 * np.pi, 4000)))
+    emg[0, 1000:1010] = np.nan
+    emg[1, :100] = np.nan
+    emg[1, -50:] = np.nan
+    emg[2, :] = np.nan
+    emg_envelope = Operator.process_emg(emg, sampling_rate=sampling_rate)
+
+    # The missing data inside the signal are interpolated
+    assert not np.any(np.isnan(emg_envelope[0, :]))
+    # The missing data at the beginning and end of the trial stay NaN (they are not set to a zero activation)
+    npt.assert_equal(np.isnan(emg_envelope[1, :]), np.isnan(emg[1, :]))
+    npt.assert_almost_equal(
+        emg_envelope[1, 100:-50], Operator.process_emg(emg[1:2, 100:-50], sampling_rate=sampling_rate)[0, :]
+    )
+    assert np.all(np.isnan(emg_envelope[2, :]))
@@ -0,0 +1,102 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import numpy as np
+import numpy.testing as npt
+
+from gait_analyzer.utils.result_store import ResultStore
+
+
+def get_result_dict():
+    return {
+        "subject_name": "AOT_01",
+        "cycles_to_analyze": range(0, 5),
+        "q_filtered": np.arange(12.0).reshape(3, 4),
+        "events": {"right_leg_heel_touch": np.array([1, 5, 9]), "left_leg_toes_off": [2, 6]},
+        "segments_angular_momentum": {"pelvis": np.ones((3, 4)), "femur_r": {"x": np.zeros((4,))}},
+        "dof_names": ["pelvis_tx", "pelvis_ty"],
+        "a/b": 3,
+        "c~1": np.array([1.0, 2.0]),
+        "nested": {"d/e": {"f~g/h": 4}},
+        "empty_dict": {},
+    }
+
+
+def assert_same_results(loaded, expected):
+    assert isinstance(loaded, dict) or hasattr(loaded, "keys")
+    npt.assert_equal(sorted(loaded.keys()), sorted(expected.keys()))
+    for key, value in expected.items():
+        if isinstance(value, dict) and len(value) > 0:
+            assert_same_results(loaded[key], value)
+        elif isinstance(value, np.ndarray):
+            npt.assert_almost_equal(loaded[key], value)
+            npt.assert_equal(loaded[key].dtype, value.dtype)
+        else:
+            npt.assert_equal(loaded[key], value)
+
+
+def test_result_store_round_trip(tmp_path):
+    store_folder = str(tmp_path / "trial_results_arrays")
+    result_dict = get_result_dict()
+    ResultStore.save(result_dict, store_folder)
+
+    assert ResultStore.exists(store_folder)
+    stored_result = ResultStore.load(store_folder)
+    assert_same_results(stored_result, result_dict)
+    # The keys containing "/" are not split into nested dictionaries
+    npt.assert_equal(stored_result["a/b"], 3)
+    npt.assert_equal(stored_result["nested"], {"d/e": {"f~g/h": 4}})
+    # The arrays are memory-mapped read-only
+    assert isinstance(stored_result["q_filtered"], np.memmap)
+    with pytest.raises(ValueError):
+        stored_result["q_filtered"][0, 0] = 1
+    with pytest.raises(KeyError):
+        stored_result["not_a_key"]
+
+
+def test_result_store_is_up_to_date(tmp_path):
+    result_file_name = str(tmp_path / "trial_results.pkl")
+    store_folder = ResultStore.get_store_folder(result_file_name)
+    with open(result_file_name, "wb") as file:
+        file.write(b"results")
+    assert not ResultStore.is_up_to_date(store_folder, result_file_name)
+
+    ResultStore.save(get_result_dict(), store_folder, source_file=result_file_name)
+    assert ResultStore.is_up_to_date(store_folder, result_file_name)
+
+    # The .pkl written again without the store
+    time.sleep(0.01)
+    with open(result_file_name, "wb") as file:
+        file.write(b"new results")
+    assert not ResultStore.is_up_to_date(store_folder, result_file_name)
+
+    # A store saved without its source file is never considered up to date
+    os.remove(result_file_name)
+    with open(result_file_name, "wb") as file:
+        file.write(b"results")
+    ResultStore.save(get_result_dict(), store_folder)
+    assert not ResultStore.is_up_to_date(store_folder, result_file_name)
+
+
+def test_result_store_concurrent_save(tmp_path):
+    store_folder = str(tmp_path / "trial_arrays")
+    ResultStore.save({"value": np.zeros((2,))}, store_folder)
+
+    # A store which already exists is kept if overwrite is False
+    ResultStore.save({"value": np.ones((2,))}, store_folder, overwrite=False)
+    npt.assert_almost_equal(ResultStore.load(store_folder)["value"], 0)
+
+    # Several writers of a new store do not share a temporary folder, and the first store written is kept
+    store_folder = str(tmp_path / "other_trial_arrays")
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [
+            executor.submit(ResultStore.save, {"value": np.full((100000,), i)}, store_folder, None, False)
+            for i in range(8)
+        ]
+        for future in futures:
+            future.result()
+    npt.assert_equal(sorted(os.listdir(tmp_path)), ["other_trial_arrays", "trial_arrays"])
+    value = ResultStore.load(store_folder)["value"]
+    npt.assert_almost_equal(value, value[0])
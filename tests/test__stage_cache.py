@@ -0,0 +1,85 @@
+import os
+import pickle
+from enum import Enum
+
+import pytest
+import numpy as np
+import numpy.testing as npt
+
+from gait_analyzer.utils.stage_cache import StageCache
+
+
+class Color(Enum):
+    RED = "red"
+    BLUE = "blue"
+
+
+def test_hash_inputs_is_deterministic():
+    inputs = (None, True, 1, 2.5, "abc", np.arange(6).reshape(2, 3), range(2, 10), Color.RED, [1, (2, 3)], {"b": 1})
+    npt.assert_equal(StageCache.hash_inputs(*inputs), StageCache.hash_inputs(*inputs))
+    # The order of the keys of a dict does not matter
+    npt.assert_equal(StageCache.hash_inputs({"a": 1, "b": 2}), StageCache.hash_inputs({"b": 2, "a": 1}))
+
+
+@pytest.mark.parametrize(
+    "first_input, second_input",
+    [
+        (1, "1"),
+        (1, 1.0),
+        (True, 1),
+        (None, "None"),
+        (np.zeros((2, 3)), np.zeros((3, 2))),
+        (np.zeros((2,), dtype=float), np.zeros((2,), dtype=np.float32)),
+        (np.array([1.0, 2.0]), np.array([1.0, 2.1])),
+        (range(0, 10), range(0, 11)),
+        (Color.RED, Color.BLUE),
+        ([1, 2], (1, 2)),
+        ([[1], 2], [1, [2]]),
+        ({"a": 1}, {"a": 2}),
+    ],
+)
+def test_hash_inputs_differs(first_input, second_input):
+    assert StageCache.hash_inputs(first_input) != StageCache.hash_inputs(second_input)
+
+
+def test_hash_inputs_unsupported_type():
+    with pytest.raises(ValueError, match="cannot be hashed by the StageCache"):
+        StageCache.hash_inputs(object())
+
+
+def test_hash_file_and_folder(tmp_path):
+    file_path = str(tmp_path / "trial.c3d")
+    with open(file_path, "wb") as file:
+        file.write(b"first content")
+    first_hash = StageCache.hash_file(file_path)
+    first_folder_hash = StageCache.hash_folder(str(tmp_path))
+    npt.assert_equal(StageCache.hash_file(file_path), first_hash)
+
+    # Files with another extension are ignored
+    with open(str(tmp_path / "notes.txt"), "wb") as file:
+        file.write(b"not a trial")
+    npt.assert_equal(StageCache.hash_folder(str(tmp_path)), first_folder_hash)
+
+    # A modified file has another hash
+    with open(file_path, "wb") as file:
+        file.write(b"second content, longer")
+    assert StageCache.hash_file(file_path) != first_hash
+    assert StageCache.hash_folder(str(tmp_path)) != first_folder_hash
+
+
+def test_load_if_up_to_date(tmp_path):
+    result_file_full_path = str(tmp_path / "results.pkl")
+    input_hash = StageCache.hash_inputs("inputs", 1)
+    assert StageCache.load_if_up_to_date(result_file_full_path, input_hash) is None
+
+    with open(result_file_full_path, "wb") as file:
+        pickle.dump({"q": np.ones((2, 3)), "input_hash": input_hash}, file)
+    data = StageCache.load_if_up_to_date(result_file_full_path, input_hash)
+    npt.assert_almost_equal(data["q"], np.ones((2, 3)))
+
+    # The results computed with other inputs are not reused
+    assert StageCache.load_if_up_to_date(result_file_full_path, StageCache.hash_inputs("inputs", 2)) is None
+    os.remove(result_file_full_path)
+    with open(result_file_full_path, "wb") as file:
+        pickle.dump({"q": np.ones((2, 3))}, file)
+    assert StageCache.load_if_up_to_date(result_file_full_path, input_hash) is None
@@ -0,0 +1,66 @@
+import warnings
+
+import pytest
+import numpy as np
+import numpy.testing as npt
+
+from gait_analyzer.time_base import TimeBase
+
+
+@pytest.fixture
+def time_base():
+    # 10 marker frames at 100 Hz and 100 analog frames at 1000 Hz
+    return TimeBase(nb_marker_frames=10, nb_analog_frames=100, markers_dt=0.01, analogs_dt=0.001)
+
+
+def test_frame_conversions(time_base):
+    npt.assert_equal(time_base.analog_to_marker_ratio, 10)
+    npt.assert_equal(time_base.marker_to_analog_frame(3), 30)
+    npt.assert_equal(time_base.marker_to_analog_frame([0, 3]), [0, 30])
+    npt.assert_equal(time_base.marker_to_analog_frame(np.array([1, 9])), np.array([10, 90]))
+    npt.assert_equal(time_base.analog_to_marker_frame(34), 3)
+    npt.assert_equal(time_base.analog_to_marker_frame([34, 36]), [3, 4])
+    assert isinstance(time_base.marker_to_analog_frame([0, 3]), list)
+    with pytest.raises(ValueError):
+        time_base.marker_to_analog_frame(np.zeros((2, 2), dtype=int))
+
+
+@pytest.mark.parametrize("half_window", [None, 2, 5])
+def test_get_analog_windows(time_base, half_window):
+    analog_windows = time_base.get_analog_windows([0, 4], half_window)
+    expected_half_window = 5 if half_window is None else half_window
+    npt.assert_equal(analog_windows.shape, (2, 2 * expected_half_window))
+    npt.assert_equal(analog_windows[1], np.arange(40 - expected_half_window, 40 + expected_half_window))
+    npt.assert_equal(time_base.get_analog_windows(4, half_window), analog_windows[1])
+
+
+@pytest.mark.parametrize("half_window", [None, 1, 3, 5])
+def test_average_over_marker_frames(time_base, half_window):
+    rng = np.random.default_rng(0)
+    analog_data = rng.normal(size=(3, 2, 100))
+    marker_rate_data = time_base.average_over_marker_frames(analog_data, half_window)
+
+    # Average over the windows of get_analog_windows, keeping only the analog frames inside the trial
+    expected = np.zeros((3, 2, 10))
+    for i_frame, analog_window in enumerate(time_base.get_analog_windows(np.arange(10), half_window)):
+        analog_window = analog_window[(analog_window >= 0) & (analog_window < 100)]
+        expected[..., i_frame] = np.mean(analog_data[..., analog_window], axis=-1)
+    npt.assert_almost_equal(marker_rate_data, expected)
+
+
+def test_average_over_marker_frames_errors(time_base):
+    with pytest.raises(ValueError, match="must not be longer than the analog to marker ratio"):
+        time_base.average_over_marker_frames(np.zeros((100,)), half_window=6)
+    with pytest.raises(ValueError, match="analog_data must have 100 frames"):
+        time_base.average_over_marker_frames(np.zeros((99,)))
+
+
+def test_average_over_marker_frames_without_analog_frames():
+    # The ratio is rounded up (35 / 10 -> 4), so the window of the last marker frame is after the last analog frame
+    time_base = TimeBase(nb_marker_frames=10, nb_analog_frames=35, markers_dt=0.01, analogs_dt=0.01 / 3.5)
+    analog_data = np.arange(35.0)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        marker_rate_data = time_base.average_over_marker_frames(analog_data, half_window=1)
+    npt.assert_almost_equal(marker_rate_data[:-1], [0.0, 3.5, 7.5, 11.5, 15.5, 19.5, 23.5, 27.5, 31.5])
+    assert np.isnan(marker_rate_data[-1])